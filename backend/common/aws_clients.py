@@ -0,0 +1,56 @@
+# AWS Clients
+# Lazily created, shared boto3 clients with one tuned botocore configuration
+
+import os
+import threading
+import boto3
+from botocore.config import Config
+
+# Connections kept per client; raise it for handlers that fan out across threads
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+# Keep-alive holds pooled connections open between invocations of a warm
+# container; standard retry mode adds jittered backoff and retry quotas
+BASE_CONFIG = Config(
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=CONNECT_TIMEOUT,
+    read_timeout=READ_TIMEOUT,
+    retries={'mode': 'standard', 'max_attempts': MAX_ATTEMPTS}
+)
+
+# boto3 sessions aren't thread-safe to build clients from; clients are
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+def get_session():
+    """The process-wide boto3 session, created on first use"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = boto3.session.Session()
+    return _session
+
+def get_client(service_name, **config):
+    """
+    Shared low-level client for service_name, created on first use
+
+    Keyword arguments are botocore Config options layered over BASE_CONFIG,
+    e.g. signature_version='s3v4'. Each distinct set gets its own client.
+    """
+    key = (service_name, tuple(sorted(config.items())))
+    client = _clients.get(key)
+    if client is None:
+        session = get_session()
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client_config = BASE_CONFIG.merge(Config(**config)) if config else BASE_CONFIG
+                client = session.client(service_name, config=client_config)
+                _clients[key] = client
+    return client
@@ -0,0 +1,174 @@
+# Content Index
+# Content-addressed dedup of uploads: one metadata-table item per distinct
+# photo content, naming the objects every copy of that content shares
+
+import os
+import re
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+
+METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
+
+# Index items live in the metadata table under photoId 'hash#<md5 hex>'. They
+# carry no gallery attribute, so list_photos never sees them.
+HASH_PREFIX = 'hash#'
+
+# Attributes copied from the index item into each photo sharing its objects:
+# the objects, what was read from the content's EXIF header, its placeholder
+# and the settings the renditions were made with
+SHARED_ATTRIBUTES = (
+    'photoKey', 'thumbnailKey', 'dimensions', 'thumbnailDimensions', 'renditions',
+    'captureDate', 'orientation', 'exif', 'placeholder', 'processingVersion'
+)
+
+# The photoIds referencing an index item. A set rather than a counter, so a
+# redelivered S3 event can't count the same photo twice.
+REFERENCES = 'references'
+
+# S3 ETags are the MD5 of the content for single-part uploads without SSE-KMS
+PLAIN_ETAG = re.compile(r'^"([0-9a-f]{32})"$')
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+def is_index_id(photo_id):
+    """Whether a photoId names an index item rather than a photo"""
+    return photo_id.startswith(HASH_PREFIX)
+
+def etag_md5(response):
+    """
+    Content MD5 from a get_object/head_object response, or None
+
+    Multipart ETags ('<md5>-<parts>') depend on the part size and SSE-KMS
+    ETags aren't digests at all, so neither can be used.
+    """
+    if response.get('ServerSideEncryption') == 'aws:kms':
+        return None
+    match = PLAIN_ETAG.match(response.get('ETag', ''))
+    return match.group(1) if match else None
+
+def acquire(content_hash, photo_id):
+    """
+    Add photo_id as a reference to existing content
+
+    Returns the shared attributes when the content is already indexed, None
+    when it isn't (the caller renders it and calls register).
+    """
+    try:
+        response = get_client('dynamodb').update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key={'photoId': {'S': HASH_PREFIX + content_hash}},
+            UpdateExpression='ADD #refs :photo',
+            ConditionExpression='attribute_exists(renditions)',
+            ExpressionAttributeNames={'#refs': REFERENCES},
+            ExpressionAttributeValues={':photo': {'SS': [photo_id]}},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    return plain_attributes(response['Attributes'])
+
+def register(content_hash, photo_id, shared):
+    """
+    Index newly rendered content with photo_id as its only reference
+
+    Returns False when a concurrent upload of the same content indexed it
+    first; the caller then keeps its own objects unshared.
+    """
+    item = {name: shared[name] for name in SHARED_ATTRIBUTES if name in shared}
+    item.update({
+        'photoId': HASH_PREFIX + content_hash,
+        'contentHash': content_hash,
+        'sourcePhotoId': photo_id
+    })
+    typed = {name: serializer.serialize(value) for name, value in item.items()}
+    typed[REFERENCES] = {'SS': [photo_id]}
+
+    try:
+        get_client('dynamodb').put_item(
+            TableName=METADATA_TABLE_NAME,
+            Item=typed,
+            ConditionExpression='attribute_not_exists(photoId)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+def replace(content_hash, shared):
+    """
+    Point indexed content at re-rendered objects
+
+    Returns the photoIds referencing it, whose items the caller updates to
+    match, or None when the content is no longer indexed.
+    """
+    names = [name for name in SHARED_ATTRIBUTES if name in shared]
+    try:
+        response = get_client('dynamodb').update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key={'photoId': {'S': HASH_PREFIX + content_hash}},
+            UpdateExpression='SET ' + ', '.join(f'#a{i} = :a{i}' for i in range(len(names))),
+            ConditionExpression='attribute_exists(photoId)',
+            ExpressionAttributeNames={f'#a{i}': name for i, name in enumerate(names)},
+            ExpressionAttributeValues={f':a{i}': serializer.serialize(shared[name]) for i, name in enumerate(names)},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    return response['Attributes'].get(REFERENCES, {}).get('SS', [])
+
+def release(content_hash, photo_ids):
+    """
+    Drop photo_ids' references to shared content
+
+    Returns the shared attributes when the last reference went away and the
+    index item was removed, so the caller deletes the shared objects; None
+    while other photos still use them.
+    """
+    key = {'photoId': {'S': HASH_PREFIX + content_hash}}
+    dynamodb_client = get_client('dynamodb')
+
+    try:
+        response = dynamodb_client.update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key=key,
+            UpdateExpression='DELETE #refs :photos',
+            ConditionExpression='attribute_exists(photoId)',
+            ExpressionAttributeNames={'#refs': REFERENCES},
+            ExpressionAttributeValues={':photos': {'SS': list(photo_ids)}},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            # Index item already gone: whoever removed it owned the cleanup
+            print(f'Content index item {content_hash} not found')
+            return None
+        raise
+
+    if REFERENCES in response['Attributes']:
+        return None
+
+    # DynamoDB drops empty sets. The condition stops this delete if a new
+    # upload acquired the content after the update above.
+    try:
+        dynamodb_client.delete_item(
+            TableName=METADATA_TABLE_NAME,
+            Key=key,
+            ConditionExpression='attribute_not_exists(#refs)',
+            ExpressionAttributeNames={'#refs': REFERENCES}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    return plain_attributes(response['Attributes'])
+
+def plain_attributes(item):
+    """Shared attributes of a typed index item as plain Python values"""
+    return {name: deserializer.deserialize(item[name]) for name in SHARED_ATTRIBUTES if name in item}
@@ -0,0 +1,340 @@
+# Gallery Manifest
+# The gallery listing as a few S3 objects, kept current by the functions that
+# add and remove photos, so list_photos reads it instead of DynamoDB
+
+import gzip
+import json
+import os
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+from instrumentation import count
+import s3_head
+
+MANIFEST_BUCKET_NAME = os.environ.get(
+    'MANIFEST_BUCKET_NAME',
+    os.environ.get('THUMBNAIL_BUCKET_NAME', 'photo-gallery-thumbnails')
+)
+MANIFEST_PREFIX = os.environ.get('MANIFEST_PREFIX', 'manifest/')
+
+# Photos per shard: rebuild writes shards this full, and a shard that grows to
+# twice this is split in two. Each write rewrites the shards it touches, so
+# this bounds the cost of an upload or delete however large the gallery is.
+SHARD_SIZE = int(os.environ.get('MANIFEST_SHARD_SIZE', '1000'))
+
+# Head updates retried on conflict, with jittered backoff
+MAX_WRITE_ATTEMPTS = int(os.environ.get('MANIFEST_MAX_WRITE_ATTEMPTS', '10'))
+
+FORMAT_VERSION = 1
+
+# The head lists the shards newest first, each with the (uploadDate, photoId)
+# of the oldest photo it may hold; the last one holds everything older:
+#   {"version": 1, "shards": [{"key": "manifest/shards/<id>.json.gz",
+#                              "from": ["2024-03-02T10:00:00Z", "<photoId>"]}, ...]}
+# A shard holds its photos newest first, gzip-compressed:
+#   {"version": 1, "photos": [entry, ...]}
+#
+# Shard objects are never modified. A write stores new shards under new keys
+# and swaps them into the head with a conditional PUT, so every change lands
+# in one atomic step and readers can cache shards by key.
+HEAD_KEY = MANIFEST_PREFIX + 'head.json'
+OLDEST = ['', '']
+
+# Manifest entry fields, as copied from a completed metadata item
+ENTRY_FIELDS = (
+    'photoId', 'filename', 'uploadDate', 'fileSize', 'photoKey', 'thumbnailKey',
+    'tags', 'dimensions', 'thumbnailDimensions', 'renditions', 'placeholder', 'sprite'
+)
+
+deserializer = TypeDeserializer()
+
+class ManifestConflict(Exception):
+    """The head kept changing under a write"""
+
+def sort_key(entry):
+    """Entries are ordered newest first by (uploadDate, photoId)"""
+    return entry['uploadDate'], entry['photoId']
+
+def make_entry(item):
+    """Manifest entry for a completed metadata item (plain values; Decimals become ints)"""
+    entry = {name: plain(item[name]) for name in ENTRY_FIELDS if name in item}
+    entry.setdefault('fileSize', 0)
+    entry.setdefault('tags', [])
+    return entry
+
+def plain(value):
+    """JSON-ready copy of a value read from DynamoDB"""
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, (list, set, tuple)):
+        return [plain(v) for v in value]
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+def find_shard(shards, key):
+    """Index of the shard holding the (uploadDate, photoId) key"""
+    for index, shard in enumerate(shards):
+        if tuple(shard['from']) <= key:
+            return index
+    return len(shards) - 1
+
+# Reading
+
+def read_object(key, etag=None):
+    """
+    (document, etag) for a manifest object; (None, None) when it doesn't exist
+
+    With etag, an unchanged object returns (None, etag) without a body.
+    """
+    data, etag = s3_head.fetch(MANIFEST_BUCKET_NAME, key, etag)
+    if data is None:
+        return None, etag
+    count('manifestReads')
+    count('manifestReadBytes', len(data))
+    if key.endswith('.gz'):
+        data = gzip.decompress(data)
+    return json.loads(data), etag
+
+def read_head(etag=None):
+    return read_object(HEAD_KEY, etag)
+
+def read_shard(key):
+    """Photos of a shard; None once it has been replaced and deleted"""
+    document, _ = read_object(key)
+    return document['photos'] if document is not None else None
+
+class ManifestReader:
+    """
+    Pages through the manifest newest first for list_photos
+
+    Lives as long as the warm container. The head is revalidated with a
+    conditional GET on every page; shards never change, so the most recently
+    used ones are served from memory without touching S3.
+    """
+
+    def __init__(self, max_shards=8):
+        self._max_shards = max_shards
+        self._head = None
+        self._head_etag = None
+        # shard key -> (photos newest first, their sort keys oldest first)
+        self._shards = OrderedDict()
+
+    def page(self, limit, after=None):
+        """
+        Up to limit entries older than the (uploadDate, photoId) after
+
+        Returns (entries, last key or None on the final page), or None when
+        there is no manifest yet.
+        """
+        head = self._read_head()
+        if head is None:
+            return None
+        try:
+            return self._page(head['shards'], limit, after)
+        except KeyError:
+            # A shard was replaced after the head was read; read it again
+            self._head_etag = None
+            head = self._read_head()
+            return self._page(head['shards'], limit, after) if head else None
+
+    def _page(self, shards, limit, after):
+        start = find_shard(shards, after) if after else 0
+        entries = []
+        for index in range(start, len(shards)):
+            photos, keys = self._read_shard(shards[index]['key'])
+            # Entries are newest first; skip those at or after the cursor
+            first = len(keys) - bisect_left(keys, after) if after else 0
+            end = first + limit - len(entries)
+            entries.extend(photos[first:end])
+            if len(entries) == limit:
+                more = end < len(photos) or index < len(shards) - 1
+                return entries, sort_key(entries[-1]) if more else None
+        return entries, None
+
+    def _read_head(self):
+        document, etag = read_head(self._head_etag)
+        if etag is None:
+            self._head, self._head_etag = None, None
+        elif document is not None:
+            self._head, self._head_etag = document, etag
+        return self._head
+
+    def _read_shard(self, key):
+        cached = self._shards.get(key)
+        if cached is None:
+            photos = read_shard(key)
+            if photos is None:
+                raise KeyError(key)
+            cached = (photos, [sort_key(entry) for entry in reversed(photos)])
+            self._shards[key] = cached
+            if len(self._shards) > self._max_shards:
+                self._shards.popitem(last=False)
+        self._shards.move_to_end(key)
+        return cached
+
+# Writing
+
+def put_args(key, document):
+    """put_object arguments storing document at key, gzipped for shards"""
+    data = json.dumps(document, separators=(',', ':')).encode('utf-8')
+    args = {
+        'Bucket': MANIFEST_BUCKET_NAME,
+        'Key': key,
+        'ContentType': 'application/json',
+        'CacheControl': 'no-cache'
+    }
+    if key.endswith('.gz'):
+        # Level 1: every upload and delete rewrites a shard, and level 6 only
+        # saves a fifth of the size for four times the CPU
+        data = gzip.compress(data, compresslevel=1)
+        args['ContentEncoding'] = 'gzip'
+    args['Body'] = data
+    return args
+
+def write_shard(photos):
+    """Store photos as a new shard object, returning its key"""
+    key = f'{MANIFEST_PREFIX}shards/{uuid.uuid4().hex}.json.gz'
+    get_client('s3').put_object(**put_args(key, {'version': FORMAT_VERSION, 'photos': photos}))
+    return key
+
+def delete_shards(keys):
+    """Best-effort removal of shard objects the head no longer lists"""
+    if not keys:
+        return
+    try:
+        get_client('s3').delete_objects(
+            Bucket=MANIFEST_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except ClientError as e:
+        print(f'Failed to delete replaced manifest shards: {str(e)}')
+
+def split(photos, lower_bound):
+    """(from, photos) of a shard's replacements: none when empty, two once it reaches twice SHARD_SIZE"""
+    if not photos:
+        return []
+    if len(photos) < 2 * SHARD_SIZE:
+        return [(lower_bound, photos)]
+    middle = len(photos) // 2
+    upper, lower = photos[:middle], photos[middle:]
+    return [(list(sort_key(upper[-1])), upper), (lower_bound, lower)]
+
+def update(add=(), remove=()):
+    """
+    Add entries and remove (uploadDate, photoId) keys in one manifest change
+
+    Only the shards holding them are rewritten. Nothing happens until rebuild
+    has created the head: until then list_photos queries the gallery index,
+    rather than a manifest missing the photos added before.
+    """
+    add_ids = {entry['photoId'] for entry in add}
+
+    def change(head):
+        if head is None:
+            return None
+        shards = head['shards']
+
+        # Changes per shard index; -1 is a first shard for an empty gallery
+        changes = {}
+        for entry in add:
+            index = find_shard(shards, sort_key(entry)) if shards else -1
+            changes.setdefault(index, ([], set()))[0].append(entry)
+        for key in remove:
+            if shards:
+                changes.setdefault(find_shard(shards, tuple(key)), ([], set()))[1].add(key[1])
+
+        replacements = {}
+        written = []
+        for index, (added, removed) in changes.items():
+            if index < 0:
+                photos, lower_bound = [], OLDEST
+            else:
+                photos = read_shard(shards[index]['key'])
+                if photos is None:
+                    # Replaced by a concurrent write since the head was read
+                    return None, written, []
+                lower_bound = shards[index]['from']
+            kept = [entry for entry in photos if entry['photoId'] not in removed | add_ids]
+            if len(kept) == len(photos) and not added:
+                continue
+            replacement = []
+            for bound, part in split(sorted(kept + added, key=sort_key, reverse=True), lower_bound):
+                key = write_shard(part)
+                written.append(key)
+                replacement.append({'key': key, 'from': bound})
+            replacements[index] = replacement
+        if not replacements:
+            return None
+
+        new_shards = replacements.get(-1, [])
+        replaced = []
+        for index, shard in enumerate(shards):
+            if index in replacements:
+                new_shards.extend(replacements[index])
+                replaced.append(shard['key'])
+            else:
+                new_shards.append(shard)
+        # The oldest shard holds everything older than the others, even
+        # after the one that did is emptied
+        if new_shards:
+            new_shards[-1] = dict(new_shards[-1], **{'from': OLDEST})
+        return dict(head, shards=new_shards), written, replaced
+
+    s3_head.update(MANIFEST_BUCKET_NAME, HEAD_KEY, change, delete_shards, MAX_WRITE_ATTEMPTS, ManifestConflict)
+
+def add_photos(items):
+    """Add completed metadata items to the manifest"""
+    update(add=[make_entry(item) for item in items])
+
+def remove_photos(items):
+    """Remove photos (items with photoId and uploadDate) from the manifest"""
+    update(remove=[(item['uploadDate'], item['photoId']) for item in items if item.get('uploadDate')])
+
+def rebuild(items):
+    """
+    Replace the manifest with one built from every completed metadata item
+
+    For first deployment or repair. Run it while no uploads or deletes are in
+    flight; changes made during the rebuild are lost.
+    """
+    entries = sorted((make_entry(item) for item in items), key=sort_key, reverse=True)
+    shards = []
+    for start in range(0, len(entries), SHARD_SIZE):
+        part = entries[start:start + SHARD_SIZE]
+        shards.append({'key': write_shard(part), 'from': list(sort_key(part[-1]))})
+    if shards:
+        shards[-1]['from'] = OLDEST
+
+    previous, _ = read_head()
+    get_client('s3').put_object(**put_args(HEAD_KEY, {'version': FORMAT_VERSION, 'shards': shards}))
+    if previous:
+        delete_shards([shard['key'] for shard in previous['shards']])
+    return len(entries), len(shards)
+
+def scan_gallery(table_name, index_name='gallery-uploadDate-index', partition='photos'):
+    """Every completed metadata item, read through the gallery index"""
+    args = {
+        'TableName': table_name,
+        'IndexName': index_name,
+        'KeyConditionExpression': '#gallery = :gallery',
+        'ExpressionAttributeNames': {'#gallery': 'gallery'},
+        'ExpressionAttributeValues': {':gallery': {'S': partition}}
+    }
+    while True:
+        response = get_client('dynamodb').query(**args)
+        for item in response.get('Items', []):
+            yield {name: deserializer.deserialize(value) for name, value in item.items()}
+        if not response.get('LastEvaluatedKey'):
+            return
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+if __name__ == '__main__':
+    # python gallery_manifest.py  (with METADATA_TABLE_NAME and MANIFEST_BUCKET_NAME set)
+    photos, shards = rebuild(scan_gallery(os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')))
+    print(f'Rebuilt manifest in s3://{MANIFEST_BUCKET_NAME}/{MANIFEST_PREFIX}: '
+          f'{photos} photos in {shards} shards')
@@ -0,0 +1,177 @@
+# Instrumentation
+# Per-invocation timing spans, counters and peak memory, logged as one
+# CloudWatch Embedded Metric Format (EMF) record per invocation
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import resource  # Unix only; used when /proc isn't available
+except ImportError:
+    resource = None
+
+# 'emf' logs a record CloudWatch turns into metrics, 'json' the same fields
+# without the metric directive, 'off' nothing (spans and counters become no-ops)
+MODE = os.environ.get('INSTRUMENTATION', 'emf').lower()
+ENABLED = MODE in ('emf', 'json')
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'PhotoGallery')
+
+# Shared no-op span returned while nothing is being recorded
+_NOOP = nullcontext()
+
+# The invocation being recorded. Lambda runs one invocation at a time per
+# container, so worker threads record into it directly.
+_current = None
+
+# Set once the first invocation in the container has been recorded
+_warm = False
+
+class Invocation:
+    """Stage timings and counters of one handler invocation"""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.spans = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add_span(self, name, elapsed):
+        with self.lock:
+            total, calls = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + elapsed, calls + 1)
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+class _Span:
+    """Adds the time spent inside the with block to a named stage"""
+
+    __slots__ = ('invocation', 'name', 'start')
+
+    def __init__(self, invocation, name):
+        self.invocation = invocation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.invocation.add_span(self.name, time.perf_counter() - self.start)
+        return False
+
+def span(name):
+    """
+    Time a stage: `with span('decode'): ...`
+
+    Repeated and concurrent spans of one name add up, so a stage run by
+    several threads can total more than the invocation's wall time.
+    """
+    invocation = _current
+    if invocation is None:
+        return _NOOP
+    return _Span(invocation, name)
+
+def count(name, value=1):
+    """Add value to a counter of the current invocation"""
+    invocation = _current
+    if invocation is not None:
+        invocation.add_count(name, value)
+
+def instrumented(function_name):
+    """
+    Decorate a lambda_handler to record and log one metrics record per call
+
+    The record holds the handler's duration, every span (as <name>Ms, with
+    <name>Calls when a stage ran more than once), every counter, the peak
+    RSS and whether the container was cold. It is logged after the handler
+    returns, even if it raised.
+    """
+    def decorate(handler):
+        if not ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _current, _warm
+            invocation = Invocation(function_name)
+            cold = not _warm
+            _warm = True
+            _reset_peak_rss()
+            _current = invocation
+            start = time.perf_counter()
+            response = None
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                elapsed = time.perf_counter() - start
+                _current = None
+                print(json.dumps(
+                    build_record(invocation, elapsed, cold, context, response),
+                    separators=(',', ':')
+                ))
+        return wrapper
+    return decorate
+
+def build_record(invocation, elapsed, cold, context, response):
+    """The log record for a finished invocation"""
+    metrics = {'durationMs': (round(elapsed * 1000, 3), 'Milliseconds')}
+    for name, (total, calls) in sorted(invocation.spans.items()):
+        metrics[f'{name}Ms'] = (round(total * 1000, 3), 'Milliseconds')
+        if calls > 1:
+            metrics[f'{name}Calls'] = (calls, 'Count')
+    for name, value in sorted(invocation.counters.items()):
+        metrics[name] = (value, 'Bytes' if name.endswith('Bytes') else 'Count')
+    peak = peak_rss_mb()
+    if peak is not None:
+        metrics['peakRssMb'] = (peak, 'Megabytes')
+
+    record = {'function': invocation.function_name, 'coldStart': cold}
+    request_id = getattr(context, 'aws_request_id', None)
+    if request_id:
+        record['requestId'] = request_id
+    if isinstance(response, dict) and 'statusCode' in response:
+        record['statusCode'] = response['statusCode']
+    record.update({name: value for name, (value, unit) in metrics.items()})
+
+    if MODE == 'emf':
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['function']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in metrics.items()]
+            }]
+        }
+    return record
+
+def _reset_peak_rss():
+    """Restart the kernel's RSS high-water mark, so the peak is per invocation"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    """
+    Peak RSS in MB: since the last reset from /proc, or since the process
+    started where only getrusage is available; None if neither is
+    """
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            status = f.read()
+        start = status.index(b'VmHWM:') + 6
+        return round(int(status[start:status.index(b'kB', start)]) / 1024, 1)
+    except (OSError, ValueError):
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return None
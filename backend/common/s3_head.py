@@ -0,0 +1,87 @@
+# S3 Head
+# A JSON head object naming immutable data objects, changed by conditional
+# PUTs: the read-modify-write loop of the gallery manifest and the sprite atlas
+
+import json
+import random
+import time
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+
+def fetch(bucket, key, etag=None):
+    """
+    (body bytes, etag) of an object; (None, None) when it doesn't exist
+
+    With etag, an unchanged object returns (None, etag) without a body.
+    """
+    args = {'Bucket': bucket, 'Key': key}
+    if etag:
+        args['IfNoneMatch'] = etag
+    try:
+        response = get_client('s3').get_object(**args)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return None, etag
+        if code in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    return response['Body'].read(), response['ETag']
+
+def read(bucket, key, etag=None):
+    """(document, etag) of a JSON head, as fetch returns it"""
+    data, etag = fetch(bucket, key, etag)
+    return (json.loads(data) if data is not None else None), etag
+
+def write(bucket, key, document, etag):
+    """
+    Replace the head if it still has etag, or create it when etag is None;
+    False when another writer got there first
+    """
+    args = {
+        'Bucket': bucket,
+        'Key': key,
+        'Body': json.dumps(document, separators=(',', ':')).encode('utf-8'),
+        'ContentType': 'application/json',
+        'CacheControl': 'no-cache'
+    }
+    if etag:
+        args['IfMatch'] = etag
+    else:
+        args['IfNoneMatch'] = '*'
+    try:
+        get_client('s3').put_object(**args)
+    except ClientError as e:
+        # 412: the head changed; 409: a concurrent conditional write won
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+            return False
+        raise
+    return True
+
+def backoff(attempt):
+    time.sleep(random.uniform(0, min(1.0, 0.025 * (2 ** attempt))))
+
+def update(bucket, key, change, discard, max_attempts, conflict):
+    """
+    Apply change to the head at key, from the current head each attempt
+
+    change(head) gets the head document (None when there is none) and returns
+    None when there is nothing to write, or (new head, keys written, keys
+    replaced); a new head of None means an object it read was replaced since
+    the head was read. discard(keys) removes the objects a write left unused:
+    the replaced ones once the head is swapped, or the written ones when
+    another writer got there first and the change is retried with backoff.
+    Raises conflict after max_attempts. Returns whether the head was written.
+    """
+    for attempt in range(max_attempts):
+        head, etag = read(bucket, key)
+        outcome = change(head)
+        if outcome is None:
+            return False
+        document, written, replaced = outcome
+        if document is not None and write(bucket, key, document, etag):
+            discard(replaced)
+            return True
+        discard(written)
+        backoff(attempt)
+    raise conflict(f'Gave up updating s3://{bucket}/{key} after {max_attempts} attempts')
@@ -0,0 +1,207 @@
+# Search Index
+# Inverted tag and filename index for list_photos filters: one metadata-table
+# item per photo and search key, read newest first through the gallery index.
+# Filenames match by word prefix, not substring: "pano" finds
+# "Panorama_01.jpg", "rama" doesn't.
+
+import json
+import os
+import re
+import time
+from aws_clients import get_client
+from instrumentation import count
+
+METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
+
+# Index items live in the metadata table under photoId '<key>#<photoId>', with
+# the search key as their gallery attribute. The gallery-uploadDate-index then
+# lists each key's photos newest first, exactly as it lists the gallery:
+#   tag#<tag>          every photo carrying the tag
+#   name#<prefix>      every photo with a filename word starting with prefix
+TAG_PREFIX = 'tag#'
+NAME_PREFIX = 'name#'
+
+# Filename words are indexed under their prefixes of these lengths (1 must be
+# one, so every term has a partition), a few items per word rather than one
+# per prefix. A term queries its longest indexed prefix and filters on
+# searchName for the rest.
+PREFIX_LENGTHS = sorted({1, *(int(length) for length in os.environ.get('SEARCH_PREFIX_LENGTHS', '1,3,6').split(','))})
+
+# Photos indexed before PREFIX_LENGTHS have every prefix up to this length;
+# deletes clear those too
+LEGACY_PREFIX_LENGTH = 8
+
+MAX_TAGS = int(os.environ.get('MAX_TAGS', '20'))
+MAX_TAG_LENGTH = 50
+
+# Uploads carry their tags to thumbnail_generator as S3 user metadata
+# (x-amz-meta-tags), a JSON list
+TAGS_METADATA = 'tags'
+
+# Service limit per call, and attempts for UnprocessedItems before giving up
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_ATTEMPTS = 5
+
+# Letters and digits; '_', '-', '.' and spaces all separate words
+WORD = re.compile(r'[^\W_]+')
+
+class IndexWriteFailed(Exception):
+    """BatchWriteItem kept leaving index items unprocessed"""
+
+def is_index_id(photo_id):
+    """Whether a photoId names a search index item rather than a photo"""
+    return photo_id.startswith(TAG_PREFIX) or photo_id.startswith(NAME_PREFIX)
+
+def normalize_tags(tags):
+    """
+    Tags as stored and indexed: lowercased, whitespace collapsed, duplicates
+    and empty tags dropped
+
+    Raises ValueError for anything but a list of strings within the limits.
+    """
+    if tags is None:
+        return []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError('tags must be a list of strings')
+
+    normalized = []
+    for tag in tags:
+        tag = ' '.join(tag.lower().split())
+        if not tag or tag in normalized:
+            continue
+        if len(tag) > MAX_TAG_LENGTH:
+            raise ValueError(f'Tags must be at most {MAX_TAG_LENGTH} characters')
+        normalized.append(tag)
+
+    if len(normalized) > MAX_TAGS:
+        raise ValueError(f'Too many tags: at most {MAX_TAGS} per photo')
+    return normalized
+
+def encode_tags(tags):
+    """S3 user metadata value for normalized tags (ASCII, as S3 requires)"""
+    return json.dumps(tags, separators=(',', ':'))
+
+def decode_tags(value):
+    """Tags from an S3 user metadata value; [] when missing or malformed"""
+    if not value:
+        return []
+    try:
+        return normalize_tags(json.loads(value))
+    except ValueError:
+        print(f'Ignoring malformed tags metadata: {value[:100]}')
+        return []
+
+def search_terms(text):
+    """Lowercased words of a filename or query, in order, without repeats"""
+    return list(dict.fromkeys(WORD.findall(text.lower())))
+
+def search_name(filename):
+    """
+    Filename words as matched by filters: each preceded by a space, so
+    contains(searchName, ' <term>') holds when a word starts with term
+    """
+    return ''.join(' ' + word for word in search_terms(filename))
+
+def tag_key(tag):
+    """Search key of a tag"""
+    return TAG_PREFIX + tag
+
+def indexed_prefix(term):
+    """The longest prefix of term that filename words are indexed under"""
+    return term[:max(length for length in PREFIX_LENGTHS if length <= len(term))]
+
+def name_key(term):
+    """Search key of the filename words starting with term's indexed prefix"""
+    return NAME_PREFIX + indexed_prefix(term)
+
+def plan(tag, terms):
+    """
+    The index partition a filtered listing queries, and the terms left to
+    filter on searchName
+
+    A tag partition holds exactly the tag's photos. Otherwise the longest term
+    picks the name partition, since it is the most selective, and is only
+    filtered on when it is longer than its indexed prefix.
+    """
+    if tag:
+        return tag_key(tag), terms
+    longest = max(terms, key=len)
+    remaining = [term for term in terms if term != longest or indexed_prefix(term) != term]
+    return name_key(longest), remaining
+
+def search_keys(item, lengths=None):
+    """Every search key a photo is indexed under, by default with PREFIX_LENGTHS"""
+    keys = [tag_key(tag) for tag in item.get('tags') or []]
+    for word in search_terms(item.get('filename', '')):
+        keys.extend(NAME_PREFIX + word[:length] for length in lengths or PREFIX_LENGTHS if length <= len(word))
+    return list(dict.fromkeys(keys))
+
+def index_items(item):
+    """Typed index items for a completed metadata item"""
+    photo_id = item['photoId']
+    name = search_name(item.get('filename', ''))
+    return [
+        {
+            'photoId': {'S': f'{key}#{photo_id}'},
+            'gallery': {'S': key},
+            'uploadDate': {'S': item['uploadDate']},
+            'photo': {'S': photo_id},
+            'searchName': {'S': name}
+        }
+        for key in search_keys(item)
+    ]
+
+def add_photos(items):
+    """
+    Index completed photos under their tags and filename word prefixes
+
+    Index item keys don't depend on uploadDate, so reprocessing a photo
+    overwrites its items instead of duplicating them.
+    """
+    # A batch may not name one key twice, as when a photo is redelivered
+    # within one batch; the last write of a key wins
+    puts = {index_item['photoId']['S']: index_item for item in items for index_item in index_items(item)}
+    write([{'PutRequest': {'Item': index_item}} for index_item in puts.values()])
+
+def remove_photos(items):
+    """
+    Drop photos' index items; each item needs photoId, filename and tags
+
+    Deleting keys that were never written is a no-op, so photos from before
+    the index existed are fine, and every prefix up to LEGACY_PREFIX_LENGTH is
+    deleted for photos indexed before PREFIX_LENGTHS.
+    """
+    lengths = sorted(set(PREFIX_LENGTHS) | set(range(1, LEGACY_PREFIX_LENGTH + 1)))
+    index_ids = dict.fromkeys(f'{key}#{item["photoId"]}' for item in items for key in search_keys(item, lengths))
+    write([{'DeleteRequest': {'Key': {'photoId': {'S': index_id}}}} for index_id in index_ids])
+
+def write(requests):
+    """BatchWriteItem in chunks, retrying UnprocessedItems; raises IndexWriteFailed"""
+    count('indexWrites', len(requests))
+    for start in range(0, len(requests), BATCH_WRITE_SIZE):
+        request = {METADATA_TABLE_NAME: requests[start:start + BATCH_WRITE_SIZE]}
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            response = get_client('dynamodb').batch_write_item(RequestItems=request)
+            request = response.get('UnprocessedItems') or {}
+            if not request:
+                break
+            if attempt < MAX_BATCH_ATTEMPTS - 1:
+                time.sleep(0.05 * (2 ** attempt))
+        else:
+            raise IndexWriteFailed(f'{len(request[METADATA_TABLE_NAME])} index items left unprocessed')
+
+if __name__ == '__main__':
+    # python search_index.py  (with METADATA_TABLE_NAME set) indexes every
+    # completed photo, e.g. those uploaded before the index existed
+    from gallery_manifest import scan_gallery
+    indexed = 0
+    batch = []
+    for photo in scan_gallery(METADATA_TABLE_NAME):
+        batch.append(photo)
+        if len(batch) == 100:
+            add_photos(batch)
+            indexed += len(batch)
+            batch = []
+    add_photos(batch)
+    indexed += len(batch)
+    print(f'Indexed {indexed} photos in {METADATA_TABLE_NAME}')
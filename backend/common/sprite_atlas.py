@@ -0,0 +1,376 @@
+# Sprite Atlas
+# Photo thumbnails packed into fixed-size sprite sheets, so a gallery page
+# loads a few sheets rather than one thumbnail per photo
+
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+from instrumentation import count
+import s3_head
+
+THUMBNAIL_BUCKET_NAME = os.environ.get('THUMBNAIL_BUCKET_NAME', 'photo-gallery-thumbnails')
+ATLAS_BUCKET_NAME = os.environ.get('ATLAS_BUCKET_NAME', THUMBNAIL_BUCKET_NAME)
+ATLAS_PREFIX = os.environ.get('ATLAS_PREFIX', 'atlas/')
+METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
+
+# Square cells as large as the biggest thumbnail, SHEET_COLUMNS x SHEET_ROWS
+# per sheet: 8x8 cells of 200px make 1600x1600 sheets of 64 photos, a page and
+# a bit of the gallery. The head records the layout it was created with.
+CELL_SIZE = int(os.environ.get('ATLAS_CELL_SIZE', os.environ.get('THUMBNAIL_MAX_SIZE', '200')))
+SHEET_COLUMNS = int(os.environ.get('ATLAS_SHEET_COLUMNS', '8'))
+SHEET_ROWS = int(os.environ.get('ATLAS_SHEET_ROWS', '8'))
+SHEET_QUALITY = int(os.environ.get('ATLAS_SHEET_QUALITY', '80'))
+
+# Fill of empty cells and behind transparent thumbnails
+BACKGROUND = (255, 255, 255)
+
+# Head updates retried on conflict, with jittered backoff
+MAX_WRITE_ATTEMPTS = int(os.environ.get('ATLAS_MAX_WRITE_ATTEMPTS', '10'))
+
+# Thumbnails downloaded at once when placing photos
+DOWNLOAD_CONCURRENCY = 8
+
+FORMAT_VERSION = 1
+
+# The head maps sheet ids to their objects:
+#   {"version": 1, "cellSize": 200, "columns": 8, "rows": 8, "next": 3,
+#    "sheets": {"0": {"key": "atlas/sheets/<id>.jpg", "used": 64, "cells": "<hex>"}, ...}}
+# Sheets are written once, holding the photos placed together, and cells are
+# never reused: used counts the cells a sheet was written with, and cells is a
+# bitmask of the ones still holding a photo. next is the id of the next sheet.
+#
+# A photo's metadata item and manifest entry carry its sprite:
+#   {"sheet": 2, "x": 400, "y": 200, "width": 200, "height": 150}
+# Sheet objects are never modified, so readers can cache them by key. Adding
+# photos stores new sheets before listing them in the head with a conditional
+# PUT; deleting photos only clears their cells in the head, and a sheet left
+# with none is deleted. The rebuild repacks the atlas densely.
+HEAD_KEY = ATLAS_PREFIX + 'head.json'
+
+serializer = TypeSerializer()
+
+class AtlasConflict(Exception):
+    """The head kept changing under a write"""
+
+def new_head():
+    return {
+        'version': FORMAT_VERSION,
+        'cellSize': CELL_SIZE,
+        'columns': SHEET_COLUMNS,
+        'rows': SHEET_ROWS,
+        'next': 0,
+        'sheets': {}
+    }
+
+def sprite_for(head, sheet_id, cell, size):
+    """The sprite of a size (width, height) thumbnail in a sheet cell"""
+    row, column = divmod(cell, head['columns'])
+    return {
+        'sheet': sheet_id,
+        'x': column * head['cellSize'],
+        'y': row * head['cellSize'],
+        'width': size[0],
+        'height': size[1]
+    }
+
+def cell_of(head, sprite):
+    return (int(sprite['y']) // head['cellSize']) * head['columns'] + int(sprite['x']) // head['cellSize']
+
+# Reading
+
+def read_head(etag=None):
+    """
+    (head, etag); (None, None) when there is no atlas yet
+
+    With etag, an unchanged head returns (None, etag) without a body.
+    """
+    return s3_head.read(ATLAS_BUCKET_NAME, HEAD_KEY, etag)
+
+class AtlasReader:
+    """
+    The sheet objects for list_photos, revalidated with a conditional GET
+    per page and otherwise kept for the warm container
+    """
+
+    def __init__(self):
+        self._head = None
+        self._etag = None
+
+    def sheet_keys(self):
+        """{sheet id: object key}, empty when there is no atlas"""
+        head, etag = read_head(self._etag)
+        if etag is None:
+            self._head, self._etag = None, None
+        elif head is not None:
+            self._head, self._etag = head, etag
+        if self._head is None:
+            return {}
+        return {int(sheet_id): sheet['key'] for sheet_id, sheet in self._head['sheets'].items()}
+
+# Images (Pillow is imported on first use, so list_photos never loads it)
+
+def new_sheet(head, cells):
+    """A blank sheet for cells photos: a row of them, or as many full rows as they need"""
+    from PIL import Image
+    columns = min(cells, head['columns'])
+    rows = -(-cells // columns)
+    return Image.new('RGB', (columns * head['cellSize'], rows * head['cellSize']), BACKGROUND)
+
+def write_sheet(img):
+    """Store a sheet under a new key, returning the key"""
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=SHEET_QUALITY, optimize=True, progressive=True)
+    key = f'{ATLAS_PREFIX}sheets/{uuid.uuid4().hex}.jpg'
+    get_client('s3').put_object(
+        Bucket=ATLAS_BUCKET_NAME,
+        Key=key,
+        Body=buffer.getvalue(),
+        ContentType='image/jpeg',
+        # A key is never rewritten, so browsers may keep it
+        CacheControl='max-age=31536000, immutable'
+    )
+    count('atlasSheetsWritten')
+    return key
+
+def read_thumbnail(key, cell_size):
+    """A thumbnail ready to paste, downloaded from the thumbnail bucket; None if it is gone"""
+    try:
+        response = get_client('s3').get_object(Bucket=THUMBNAIL_BUCKET_NAME, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    return fit_thumbnail(response['Body'].read(), cell_size)
+
+def fit_thumbnail(data, cell_size):
+    """Encoded thumbnail bytes ready to paste: RGB on BACKGROUND, within cell_size"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((cell_size, cell_size))
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, BACKGROUND + (255,))
+            img = Image.alpha_composite(background, img)
+        return img.convert('RGB')
+
+def read_thumbnails(items, cell_size, encoded=None):
+    """
+    {photoId: thumbnail image} for items whose thumbnail still exists; those
+    in encoded ({photoId: thumbnail bytes}) are decoded rather than downloaded
+    """
+    encoded = encoded or {}
+    thumbnails = {photo_id: fit_thumbnail(data, cell_size) for photo_id, data in encoded.items()}
+    items = [item for item in items if item['photoId'] not in thumbnails]
+    keys = [item['thumbnailKey'] for item in items]
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+        images = list(executor.map(lambda key: read_thumbnail(key, cell_size), keys))
+    thumbnails.update((item['photoId'], img) for item, img in zip(items, images) if img is not None)
+    return thumbnails
+
+# Writing
+
+def delete_sheets(keys):
+    """Best-effort removal of sheet objects the head no longer lists"""
+    if not keys:
+        return
+    try:
+        get_client('s3').delete_objects(
+            Bucket=ATLAS_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+    except ClientError as e:
+        print(f'Failed to delete replaced sprite sheets: {str(e)}')
+
+def compose(head, thumbnails, order):
+    """
+    Sheets holding just these thumbnails, in order and a sheet's capacity at
+    a time: [(sheet image, photoIds by cell)]
+    """
+    capacity = head['columns'] * head['rows']
+    photo_ids = [photo_id for photo_id in order if photo_id in thumbnails]
+    sheets = []
+    for start in range(0, len(photo_ids), capacity):
+        chunk = photo_ids[start:start + capacity]
+        img = new_sheet(head, len(chunk))
+        for cell, photo_id in enumerate(chunk):
+            sprite = sprite_for(head, None, cell, thumbnails[photo_id].size)
+            img.paste(thumbnails[photo_id], (sprite['x'], sprite['y']))
+        sheets.append((img, chunk))
+    return sheets
+
+def list_sheets(head, sheets, thumbnails):
+    """
+    Add written sheets ([(key, photoIds by cell)]) to head under new ids,
+    returning {photoId: sprite}
+    """
+    placements = {}
+    for key, chunk in sheets:
+        sheet_id = head['next']
+        head['next'] += 1
+        head['sheets'][str(sheet_id)] = {'key': key, 'used': len(chunk), 'cells': format((1 << len(chunk)) - 1, 'x')}
+        for cell, photo_id in enumerate(chunk):
+            placements[photo_id] = sprite_for(head, sheet_id, cell, thumbnails[photo_id].size)
+    return placements
+
+def add_photos(items, encoded=None):
+    """
+    Place completed items' thumbnails in the atlas and record each sprite on
+    the photo's metadata item and on the item dict, for the manifest entry
+
+    The photos get sheets of their own, newest first, written once before
+    the head lists them, so no sheet is downloaded or re-encoded and a
+    conflicting head update only retries the JSON. Items already carrying a
+    sprite are skipped; free them with remove_photos first to move them.
+    Thumbnails in encoded ({photoId: thumbnail bytes}, e.g. just rendered)
+    aren't downloaded again. Returns the number placed.
+    """
+    items = [item for item in items if item.get('thumbnailKey') and not item.get('sprite')]
+    if not items:
+        return 0
+    order = [item['photoId'] for item in sorted(items, key=lambda item: item['uploadDate'], reverse=True)]
+    encoded = {photo_id: data for photo_id, data in (encoded or {}).items() if photo_id in order}
+
+    # The current head only gives the layout; sheet ids are taken when listing
+    layout = read_head()[0] or new_head()
+    thumbnails = read_thumbnails(items, layout['cellSize'], encoded)
+    sheets = [(write_sheet(img), chunk) for img, chunk in compose(layout, thumbnails, order)]
+    if not sheets:
+        return 0
+    placements = {}
+
+    def change(head):
+        nonlocal placements
+        head = head or new_head()
+        placements = list_sheets(head, sheets, thumbnails)
+        # The sheets stay valid for the next attempt
+        return head, [], []
+
+    try:
+        s3_head.update(ATLAS_BUCKET_NAME, HEAD_KEY, change, delete_sheets, MAX_WRITE_ATTEMPTS, AtlasConflict)
+    except AtlasConflict:
+        delete_sheets([key for key, chunk in sheets])
+        raise
+
+    for item in items:
+        sprite = placements.get(item['photoId'])
+        if sprite and record_sprite(item['photoId'], sprite):
+            item['sprite'] = sprite
+    return len(placements)
+
+def record_sprite(photo_id, sprite):
+    """Set a photo's sprite; False if it was deleted meanwhile"""
+    try:
+        get_client('dynamodb').update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key={'photoId': {'S': photo_id}},
+            UpdateExpression='SET #sprite = :sprite',
+            ConditionExpression='attribute_exists(photoId)',
+            ExpressionAttributeNames={'#sprite': 'sprite'},
+            ExpressionAttributeValues={':sprite': serializer.serialize(sprite)}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+def remove_photos(items):
+    """
+    Free the cells of photos being deleted in the head; sheets left with no
+    photos are deleted
+
+    Only the head is rewritten, so this needs no Pillow. The pixels of freed
+    cells stay in their sheets until the rebuild repacks the atlas. Freeing
+    a cell twice is a no-op, so a retried delete can call this again.
+    """
+    by_sheet = {}
+    for item in items:
+        sprite = item.get('sprite')
+        if sprite:
+            by_sheet.setdefault(int(sprite['sheet']), []).append(sprite)
+    if not by_sheet:
+        return
+
+    def change(head):
+        if head is None:
+            return None
+        changed = False
+        replaced = []
+        for sheet_id, sprites in by_sheet.items():
+            sheet = head['sheets'].get(str(sheet_id))
+            if sheet is None:
+                continue
+            cells = int(sheet['cells'], 16)
+            remaining = cells
+            for sprite in sprites:
+                remaining &= ~(1 << cell_of(head, sprite))
+            if remaining == cells:
+                continue
+            changed = True
+            if remaining == 0:
+                del head['sheets'][str(sheet_id)]
+                replaced.append(sheet['key'])
+            else:
+                sheet['cells'] = format(remaining, 'x')
+        if not changed:
+            return None
+        return head, [], replaced
+
+    s3_head.update(ATLAS_BUCKET_NAME, HEAD_KEY, change, delete_sheets, MAX_WRITE_ATTEMPTS, AtlasConflict)
+
+def rebuild(items):
+    """
+    Replace the atlas with one packing every completed metadata item densely,
+    newest first, and record the new sprites
+
+    For first deployment, and periodically to compact the atlas: uploads
+    leave many small sheets and deletes leave freed cells behind. Run it
+    while no uploads or deletes are in flight. Returns (photos placed, sheets
+    written).
+    """
+    items = sorted((item for item in items if item.get('thumbnailKey')),
+                   key=lambda item: item['uploadDate'], reverse=True)
+    previous, _ = read_head()
+    head = new_head()
+    capacity = head['columns'] * head['rows']
+    placements = {}
+    for start in range(0, len(items), capacity):
+        chunk = items[start:start + capacity]
+        thumbnails = read_thumbnails(chunk, head['cellSize'])
+        sheets = [(write_sheet(img), photo_ids)
+                  for img, photo_ids in compose(head, thumbnails, [item['photoId'] for item in chunk])]
+        placements.update(list_sheets(head, sheets, thumbnails))
+
+    for item in items:
+        sprite = placements.get(item['photoId'])
+        if sprite and record_sprite(item['photoId'], sprite):
+            item['sprite'] = sprite
+        else:
+            item.pop('sprite', None)
+
+    get_client('s3').put_object(
+        Bucket=ATLAS_BUCKET_NAME,
+        Key=HEAD_KEY,
+        Body=json.dumps(head, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json',
+        CacheControl='no-cache'
+    )
+    if previous:
+        delete_sheets([sheet['key'] for sheet in previous['sheets'].values()])
+    return len(placements), len(head['sheets'])
+
+if __name__ == '__main__':
+    # python sprite_atlas.py  (with METADATA_TABLE_NAME and THUMBNAIL_BUCKET_NAME set)
+    import gallery_manifest
+    items = list(gallery_manifest.scan_gallery(METADATA_TABLE_NAME))
+    photos, sheets = rebuild(items)
+    print(f'Rebuilt sprite atlas in s3://{ATLAS_BUCKET_NAME}/{ATLAS_PREFIX}: {photos} photos in {sheets} sheets')
+    # Manifest entries carry the sprites too
+    if gallery_manifest.read_head()[0] is not None:
+        gallery_manifest.rebuild(items)
+        print('Rebuilt the gallery manifest with the new sprites')
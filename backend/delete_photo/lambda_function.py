@@ -1,18 +1,39 @@
 # Delete Photo Lambda Function
 # Deletes photo, thumbnail, and metadata
 
+import base64
 import json
 import os
-import boto3
+import time
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
-
-s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+from aws_clients import get_client
+import content_index
+import gallery_manifest
+from instrumentation import count, instrumented, span
+import search_index
+import sprite_atlas
 
 METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
 PHOTO_BUCKET_NAME = os.environ.get('PHOTO_BUCKET_NAME', 'photo-gallery-photos')
 THUMBNAIL_BUCKET_NAME = os.environ.get('THUMBNAIL_BUCKET_NAME', 'photo-gallery-thumbnails')
+MAX_BULK_DELETE = int(os.environ.get('MAX_BULK_DELETE', '1000'))
+
+# Attributes needed to find every object a photo owns or shares, its gallery
+# manifest shard, its search index items and its sprite sheet cell
+KEY_ATTRIBUTES = 'photoId, uploadDate, filename, tags, photoKey, thumbnailKey, renditions, contentHash, sprite'
+
+deserializer = TypeDeserializer()
+
+# Service limits per call
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+S3_DELETE_SIZE = 1000
+
+# Attempts for BatchGetItem/BatchWriteItem leftovers before giving up
+MAX_BATCH_ATTEMPTS = 5
 
+@instrumented('delete_photo')
 def lambda_handler(event, context):
     """
     Delete photo and associated data
@@ -22,21 +43,35 @@ def lambda_handler(event, context):
         "photoId": str
     }
     
+    or, for bulk deletes (POST /photos/delete):
+    {
+        "photoIds": [str]
+    }
+    
     Returns:
     {
         "message": str,
         "photoId": str
     }
+    
+    or, for bulk deletes, a per-ID report (see bulk_delete)
     """
     try:
         # Parse request
         if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
+            raw_body = event['body']
+            # API Gateway base64-encodes request bodies once binary media types are enabled
+            if event.get('isBase64Encoded'):
+                raw_body = base64.b64decode(raw_body)
+            body = json.loads(raw_body)
         else:
             body = event.get('body', event)
         
+        if isinstance(body, dict) and 'photoIds' in body:
+            return handle_bulk_delete(body['photoIds'])
+        
         # Get photoId from path parameters or body
-        photo_id = event.get('pathParameters', {}).get('photoId') or body.get('photoId')
+        photo_id = (event.get('pathParameters') or {}).get('photoId') or body.get('photoId')
         
         if not photo_id:
             return {
@@ -50,11 +85,30 @@ def lambda_handler(event, context):
                 })
             }
         
+        # Content and search index items share the table but aren't photos
+        if content_index.is_index_id(photo_id) or search_index.is_index_id(photo_id):
+            return {
+                'statusCode': 404,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Photo not found'
+                })
+            }
+        
         # Query DynamoDB for photo metadata
-        table = dynamodb.Table(METADATA_TABLE_NAME)
+        dynamodb_client = get_client('dynamodb')
+        s3_client = get_client('s3')
         
         try:
-            response = table.get_item(Key={'photoId': photo_id})
+            with span('lookup'):
+                response = dynamodb_client.get_item(
+                    TableName=METADATA_TABLE_NAME,
+                    Key={'photoId': {'S': photo_id}},
+                    ProjectionExpression=KEY_ATTRIBUTES
+                )
             
             if 'Item' not in response:
                 return {
@@ -68,9 +122,10 @@ def lambda_handler(event, context):
                     })
                 }
             
-            item = response['Item']
+            item = plain_item(response['Item'])
             photo_key = item.get('photoKey')
             thumbnail_key = item.get('thumbnailKey')
+            rendition_keys = get_rendition_keys(item)
             
             print(f'Found photo {photo_id}: photoKey={photo_key}, thumbnailKey={thumbnail_key}')
         
@@ -87,27 +142,98 @@ def lambda_handler(event, context):
                 })
             }
         
+        # Take the photo out of the listing first, so a failure here leaves it
+        # whole and the delete can be retried
+        try:
+            with span('manifest'):
+                gallery_manifest.remove_photos([item])
+        except (ClientError, gallery_manifest.ManifestConflict) as e:
+            print(f'Gallery manifest update failed: {str(e)}')
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Failed to remove photo from the gallery. Please try again.'
+                })
+            }
+        
+        try:
+            with span('index'):
+                search_index.remove_photos([item])
+        except (ClientError, search_index.IndexWriteFailed) as e:
+            print(f'Search index update failed: {str(e)}')
+            return {
+                'statusCode': 500,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'error': 'Failed to remove photo from search results. Please try again.'
+                })
+            }
+        
+        # Its pixels would otherwise stay visible in the sprite sheet
+        erase_sprites([item])
+        
+        # Objects shared with duplicate uploads are only deleted with the last
+        # photo referencing them
+        if item.get('contentHash'):
+            try:
+                with span('release'):
+                    shared = content_index.release(item['contentHash'], [photo_id])
+            except ClientError as e:
+                print(f'Content index update failed: {str(e)}')
+                return {
+                    'statusCode': 500,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': 'Failed to release shared photo data. Please try again.'
+                    })
+                }
+            
+            if shared is None:
+                print(f'Keeping objects shared through content {item["contentHash"]}')
+                photo_key, rendition_keys = None, []
+            else:
+                photo_key, rendition_keys = shared.get('photoKey'), get_rendition_keys(shared)
+        
         # Delete photo from Photo Bucket
         if photo_key:
             try:
-                s3_client.delete_object(Bucket=PHOTO_BUCKET_NAME, Key=photo_key)
+                with span('s3Delete'):
+                    s3_client.delete_object(Bucket=PHOTO_BUCKET_NAME, Key=photo_key)
+                count('objectsDeleted')
                 print(f'Deleted photo from S3: {photo_key}')
             except ClientError as e:
                 print(f'Failed to delete photo from S3: {str(e)}')
                 # Continue with deletion even if S3 delete fails
         
-        # Delete thumbnail from Thumbnail Bucket
-        if thumbnail_key:
+        # Delete thumbnail and other renditions from Thumbnail Bucket
+        for key in rendition_keys:
             try:
-                s3_client.delete_object(Bucket=THUMBNAIL_BUCKET_NAME, Key=thumbnail_key)
-                print(f'Deleted thumbnail from S3: {thumbnail_key}')
+                with span('s3Delete'):
+                    s3_client.delete_object(Bucket=THUMBNAIL_BUCKET_NAME, Key=key)
+                count('objectsDeleted')
+                print(f'Deleted rendition from S3: {key}')
             except ClientError as e:
-                print(f'Failed to delete thumbnail from S3: {str(e)}')
+                print(f'Failed to delete rendition from S3: {str(e)}')
                 # Continue with deletion even if S3 delete fails
         
         # Delete metadata from DynamoDB
         try:
-            table.delete_item(Key={'photoId': photo_id})
+            with span('metadataDelete'):
+                dynamodb_client.delete_item(
+                    TableName=METADATA_TABLE_NAME,
+                    Key={'photoId': {'S': photo_id}}
+                )
+            count('photosDeleted')
             print(f'Deleted metadata from DynamoDB: {photo_id}')
         except ClientError as e:
             print(f'DynamoDB DeleteItem failed: {str(e)}')
@@ -146,3 +272,277 @@ def lambda_handler(event, context):
                 'error': 'An unexpected error occurred. Please try again.'
             })
         }
+
+def plain_item(item):
+    """Convert a typed DynamoDB item ({'S': ...}) to plain Python values"""
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+def get_rendition_keys(item):
+    """Thumbnail bucket keys owned by a photo: the thumbnail plus every rendition"""
+    keys = []
+    if item.get('thumbnailKey'):
+        keys.append(item['thumbnailKey'])
+    for rendition in item.get('renditions', {}).values():
+        if rendition.get('key') and rendition['key'] not in keys:
+            keys.append(rendition['key'])
+    return keys
+
+def handle_bulk_delete(photo_ids):
+    """Validate a bulk delete request and run it"""
+    if (
+        not isinstance(photo_ids, list)
+        or not photo_ids
+        or not all(isinstance(photo_id, str) and photo_id for photo_id in photo_ids)
+    ):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': 'photoIds must be a non-empty list of photo IDs'
+            })
+        }
+    
+    if len(photo_ids) > MAX_BULK_DELETE:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': f'Too many photoIds: at most {MAX_BULK_DELETE} per request'
+            })
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(bulk_delete(photo_ids))
+    }
+
+def erase_sprites(items):
+    """
+    Free the photos' cells in the sprite atlas, best effort
+
+    The photos have already left the manifest, so nothing references a cell
+    left behind; a failure is logged and counted rather than stopping the
+    delete.
+    """
+    try:
+        with span('atlas'):
+            sprite_atlas.remove_photos(items)
+    except (ClientError, sprite_atlas.AtlasConflict) as e:
+        print(f'Sprite atlas update failed, leaving cells behind: {str(e)}')
+        count('atlasEraseFailures')
+
+def bulk_delete(photo_ids):
+    """
+    Delete many photos with batched S3 and DynamoDB calls
+    
+    Metadata is read with BatchGetItem, photos leave the gallery manifest in
+    one write per shard and the search index in batched deletes, objects are
+    removed with delete_objects (1000 keys per call, per bucket) and metadata
+    with BatchWriteItem. As with single deletes, S3 failures are logged but
+    don't stop the metadata delete.
+    
+    Returns:
+    {
+        "results": [{"photoId": str, "status": "deleted" | "not_found" | "failed", "error": str}],
+        "deleted": int,
+        "notFound": int,
+        "failed": int
+    }
+    """
+    photo_ids = list(dict.fromkeys(photo_ids))
+    results = {}
+    
+    # Content and search index items share the table but aren't photos
+    for photo_id in photo_ids:
+        if content_index.is_index_id(photo_id) or search_index.is_index_id(photo_id):
+            results[photo_id] = {'photoId': photo_id, 'status': 'not_found'}
+    
+    # Resolve metadata in BatchGetItem chunks
+    items = {}
+    for chunk in chunked([photo_id for photo_id in photo_ids if photo_id not in results], BATCH_GET_SIZE):
+        try:
+            found, unprocessed = batch_get_items(chunk)
+        except ClientError as e:
+            print(f'DynamoDB BatchGetItem failed: {str(e)}')
+            found, unprocessed = [], chunk
+        for item in found:
+            items[item['photoId']] = item
+        for photo_id in unprocessed:
+            results[photo_id] = {'photoId': photo_id, 'status': 'failed',
+                                 'error': 'Failed to retrieve photo metadata'}
+    
+    for photo_id in photo_ids:
+        if photo_id not in items and photo_id not in results:
+            results[photo_id] = {'photoId': photo_id, 'status': 'not_found'}
+    
+    print(f'Bulk delete: {len(items)} of {len(photo_ids)} photos found')
+    
+    # One manifest write per shard for the whole request
+    try:
+        with span('manifest'):
+            gallery_manifest.remove_photos(items.values())
+    except (ClientError, gallery_manifest.ManifestConflict) as e:
+        print(f'Gallery manifest update failed: {str(e)}')
+        for photo_id in items:
+            results[photo_id] = {'photoId': photo_id, 'status': 'failed',
+                                 'error': 'Failed to remove photo from the gallery'}
+        items = {}
+    
+    try:
+        with span('index'):
+            search_index.remove_photos(items.values())
+    except (ClientError, search_index.IndexWriteFailed) as e:
+        print(f'Search index update failed: {str(e)}')
+        for photo_id in items:
+            results[photo_id] = {'photoId': photo_id, 'status': 'failed',
+                                 'error': 'Failed to remove photo from search results'}
+        items = {}
+    
+    # One rewrite per affected sprite sheet
+    erase_sprites(list(items.values()))
+    
+    # Photos with their own objects, plus shared content whose last reference
+    # is in this request
+    owners = [item for item in items.values() if not item.get('contentHash')]
+    for content_hash, sharing_ids in group_by_content(items.values()).items():
+        try:
+            with span('release'):
+                shared = content_index.release(content_hash, sharing_ids)
+        except ClientError as e:
+            print(f'Content index update failed: {str(e)}')
+            # Keep the metadata so a retry can release the references
+            for photo_id in sharing_ids:
+                del items[photo_id]
+                results[photo_id] = {'photoId': photo_id, 'status': 'failed',
+                                     'error': 'Failed to release shared photo data'}
+            continue
+        if shared is not None:
+            owners.append(shared)
+    
+    # Delete objects from both buckets
+    photo_keys = [item['photoKey'] for item in owners if item.get('photoKey')]
+    thumbnail_keys = [key for item in owners for key in get_rendition_keys(item)]
+    delete_s3_objects(PHOTO_BUCKET_NAME, photo_keys)
+    delete_s3_objects(THUMBNAIL_BUCKET_NAME, thumbnail_keys)
+    
+    # Delete metadata in BatchWriteItem chunks
+    for chunk in chunked(list(items), BATCH_WRITE_SIZE):
+        try:
+            unprocessed = batch_delete_items(chunk)
+        except ClientError as e:
+            print(f'DynamoDB BatchWriteItem failed: {str(e)}')
+            unprocessed = chunk
+        for photo_id in chunk:
+            if photo_id in unprocessed:
+                results[photo_id] = {'photoId': photo_id, 'status': 'failed',
+                                     'error': 'Failed to delete photo metadata'}
+            else:
+                results[photo_id] = {'photoId': photo_id, 'status': 'deleted'}
+    
+    report = [results[photo_id] for photo_id in photo_ids]
+    counts = {status: sum(1 for r in report if r['status'] == status)
+              for status in ('deleted', 'not_found', 'failed')}
+    print(f'Bulk delete: {counts}')
+    count('photosDeleted', counts['deleted'])
+    
+    return {
+        'results': report,
+        'deleted': counts['deleted'],
+        'notFound': counts['not_found'],
+        'failed': counts['failed']
+    }
+
+def batch_get_items(photo_ids):
+    """
+    BatchGetItem with retries of UnprocessedKeys
+    
+    Returns (items, photo IDs still unprocessed after MAX_BATCH_ATTEMPTS).
+    """
+    request = {
+        METADATA_TABLE_NAME: {
+            'Keys': [{'photoId': {'S': photo_id}} for photo_id in photo_ids],
+            'ProjectionExpression': KEY_ATTRIBUTES
+        }
+    }
+    items = []
+    
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        with span('lookup'):
+            response = get_client('dynamodb').batch_get_item(RequestItems=request)
+        items.extend(plain_item(item) for item in response.get('Responses', {}).get(METADATA_TABLE_NAME, []))
+        request = response.get('UnprocessedKeys') or {}
+        if not request:
+            return items, []
+        if attempt < MAX_BATCH_ATTEMPTS - 1:
+            backoff(attempt)
+    
+    return items, [key['photoId']['S'] for key in request[METADATA_TABLE_NAME]['Keys']]
+
+def batch_delete_items(photo_ids):
+    """
+    BatchWriteItem deletes with retries of UnprocessedItems
+    
+    Returns the photo IDs still unprocessed after MAX_BATCH_ATTEMPTS.
+    """
+    request = {
+        METADATA_TABLE_NAME: [
+            {'DeleteRequest': {'Key': {'photoId': {'S': photo_id}}}} for photo_id in photo_ids
+        ]
+    }
+    
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        with span('metadataDelete'):
+            response = get_client('dynamodb').batch_write_item(RequestItems=request)
+        request = response.get('UnprocessedItems') or {}
+        if not request:
+            return set()
+        if attempt < MAX_BATCH_ATTEMPTS - 1:
+            backoff(attempt)
+    
+    return {r['DeleteRequest']['Key']['photoId']['S'] for r in request[METADATA_TABLE_NAME]}
+
+def delete_s3_objects(bucket, keys):
+    """Delete keys from bucket with delete_objects, logging any failures"""
+    for chunk in chunked(list(dict.fromkeys(keys)), S3_DELETE_SIZE):
+        try:
+            with span('s3Delete'):
+                response = get_client('s3').delete_objects(
+                    Bucket=bucket,
+                    Delete={
+                        'Objects': [{'Key': key} for key in chunk],
+                        'Quiet': True
+                    }
+                )
+            for error in response.get('Errors', []):
+                print(f'Failed to delete {error.get("Key")} from S3: {error.get("Message")}')
+            count('objectsDeleted', len(chunk) - len(response.get('Errors', [])))
+            print(f'Deleted {len(chunk) - len(response.get("Errors", []))} objects from {bucket}')
+        except ClientError as e:
+            print(f'S3 DeleteObjects failed: {str(e)}')
+            # Continue with deletion even if S3 delete fails
+
+def group_by_content(items):
+    """photoIds of the items that share content, by content hash"""
+    groups = {}
+    for item in items:
+        if item.get('contentHash'):
+            groups.setdefault(item['contentHash'], []).append(item['photoId'])
+    return groups
+
+def backoff(attempt):
+    """Exponential backoff between batch retries: 50ms, 100ms, 200ms, ..."""
+    time.sleep(0.05 * (2 ** attempt))
+
+def chunked(values, size):
+    """Split values into lists of at most size"""
+    return [values[i:i + size] for i in range(0, len(values), size)]
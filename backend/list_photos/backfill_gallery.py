@@ -0,0 +1,60 @@
+# Gallery Index Backfill
+# Sets the gallery partition key on completed photos written before the
+# gallery index existed, so the index, and everything rebuilt from it, sees them
+
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+import lambda_function as list_photos
+
+METADATA_TABLE_NAME = list_photos.METADATA_TABLE_NAME
+GALLERY_PARTITION = list_photos.GALLERY_PARTITION
+
+# Items updated at once; stay within AWS_MAX_POOL_CONNECTIONS
+UPDATE_CONCURRENCY = 8
+
+def untagged_pages():
+    """photoIds of completed photos without the gallery attribute, a Scan page at a time"""
+    args = {
+        'TableName': METADATA_TABLE_NAME,
+        'ProjectionExpression': 'photoId',
+        # Index items have no processingStatus, and failed photos stay unlisted
+        'FilterExpression': '#status = :completed AND attribute_not_exists(#gallery)',
+        'ExpressionAttributeNames': {'#status': 'processingStatus', '#gallery': 'gallery'},
+        'ExpressionAttributeValues': {':completed': {'S': 'completed'}}
+    }
+    while True:
+        response = get_client('dynamodb').scan(**args)
+        yield [item['photoId']['S'] for item in response.get('Items', [])]
+        if not response.get('LastEvaluatedKey'):
+            return
+        args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def tag_photo(photo_id):
+    """Set gallery on one photo; False when it was deleted or reprocessed meanwhile"""
+    try:
+        get_client('dynamodb').update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key={'photoId': {'S': photo_id}},
+            UpdateExpression='SET #gallery = :gallery',
+            ConditionExpression='#status = :completed',
+            ExpressionAttributeNames={'#gallery': 'gallery', '#status': 'processingStatus'},
+            ExpressionAttributeValues={':gallery': {'S': GALLERY_PARTITION}, ':completed': {'S': 'completed'}}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+def main():
+    tagged = 0
+    with ThreadPoolExecutor(max_workers=UPDATE_CONCURRENCY) as executor:
+        for photo_ids in untagged_pages():
+            tagged += sum(executor.map(tag_photo, photo_ids))
+    print(f'Set gallery = "{GALLERY_PARTITION}" on {tagged} photos in {METADATA_TABLE_NAME}')
+
+if __name__ == '__main__':
+    # PYTHONPATH=backend/common python3 backend/list_photos/backfill_gallery.py
+    # (with METADATA_TABLE_NAME set). Safe to run again: tagged photos are skipped.
+    main()
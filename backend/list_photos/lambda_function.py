@@ -1,23 +1,132 @@
 # List Photos Lambda Function
-# Returns all photo metadata for gallery display
+# Returns photo metadata for gallery display, one page at a time
 
+import base64
+import binascii
 import json
 import os
-import boto3
+import time
+from datetime import date
 from botocore.exceptions import ClientError
-from decimal import Decimal
-
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
+from aws_clients import get_client, get_session
+from gallery_manifest import ManifestReader
+from instrumentation import count, instrumented, span
+import search_index
+from sprite_atlas import ATLAS_BUCKET_NAME, AtlasReader
+from response_encoding import encode_body, get_header, to_compact
+from url_cache import PresignedUrlCache
+from url_signer import PresignedUrlSigner
 
 METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
 PHOTO_BUCKET_NAME = os.environ.get('PHOTO_BUCKET_NAME', 'photo-gallery-photos')
 THUMBNAIL_BUCKET_NAME = os.environ.get('THUMBNAIL_BUCKET_NAME', 'photo-gallery-thumbnails')
 URL_EXPIRATION = int(os.environ.get('URL_EXPIRATION', '3600'))  # 1 hour default
+GALLERY_INDEX_NAME = os.environ.get('GALLERY_INDEX_NAME', 'gallery-uploadDate-index')
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', '200'))
+URL_CACHE_SIZE = int(os.environ.get('URL_CACHE_SIZE', '20000'))
+URL_CACHE_MIN_REMAINING = int(os.environ.get('URL_CACHE_MIN_REMAINING', '1800'))  # 30 minutes default
+
+# 'manifest' serves pages from the gallery manifest in S3, falling back to the
+# gallery index until one exists; 'index' always queries DynamoDB
+LISTING_SOURCE = os.environ.get('LISTING_SOURCE', 'manifest')
+MANIFEST_CACHE_SHARDS = int(os.environ.get('MANIFEST_CACHE_SHARDS', '8'))
+
+# Items a filtered page may read before it is returned short. Filters on
+# searchName are applied after DynamoDB reads an item, so a rare term could
+# otherwise read a whole index partition in one request.
+SEARCH_MAX_READS = int(os.environ.get('SEARCH_MAX_READS', '1000'))
+
+# Partition value written by thumbnail_generator on every completed photo.
+# Failed items don't carry it, so they never show up in the index.
+GALLERY_PARTITION = 'photos'
+
+# Only the attributes the response is built from, read straight off the wire
+PROJECTED_ATTRIBUTES = [
+    'photoId', 'filename', 'uploadDate', 'fileSize', 'photoKey', 'thumbnailKey',
+    'tags', 'dimensions', 'thumbnailDimensions', 'renditions', 'placeholder', 'sprite', 'processingStatus'
+]
+
+# Search index items: their key, which doubles as the cursor, and the photo
+INDEX_ATTRIBUTES = ['photoId', 'gallery', 'uploadDate', 'photo']
+
+# Service limit per BatchGetItem call, and attempts for UnprocessedKeys
+BATCH_GET_SIZE = 100
+MAX_BATCH_ATTEMPTS = 5
+
+# Upper bound of a date range: sorts after every uploadDate on the end day
+END_OF_DAY = 'T~'
+
+# Lives as long as the warm container, so repeat gallery loads skip signing.
+# Built by get_url_cache on first use.
+url_cache = None
+
+# Caches the manifest head and recently read shards for the warm container.
+# Built by get_manifest_reader on first use.
+manifest_reader = None
+
+# Caches the sprite atlas head for the warm container, like the manifest head
+atlas_reader = None
+
+def get_url_cache():
+    """The container's presigned URL cache, created with its signer on first use"""
+    global url_cache
+    if url_cache is None:
+        # Signs URLs byte-for-byte like generate_presigned_url on an s3v4
+        # client, minus the per-call botocore request pipeline
+        url_signer = PresignedUrlSigner(
+            get_client('s3', signature_version='s3v4'),
+            get_session().get_credentials(),
+            URL_EXPIRATION
+        )
+        url_cache = PresignedUrlCache(
+            url_signer,
+            URL_EXPIRATION,
+            max_entries=URL_CACHE_SIZE,
+            min_remaining=URL_CACHE_MIN_REMAINING
+        )
+    return url_cache
+
+def get_manifest_reader():
+    """The container's gallery manifest reader, created on first use"""
+    global manifest_reader
+    if manifest_reader is None:
+        manifest_reader = ManifestReader(max_shards=MANIFEST_CACHE_SHARDS)
+    return manifest_reader
+
+def get_atlas_reader():
+    """The container's sprite atlas reader, created on first use"""
+    global atlas_reader
+    if atlas_reader is None:
+        atlas_reader = AtlasReader()
+    return atlas_reader
 
+@instrumented('list_photos')
 def lambda_handler(event, context):
     """
-    Retrieve all photo metadata from DynamoDB
+    Retrieve one page of photo metadata, newest first
+    
+    Pages come from the gallery manifest (see gallery_manifest), one or two
+    S3 reads however large the gallery is; the gallery index in DynamoDB is
+    queried when there is no manifest or it can't be read.
+    
+    Filtered pages are queried from the search index (see search_index), so
+    they read only the matching photos, never the whole gallery.
+    
+    Query parameters:
+        limit  - page size (default 50, max 200)
+        cursor - opaque token returned as nextCursor by the previous page
+        format - 'compact' for array-encoded records (see response_encoding)
+        tag    - only photos carrying this tag
+        q      - only photos with a filename word starting with each word of q
+        from   - only photos uploaded on or after this day (YYYY-MM-DD, UTC)
+        to     - only photos uploaded on or before this day (YYYY-MM-DD, UTC)
+    
+    A filtered page may hold fewer than limit photos, even none, while
+    nextCursor is set; keep paging until it is null. Cursors only continue a
+    listing with the same tag and q.
+    
+    The body is gzip or br compressed when Accept-Encoding allows it.
     
     Returns:
     {
@@ -29,97 +138,136 @@ def lambda_handler(event, context):
                 "thumbnailUrl": str,
                 "photoUrl": str,
                 "tags": list,
-                "dimensions": dict
+                "dimensions": dict,
+                "renditions": {"<name>": {"url": str, "width": int, "height": int, "contentType": str}},
+                "placeholder": str or null (BlurHash to paint until the thumbnail loads),
+                "sprite": {"sheet": int, "x": int, "y": int, "width": int, "height": int} or null
             }
-        ]
+        ],
+        "sheets": [str],
+        "nextCursor": str or null
     }
+    
+    A photo with a sprite can be drawn from sheets[sprite.sheet], one sprite
+    sheet image shared by the photos around it, instead of its thumbnailUrl.
     """
     try:
-        # Scan DynamoDB table for all photos
-        table = dynamodb.Table(METADATA_TABLE_NAME)
+        params = event.get('queryStringParameters') or {}
         
         try:
-            response = table.scan()
-            items = response.get('Items', [])
-            
-            # Handle pagination if there are more items
-            while 'LastEvaluatedKey' in response:
-                response = table.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
-                items.extend(response.get('Items', []))
-            
-            print(f'Retrieved {len(items)} photos from DynamoDB')
-        
-        except ClientError as e:
-            print(f'DynamoDB scan failed: {str(e)}')
+            limit = parse_limit(params.get('limit'))
+            start_key = decode_cursor(params.get('cursor'))
+            response_format = parse_format(params.get('format'))
+            search = parse_search(params)
+            if start_key and not cursor_matches(search, start_key):
+                raise ValueError('Invalid cursor: it belongs to a listing with other filters')
+        except ValueError as e:
             return {
-                'statusCode': 500,
+                'statusCode': 400,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
-                    'error': 'Failed to retrieve photos. Please try again.'
+                    'error': str(e)
                 })
             }
         
-        # Format photos for response
-        photos = []
-        for item in items:
-            # Skip failed processing items
-            if item.get('processingStatus') == 'failed':
-                continue
-            
+        page = None
+        if LISTING_SOURCE == 'manifest' and not search:
+            with span('manifest'):
+                page = read_manifest_page(limit, start_key)
+        if page is not None:
+            items, next_cursor = page
+            format_item = format_entry
+            print(f'Retrieved {len(items)} photos from the gallery manifest')
+        
+        # Query the gallery index newest first, in the gallery partition or a
+        # search index one. The low-level client skips the resource layer's
+        # Decimal conversion; format_photo reads the typed attributes directly.
+        else:
             try:
-                # Generate presigned URLs for photo and thumbnail
-                photo_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': PHOTO_BUCKET_NAME,
-                        'Key': item['photoKey']
-                    },
-                    ExpiresIn=URL_EXPIRATION
-                )
-                
-                thumbnail_url = s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={
-                        'Bucket': THUMBNAIL_BUCKET_NAME,
-                        'Key': item['thumbnailKey']
+                with span('query'):
+                    if search:
+                        items, next_cursor = query_search(search, limit, start_key)
+                        print(f'Retrieved {len(items)} photos from search key {search["partition"]}')
+                    else:
+                        items, last_key = query_partition(GALLERY_PARTITION, PROJECTED_ATTRIBUTES, limit, start_key)
+                        next_cursor = encode_cursor(last_key)
+                        print(f'Retrieved {len(items)} photos from DynamoDB')
+                format_item = format_photo
+            
+            except ClientError as e:
+                print(f'DynamoDB query failed: {str(e)}')
+                return {
+                    'statusCode': 500,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
                     },
-                    ExpiresIn=URL_EXPIRATION
-                )
-                
-                # Build photo object
-                photo = {
-                    'photoId': item['photoId'],
-                    'filename': item['filename'],
-                    'uploadDate': item['uploadDate'],
-                    'fileSize': int(item.get('fileSize', 0)),
-                    'thumbnailUrl': thumbnail_url,
-                    'photoUrl': photo_url,
-                    'tags': item.get('tags', []),
-                    'dimensions': convert_decimals(item.get('dimensions', {})),
-                    'thumbnailDimensions': convert_decimals(item.get('thumbnailDimensions', {}))
+                    'body': json.dumps({
+                        'error': 'Failed to retrieve photos. Please try again.'
+                    })
                 }
+        
+        # Format photos for response
+        url_cache = get_url_cache()
+        url_cache.evict_expired()
+        url_cache.reset_stats()
+        photos = []
+        with span('format'):
+            for item in items:
+                # Skip failed processing items
+                if item.get('processingStatus', {}).get('S') == 'failed':
+                    continue
                 
-                photos.append(photo)
-            
-            except ClientError as e:
-                print(f'Failed to generate presigned URL for photo {item.get("photoId")}: {str(e)}')
-                continue
+                try:
+                    photos.append(format_item(item, url_cache))
+                
+                except ClientError as e:
+                    photo_id = item['photoId'] if format_item is format_entry else item['photoId']['S']
+                    print(f'Failed to generate presigned URL for photo {photo_id}: {str(e)}')
+                    continue
         
-        # Sort by upload date (newest first)
-        photos.sort(key=lambda x: x['uploadDate'], reverse=True)
+        with span('atlas'):
+            sheets = resolve_sheets(photos, url_cache)
+        
+        count('photosReturned', len(photos))
+        count('urlsSigned', url_cache.misses)
+        count('urlCacheHits', url_cache.hits)
+        print(f'URL cache: {url_cache.hits} hits, {url_cache.misses} misses, '
+              f'{url_cache.evictions} evictions, {len(url_cache)} entries')
+        
+        if response_format == 'compact':
+            payload = to_compact(photos, sheets)
+            payload['nextCursor'] = next_cursor
+        else:
+            payload = {
+                'photos': photos,
+                'sheets': sheets,
+                'nextCursor': next_cursor
+            }
+        
+        with span('encode'):
+            body, is_base64, content_encoding = encode_body(
+                json.dumps(payload, separators=(',', ':')),
+                get_header(event, 'Accept-Encoding')
+            )
+        count('responseBytes', len(body))
+        
+        headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Vary': 'Accept-Encoding'
+        }
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
         
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'photos': photos
-            })
+            'headers': headers,
+            'body': body,
+            'isBase64Encoded': is_base64
         }
     
     except Exception as e:
@@ -135,13 +283,368 @@ def lambda_handler(event, context):
             })
         }
 
-def convert_decimals(obj):
-    """Convert DynamoDB Decimal types to int/float for JSON serialization"""
-    if isinstance(obj, list):
-        return [convert_decimals(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    else:
-        return obj
+def format_photo(item, url_cache):
+    """Build the response record for one item in DynamoDB's typed wire format"""
+    # Every stored rendition, so the client can pick the smallest that fits
+    renditions = {}
+    for name, rendition in item.get('renditions', {}).get('M', {}).items():
+        fields = rendition['M']
+        renditions[name] = {
+            'url': url_cache.get_url(THUMBNAIL_BUCKET_NAME, fields['key']['S']),
+            'width': int(fields['width']['N']),
+            'height': int(fields['height']['N']),
+            'contentType': fields['contentType']['S']
+        }
+    
+    return {
+        'photoId': item['photoId']['S'],
+        'filename': item['filename']['S'],
+        'uploadDate': item['uploadDate']['S'],
+        'fileSize': int(item['fileSize']['N']) if 'fileSize' in item else 0,
+        'thumbnailUrl': url_cache.get_url(THUMBNAIL_BUCKET_NAME, item['thumbnailKey']['S']),
+        'photoUrl': url_cache.get_url(PHOTO_BUCKET_NAME, item['photoKey']['S']),
+        'tags': decode_attribute(item['tags']) if 'tags' in item else [],
+        'dimensions': decode_attribute(item['dimensions']) if 'dimensions' in item else {},
+        'thumbnailDimensions': (
+            decode_attribute(item['thumbnailDimensions']) if 'thumbnailDimensions' in item else {}
+        ),
+        'renditions': renditions,
+        'placeholder': item['placeholder']['S'] if 'placeholder' in item else None,
+        'sprite': decode_attribute(item['sprite']) if 'sprite' in item else None
+    }
+
+def format_entry(entry, url_cache):
+    """Build the response record for one gallery manifest entry"""
+    renditions = {}
+    for name, rendition in entry.get('renditions', {}).items():
+        renditions[name] = {
+            'url': url_cache.get_url(THUMBNAIL_BUCKET_NAME, rendition['key']),
+            'width': rendition['width'],
+            'height': rendition['height'],
+            'contentType': rendition['contentType']
+        }
+    
+    return {
+        'photoId': entry['photoId'],
+        'filename': entry['filename'],
+        'uploadDate': entry['uploadDate'],
+        'fileSize': entry['fileSize'],
+        'thumbnailUrl': url_cache.get_url(THUMBNAIL_BUCKET_NAME, entry['thumbnailKey']),
+        'photoUrl': url_cache.get_url(PHOTO_BUCKET_NAME, entry['photoKey']),
+        'tags': entry['tags'],
+        'dimensions': entry.get('dimensions', {}),
+        'thumbnailDimensions': entry.get('thumbnailDimensions', {}),
+        'renditions': renditions,
+        'placeholder': entry.get('placeholder'),
+        'sprite': entry.get('sprite')
+    }
+
+def resolve_sheets(photos, url_cache):
+    """
+    Presigned URLs of the sprite sheets holding the page's photos, with each
+    photo's sprite sheet id replaced by an index into them
+
+    Sprites on sheets the atlas no longer lists become null, and so does
+    every sprite when the atlas can't be read; the client then falls back to
+    thumbnailUrl.
+    """
+    if not any(photo['sprite'] for photo in photos):
+        return []
+    try:
+        sheet_keys = get_atlas_reader().sheet_keys()
+    except (ClientError, ValueError) as e:
+        print(f'Sprite atlas read failed: {str(e)}')
+        sheet_keys = {}
+    
+    urls = []
+    indexes = {}
+    for photo in photos:
+        sprite = photo['sprite']
+        if not sprite:
+            continue
+        key = sheet_keys.get(sprite['sheet'])
+        if key is None:
+            photo['sprite'] = None
+            continue
+        if key not in indexes:
+            indexes[key] = len(urls)
+            urls.append(url_cache.get_url(ATLAS_BUCKET_NAME, key))
+        photo['sprite'] = dict(sprite, sheet=indexes[key])
+    return urls
+
+def read_manifest_page(limit, start_key):
+    """
+    (entries, next cursor) from the gallery manifest, or None to query the
+    gallery index instead
+    """
+    after = None
+    if start_key:
+        # Cursors carry the same key either way, so paging survives a switch
+        # between sources
+        if 'uploadDate' not in start_key or 'photoId' not in start_key:
+            return None
+        after = (start_key['uploadDate']['S'], start_key['photoId']['S'])
+    
+    try:
+        page = get_manifest_reader().page(limit, after)
+    except (ClientError, KeyError, ValueError) as e:
+        print(f'Gallery manifest read failed: {str(e)}')
+        return None
+    if page is None:
+        print('No gallery manifest yet')
+        return None
+    
+    entries, last = page
+    next_cursor = None
+    if last:
+        upload_date, photo_id = last
+        next_cursor = encode_cursor({
+            'photoId': {'S': photo_id},
+            'gallery': {'S': GALLERY_PARTITION},
+            'uploadDate': {'S': upload_date}
+        })
+    return entries, next_cursor
+
+def query_search(search, limit, start_key):
+    """
+    (typed photo items, next cursor) for a filtered page
+
+    A date-only filter narrows the gallery partition itself. Otherwise the
+    search index partition is queried for the matching index items, and their
+    photos are read with BatchGetItem in the same order.
+    """
+    if search['partition'] == GALLERY_PARTITION:
+        items, last_key = query_partition(
+            GALLERY_PARTITION, PROJECTED_ATTRIBUTES, limit, start_key, search['dates']
+        )
+        return items, encode_cursor(last_key)
+    
+    entries, last_key = query_partition(
+        search['partition'], INDEX_ATTRIBUTES, limit, start_key, search['dates'], search['terms']
+    )
+    photos = batch_get_photos([entry['photo']['S'] for entry in entries])
+    # An index item can outlive its photo for a moment during a delete
+    items = [photos[entry['photo']['S']] for entry in entries if entry['photo']['S'] in photos]
+    return items, encode_cursor(last_key)
+
+def query_partition(partition, attributes, limit, start_key, dates=(None, None), terms=()):
+    """
+    Up to limit items of one gallery index partition, newest first, and the
+    key to continue from (None at the end)
+
+    dates bounds uploadDate in the key condition. Each of terms must start a
+    word of searchName; DynamoDB applies that after Limit, so matches are
+    collected over several queries, until the page is full or SEARCH_MAX_READS
+    items have been read.
+    """
+    names = {'#gallery': 'gallery', **{f'#a{i}': name for i, name in enumerate(attributes)}}
+    values = {':gallery': {'S': partition}}
+    key_condition = '#gallery = :gallery'
+    
+    start, end = dates
+    if start or end:
+        names['#uploadDate'] = 'uploadDate'
+    if start:
+        values[':start'] = {'S': start}
+    if end:
+        values[':end'] = {'S': end}
+    if start and end:
+        key_condition += ' AND #uploadDate BETWEEN :start AND :end'
+    elif start:
+        key_condition += ' AND #uploadDate >= :start'
+    elif end:
+        key_condition += ' AND #uploadDate <= :end'
+    
+    query_args = {
+        'TableName': METADATA_TABLE_NAME,
+        'IndexName': GALLERY_INDEX_NAME,
+        'KeyConditionExpression': key_condition,
+        'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(attributes))),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+        'ScanIndexForward': False
+    }
+    if terms:
+        names['#searchName'] = 'searchName'
+        for i, term in enumerate(terms):
+            values[f':term{i}'] = {'S': ' ' + term}
+        query_args['FilterExpression'] = ' AND '.join(
+            f'contains(#searchName, :term{i})' for i in range(len(terms))
+        )
+    
+    items = []
+    reads = 0
+    while True:
+        query_args['Limit'] = min(limit, SEARCH_MAX_READS - reads) if terms else limit
+        if start_key:
+            query_args['ExclusiveStartKey'] = start_key
+        response = get_client('dynamodb').query(**query_args)
+        reads += query_args['Limit']
+        matches = response.get('Items', [])
+        count('itemsScanned', response.get('ScannedCount', len(matches)))
+        start_key = response.get('LastEvaluatedKey')
+        
+        if len(items) + len(matches) > limit:
+            # Full page: continue after the last match returned, not after
+            # everything DynamoDB read
+            items.extend(matches[:limit - len(items)])
+            last = items[-1]
+            return items, {name: last[name] for name in ('photoId', 'gallery', 'uploadDate')}
+        
+        items.extend(matches)
+        if not start_key or len(items) == limit or reads >= SEARCH_MAX_READS:
+            return items, start_key
+
+def batch_get_photos(photo_ids):
+    """Typed photo items by photoId, read with BatchGetItem"""
+    photos = {}
+    for start in range(0, len(photo_ids), BATCH_GET_SIZE):
+        request = {
+            METADATA_TABLE_NAME: {
+                'Keys': [{'photoId': {'S': photo_id}} for photo_id in photo_ids[start:start + BATCH_GET_SIZE]],
+                'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(PROJECTED_ATTRIBUTES))),
+                'ExpressionAttributeNames': {f'#a{i}': name for i, name in enumerate(PROJECTED_ATTRIBUTES)}
+            }
+        }
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            with span('batchGet'):
+                response = get_client('dynamodb').batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(METADATA_TABLE_NAME, []):
+                photos[item['photoId']['S']] = item
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            if attempt < MAX_BATCH_ATTEMPTS - 1:
+                time.sleep(0.05 * (2 ** attempt))
+        else:
+            # Dropping them would skip photos for good, since the cursor moves on
+            raise ClientError(
+                {'Error': {'Code': 'ProvisionedThroughputExceededException',
+                           'Message': f'{len(request[METADATA_TABLE_NAME]["Keys"])} photos left unprocessed'}},
+                'BatchGetItem'
+            )
+    return photos
+
+def decode_attribute(value):
+    """Convert a typed DynamoDB attribute value ({'N': '12'}) to plain JSON types"""
+    (kind, raw), = value.items()
+    if kind == 'S' or kind == 'BOOL':
+        return raw
+    if kind == 'N':
+        return decode_number(raw)
+    if kind == 'M':
+        return {k: decode_attribute(v) for k, v in raw.items()}
+    if kind == 'L':
+        return [decode_attribute(v) for v in raw]
+    if kind == 'SS':
+        return list(raw)
+    if kind == 'NS':
+        return [decode_number(n) for n in raw]
+    if kind == 'NULL':
+        return None
+    raise ValueError(f'Unsupported attribute type: {kind}')
+
+def decode_number(raw):
+    """DynamoDB numbers arrive as strings; keep integers exact"""
+    if '.' in raw or 'e' in raw or 'E' in raw:
+        return float(raw)
+    return int(raw)
+
+def parse_limit(value):
+    """Validate the requested page size"""
+    if value is None or value == '':
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Invalid limit: must be an integer')
+    if limit < 1:
+        raise ValueError('Invalid limit: must be at least 1')
+    return min(limit, MAX_PAGE_SIZE)
+
+def parse_format(value):
+    """Validate the requested response format"""
+    if value is None or value == '' or value == 'full':
+        return 'full'
+    if value == 'compact':
+        return 'compact'
+    raise ValueError('Invalid format: must be full or compact')
+
+def parse_search(params):
+    """
+    The filters of a listing request, or None when it has none
+
+    Returns the gallery index partition to query ('photos' for a date range
+    alone), the terms left to filter on searchName, and the uploadDate bounds.
+    """
+    tag = params.get('tag') or None
+    q = params.get('q') or None
+    start = parse_date(params.get('from'), 'from')
+    end = parse_date(params.get('to'), 'to')
+    if not (tag or q or start or end):
+        return None
+    
+    if tag:
+        try:
+            tags = search_index.normalize_tags([tag])
+        except ValueError as e:
+            raise ValueError(f'Invalid tag: {str(e)}')
+        if not tags:
+            raise ValueError('Invalid tag: must not be blank')
+        tag = tags[0]
+    
+    terms = []
+    if q:
+        terms = search_index.search_terms(q)
+        if not terms:
+            raise ValueError('Invalid q: must contain letters or digits')
+    
+    if start and end and start > end:
+        raise ValueError('Invalid date range: from is after to')
+    
+    partition, remaining = search_index.plan(tag, terms) if (tag or terms) else (GALLERY_PARTITION, [])
+    return {
+        'partition': partition,
+        'terms': remaining,
+        'dates': (start, end + END_OF_DAY if end else None)
+    }
+
+def cursor_matches(search, start_key):
+    """Whether a cursor continues a listing with these filters (None for none)"""
+    partition = search['partition'] if search else GALLERY_PARTITION
+    if start_key.get('gallery', {}).get('S') != partition:
+        return False
+    upload_date = start_key.get('uploadDate', {}).get('S', '')
+    start, end = search['dates'] if search else (None, None)
+    return (not start or upload_date >= start) and (not end or upload_date <= end)
+
+def parse_date(value, name):
+    """Validate a YYYY-MM-DD date parameter"""
+    if value is None or value == '':
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f'Invalid {name}: must be a date (YYYY-MM-DD)')
+
+def encode_cursor(last_evaluated_key):
+    """Turn a DynamoDB LastEvaluatedKey into an opaque, URL-safe cursor"""
+    if not last_evaluated_key:
+        return None
+    # Key attributes are all strings; the cursor carries them untyped
+    key = {name: value['S'] for name, value in last_evaluated_key.items()}
+    raw = json.dumps(key, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Turn a cursor from encode_cursor back into an ExclusiveStartKey"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, dict) or not all(isinstance(v, str) for v in key.values()):
+        raise ValueError('Invalid cursor')
+    return {name: {'S': value} for name, value in key.items()}
@@ -0,0 +1,192 @@
+# Response Encoding
+# Compact record format and Accept-Encoding negotiation for /photos responses
+
+import base64
+import gzip
+
+try:
+    import brotli  # Optional: not part of the Lambda Python runtime
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this go out uncompressed; the saving isn't worth the CPU
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+# Column order of each record in the compact format
+COMPACT_FIELDS = [
+    'photoId', 'filename', 'uploadDate', 'fileSize', 'tags',
+    'dimensions', 'thumbnailDimensions', 'photoUrl', 'thumbnailUrl', 'renditions', 'placeholder',
+    'sprite'
+]
+
+def to_compact(photos, sheets=()):
+    """
+    Encode photos as arrays instead of objects, with shared URL parts
+    factored out
+
+    Records follow fields. Dimensions become [width, height], and renditions a
+    list aligned with renditionNames holding [width, height, contentType, url]
+    or null. A sprite becomes [sheet, x, y, width, height], with the sheet
+    URLs in sheets. Every URL becomes [prefix, path, query, *values]: urlPrefixes[prefix]
+    holds its scheme, host and leading slash, and queryTemplates[query] its query
+    string with each parameter that differs between URLs replaced by {}, filled
+    in order from values. For presigned URLs only the date and signature vary.
+    """
+    rendition_names = []
+    for photo in photos:
+        for name in photo.get('renditions', {}):
+            if name not in rendition_names:
+                rendition_names.append(name)
+
+    urls = _UrlTable()
+    for url in sheets:
+        urls.add(url)
+    for photo in photos:
+        urls.add(photo['photoUrl'])
+        urls.add(photo['thumbnailUrl'])
+        for rendition in photo.get('renditions', {}).values():
+            urls.add(rendition['url'])
+
+    def dimensions(value):
+        return [value['width'], value['height']] if value else None
+
+    def sprite(value):
+        return [value['sheet'], value['x'], value['y'], value['width'], value['height']] if value else None
+
+    records = []
+    for photo in photos:
+        renditions = photo.get('renditions', {})
+        records.append([
+            photo['photoId'],
+            photo['filename'],
+            photo['uploadDate'],
+            photo['fileSize'],
+            photo['tags'],
+            dimensions(photo['dimensions']),
+            dimensions(photo['thumbnailDimensions']),
+            urls.encode(photo['photoUrl']),
+            urls.encode(photo['thumbnailUrl']),
+            [
+                [r['width'], r['height'], r['contentType'], urls.encode(r['url'])] if r else None
+                for r in (renditions.get(name) for name in rendition_names)
+            ],
+            photo.get('placeholder'),
+            sprite(photo.get('sprite'))
+        ])
+
+    return {
+        'format': 'compact',
+        'fields': COMPACT_FIELDS,
+        'urlPrefixes': list(urls.prefixes),
+        'queryTemplates': list(urls.templates),
+        'renditionNames': rendition_names,
+        'sheets': [urls.encode(url) for url in sheets],
+        'photos': records
+    }
+
+class _UrlTable:
+    """Splits URLs into host prefix, path and query template for to_compact"""
+
+    def __init__(self):
+        self.prefixes = {}
+        self.templates = {}
+        self._split = {}
+        self._shared = {}
+        self._template_index = {}
+
+    def add(self, url):
+        """First pass: note which query values are the same across all URLs"""
+        if url in self._split:
+            return
+        host_end = url.find('/', url.find('://') + 3)
+        base, _, query = url.partition('?')
+        names, values = [], []
+        if query:
+            for param in query.split('&'):
+                name, sep, value = param.partition('=')
+                names.append(name + sep)
+                values.append(value)
+        names = tuple(names)
+        self._split[url] = (base[:host_end + 1], base[host_end + 1:], names, values)
+
+        shared = self._shared.get(names)
+        if shared is None:
+            self._shared[names] = list(values)
+        else:
+            for i, value in enumerate(values):
+                if shared[i] != value:
+                    shared[i] = None
+
+    def encode(self, url):
+        """Second pass: [prefix, path, query, *values] for a URL passed to add"""
+        prefix, path, names, values = self._split[url]
+        shared = self._shared[names]
+        template_index = self._template_index.get(names)
+        if template_index is None:
+            template = '&'.join(
+                name + ('{}' if value is None else value) for name, value in zip(names, shared)
+            )
+            template_index = self.templates.setdefault(template, len(self.templates))
+            self._template_index[names] = template_index
+        return [
+            self.prefixes.setdefault(prefix, len(self.prefixes)),
+            path,
+            template_index,
+            *(value for value, common in zip(values, shared) if common is None)
+        ]
+
+def negotiate_encoding(accept_encoding):
+    """Pick br, gzip or None (identity) from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for entry in accept_encoding.split(','):
+        coding, _, params = entry.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best = None
+    for coding in candidates:
+        q = weights.get(coding, weights.get('*', 0.0))
+        if q > 0 and (best is None or q > weights.get(best, weights.get('*', 0.0))):
+            best = coding
+    return best
+
+def encode_body(body, accept_encoding):
+    """
+    Compress a response body as the client allows
+
+    Returns (body, is_base64_encoded, content_encoding). Compressed bodies are
+    base64-encoded for API Gateway, which needs binary media types enabled to
+    pass them on as raw bytes.
+    """
+    encoding = negotiate_encoding(accept_encoding)
+    raw = body.encode('utf-8')
+    if encoding is None or len(raw) < MIN_COMPRESS_BYTES:
+        return body, False, None
+
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+
+    return base64.b64encode(compressed).decode('ascii'), True, encoding
+
+def get_header(event, name):
+    """Case-insensitive request header lookup"""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
@@ -0,0 +1,68 @@
+# Presigned URL Cache
+# Reuses presigned URLs across invocations of a warm Lambda container
+
+import time
+from collections import OrderedDict
+
+class PresignedUrlCache:
+    """
+    Bounded LRU cache of presigned URLs keyed by (bucket, key).
+
+    A cached URL is handed back only while at least min_remaining seconds of
+    its lifetime are left, so the browser always gets a usable link. Entries
+    past that point are dropped on lookup and swept once per invocation;
+    the least recently used entry goes when the cache is full.
+    """
+
+    def __init__(self, signer, expires_in, max_entries, min_remaining):
+        self._signer = signer
+        self._expires_in = expires_in
+        self._max_entries = max_entries
+        self._min_remaining = min(min_remaining, expires_in)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_url(self, bucket, key, now=None):
+        """Return a presigned URL for bucket/key, signing only on a miss"""
+        now = time.time() if now is None else now
+        cache_key = (bucket, key)
+
+        entry = self._entries.get(cache_key)
+        if entry is not None:
+            url, expires_at = entry
+            if expires_at - now >= self._min_remaining:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return url
+            del self._entries[cache_key]
+            self.evictions += 1
+
+        self.misses += 1
+        url = self._signer.sign(bucket, key, now=now)
+        # X-Amz-Date is truncated to the second, so count from there
+        self._entries[cache_key] = (url, int(now) + self._expires_in)
+
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+        return url
+
+    def evict_expired(self, now=None):
+        """Drop every entry that can no longer be handed out"""
+        now = time.time() if now is None else now
+        threshold = now + self._min_remaining
+        stale = [k for k, (_, expires_at) in self._entries.items() if expires_at < threshold]
+        for cache_key in stale:
+            del self._entries[cache_key]
+        self.evictions += len(stale)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,141 @@
+# Presigned URL Signer
+# SigV4 query signing for S3 GET URLs without the botocore request pipeline
+
+import hashlib
+import hmac
+import time
+from urllib.parse import quote, urlsplit
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+class PresignedUrlSigner:
+    """
+    Produces the same presigned get_object URLs as
+    s3_client.generate_presigned_url, for a client configured with
+    signature_version='s3v4'.
+
+    botocore builds, serializes and signs a full request object for every
+    URL. Here the endpoint for each bucket is resolved once through botocore,
+    the signing key is derived once per day and region, and each URL costs
+    one SHA-256 and one HMAC.
+    """
+
+    def __init__(self, s3_client, credentials, expires_in):
+        if s3_client.meta.config.signature_version != 's3v4':
+            raise ValueError('PresignedUrlSigner requires an s3v4 client')
+
+        self._client = s3_client
+        self._credentials = credentials
+        self._region = s3_client.meta.region_name
+        self._expires = str(int(expires_in))
+        self._bucket_bases = {}
+        self._scope_state = None
+        self._timestamp_second = None
+        self._timestamp = None
+
+    def sign(self, bucket, key, now=None):
+        """
+        Return a presigned GET URL for bucket/key
+
+        now - optional epoch seconds to sign at (defaults to the current time)
+        """
+        base_url, host, base_path = self._bucket_base(bucket)
+        timestamp = self._amz_date(now)
+        state = self._state_for(timestamp[:8])
+
+        path = base_path + quote(key, safe='/~')
+        canonical_request = (
+            f'GET\n{path}\n{state["canonical_prefix"]}{timestamp}'
+            f'{state["canonical_suffix"]}\nhost:{host}\n\nhost\n{UNSIGNED_PAYLOAD}'
+        )
+        string_to_sign = (
+            f'{ALGORITHM}\n{timestamp}\n{state["scope"]}\n'
+            f'{hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()}'
+        )
+        signature = hmac.new(
+            state['signing_key'], string_to_sign.encode('utf-8'), hashlib.sha256
+        ).hexdigest()
+
+        return (
+            f'{base_url}{path}?{state["url_prefix"]}{timestamp}'
+            f'{state["url_suffix"]}&X-Amz-Signature={signature}'
+        )
+
+    def _bucket_base(self, bucket):
+        """Resolve scheme, host and path prefix for a bucket exactly as botocore does"""
+        base = self._bucket_bases.get(bucket)
+        if base is None:
+            probe = self._client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket, 'Key': 'probe'},
+                ExpiresIn=int(self._expires)
+            )
+            parts = urlsplit(probe)
+            base_path = parts.path[:-len('probe')]
+            base = (f'{parts.scheme}://{parts.netloc}', parts.netloc, base_path)
+            self._bucket_bases[bucket] = base
+        return base
+
+    def _amz_date(self, now):
+        """Format X-Amz-Date, reusing the string within the same second"""
+        second = int(time.time() if now is None else now)
+        if second != self._timestamp_second:
+            self._timestamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(second))
+            self._timestamp_second = second
+        return self._timestamp
+
+    def _state_for(self, date_stamp):
+        """Signing key and static query fragments for the current credentials and day"""
+        credentials = self._credentials.get_frozen_credentials()
+        state = self._scope_state
+        if (
+            state is not None
+            and state['date_stamp'] == date_stamp
+            and state['credentials'] == credentials
+        ):
+            return state
+
+        scope = f'{date_stamp}/{self._region}/s3/aws4_request'
+        credential = f'{credentials.access_key}/{scope}'
+
+        # URL order follows botocore; the canonical query string is sorted
+        url_prefix = (
+            f'X-Amz-Algorithm={ALGORITHM}'
+            f'&X-Amz-Credential={_encode(credential)}'
+            f'&X-Amz-Date='
+        )
+        url_suffix = f'&X-Amz-Expires={self._expires}&X-Amz-SignedHeaders=host'
+        canonical_suffix = f'&X-Amz-Expires={self._expires}'
+        if credentials.token is not None:
+            token = _encode(credentials.token)
+            url_suffix += f'&X-Amz-Security-Token={token}'
+            canonical_suffix += f'&X-Amz-Security-Token={token}'
+        canonical_suffix += '&X-Amz-SignedHeaders=host'
+
+        state = {
+            'date_stamp': date_stamp,
+            'credentials': credentials,
+            'scope': scope,
+            'signing_key': _signing_key(credentials.secret_key, date_stamp, self._region),
+            'url_prefix': url_prefix,
+            'url_suffix': url_suffix,
+            'canonical_prefix': url_prefix,
+            'canonical_suffix': canonical_suffix
+        }
+        self._scope_state = state
+        return state
+
+def _encode(value):
+    """Percent-encode a query value the way botocore does"""
+    return quote(value, safe='-_.~')
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+def _signing_key(secret_key, date_stamp, region):
+    """Derive the SigV4 signing key for one day, region and the s3 service"""
+    k_date = _hmac(f'AWS4{secret_key}'.encode('utf-8'), date_stamp)
+    k_region = _hmac(k_date, region)
+    k_service = _hmac(k_region, 's3')
+    return _hmac(k_service, 'aws4_request')
@@ -0,0 +1,377 @@
+# Thumbnail Backfill
+# Re-renders existing photos with the current thumbnail_generator settings and
+# finishes photos whose processing failed, outside Lambda, resumably
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import BotoCoreError, ClientError
+from PIL import Image
+from aws_clients import get_client
+import content_index
+import gallery_manifest
+import search_index
+import sprite_atlas
+import lambda_function as thumbnail_generator
+
+PHOTO_BUCKET_NAME = thumbnail_generator.PHOTO_BUCKET_NAME
+THUMBNAIL_BUCKET_NAME = thumbnail_generator.THUMBNAIL_BUCKET_NAME
+METADATA_TABLE_NAME = thumbnail_generator.METADATA_TABLE_NAME
+
+# What the backfill reads of each photo's item to decide what it needs
+ITEM_ATTRIBUTES = [
+    'photoId', 'uploadDate', 'photoKey', 'processingStatus', 'processingVersion', 'contentHash', 'renditions'
+]
+
+# Service limits per call
+BATCH_GET_SIZE = 100
+S3_DELETE_SIZE = 1000
+
+# BatchGetItem calls made for one batch while DynamoDB leaves keys unprocessed,
+# with exponential backoff between them
+BATCH_GET_ATTEMPTS = 8
+
+STAT_NAMES = ('examined', 'rendered', 'ingested', 'skipped', 'missing', 'failed')
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+class ReadThrottled(Exception):
+    """DynamoDB kept leaving keys of a BatchGetItem unprocessed"""
+
+# Planning
+
+def plan(item, force=False):
+    """
+    What a photo needs: 'ingest' to process it as a new upload (no item, or
+    processing failed), 'render' to re-render a completed photo made with
+    other settings, or None when it is up to date
+    """
+    if item is None or item.get('processingStatus') != 'completed':
+        return 'ingest'
+    if force or item.get('processingVersion') != thumbnail_generator.PROCESSING_VERSION:
+        return 'render'
+    return None
+
+def plain_item(item):
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+def table_pages(cursor, page_size):
+    """
+    (photo key, item) pairs of every photo item in the metadata table, a
+    Scan page at a time, with the cursor to resume after each page
+    """
+    names = {name: f'#a{i}' for i, name in enumerate(ITEM_ATTRIBUTES)}
+    index_prefixes = (content_index.HASH_PREFIX, search_index.TAG_PREFIX, search_index.NAME_PREFIX)
+    args = {
+        'TableName': METADATA_TABLE_NAME,
+        'ProjectionExpression': ', '.join(names.values()),
+        # The content and search index items share the table; leave them out
+        'FilterExpression': ' AND '.join(
+            [f'attribute_exists({names["photoKey"]})'] +
+            [f'NOT begins_with({names["photoId"]}, :prefix{i})' for i in range(len(index_prefixes))]
+        ),
+        'ExpressionAttributeNames': {alias: name for name, alias in names.items()},
+        'ExpressionAttributeValues': {f':prefix{i}': {'S': prefix} for i, prefix in enumerate(index_prefixes)},
+        'Limit': page_size
+    }
+    while True:
+        if cursor:
+            args['ExclusiveStartKey'] = cursor
+        response = get_client('dynamodb').scan(**args)
+        entries = []
+        for item in response.get('Items', []):
+            item = plain_item(item)
+            entries.append((item['photoKey'], item))
+        cursor = response.get('LastEvaluatedKey')
+        yield entries, cursor
+        if not cursor:
+            return
+
+def bucket_pages(cursor, page_size):
+    """
+    (photo key, item or None) pairs of every original in the photo bucket, a
+    listing page at a time, with the cursor to resume after each page
+    """
+    args = {'Bucket': PHOTO_BUCKET_NAME, 'Prefix': 'photos/', 'MaxKeys': page_size}
+    while True:
+        if cursor:
+            args['ContinuationToken'] = cursor
+        response = get_client('s3').list_objects_v2(**args)
+        keys = [obj['Key'] for obj in response.get('Contents', []) if obj['Key'].count('/') >= 2]
+        items = batch_get_items(list(dict.fromkeys(key.split('/')[1] for key in keys)))
+        entries = []
+        for key in keys:
+            item = items.get(key.split('/')[1])
+            # A photo sharing another upload's content points elsewhere; its
+            # own upload was deleted, so this is a leftover
+            if item is None or item['photoKey'] == key:
+                entries.append((key, item))
+        cursor = response.get('NextContinuationToken')
+        yield entries, cursor
+        if not cursor:
+            return
+
+def batch_get_items(photo_ids):
+    """
+    Plain items by photoId, read with BatchGetItem
+
+    Raises ReadThrottled when keys are still unprocessed after
+    BATCH_GET_ATTEMPTS calls, rather than taking them for missing items.
+    """
+    items = {}
+    for start in range(0, len(photo_ids), BATCH_GET_SIZE):
+        request = {
+            METADATA_TABLE_NAME: {
+                'Keys': [{'photoId': {'S': photo_id}} for photo_id in photo_ids[start:start + BATCH_GET_SIZE]],
+                'ProjectionExpression': ', '.join(f'#a{i}' for i in range(len(ITEM_ATTRIBUTES))),
+                'ExpressionAttributeNames': {f'#a{i}': name for i, name in enumerate(ITEM_ATTRIBUTES)}
+            }
+        }
+        for attempt in range(BATCH_GET_ATTEMPTS):
+            if attempt:
+                time.sleep(random.uniform(0, min(5.0, 0.05 * (2 ** attempt))))
+            response = get_client('dynamodb').batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(METADATA_TABLE_NAME, []):
+                items[item['photoId']['S']] = plain_item(item)
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                break
+        else:
+            raise ReadThrottled(f'{len(request[METADATA_TABLE_NAME]["Keys"])} items still unprocessed '
+                                f'after {BATCH_GET_ATTEMPTS} BatchGetItem calls')
+    return items
+
+# Workers: run in the process pool, one photo at a time
+
+def quiet_worker():
+    """Pool initializer: drop thumbnail_generator's per-photo logging"""
+    sys.stdout = open(os.devnull, 'w')
+
+def ingest(photo_key, upload_date):
+    """
+    Process an original as thumbnail_generator does an upload; its completed
+    item and encoded thumbnail (None when the content was shared), or None
+    """
+    completed = []
+    thumbnail_generator.process_photo(PHOTO_BUCKET_NAME, photo_key,
+                                      lambda item, thumbnail=None: completed.append((item, thumbnail)), upload_date)
+    return completed[0] if completed else None
+
+def render(photo_key):
+    """Re-render an original's renditions in place; the new shared attributes"""
+    _, owner_id, filename = photo_key.split('/', 2)
+    response = get_client('s3').get_object(Bucket=PHOTO_BUCKET_NAME, Key=photo_key)
+    buffer, _ = thumbnail_generator.read_object_body(response['Body'])
+    try:
+        rendered = thumbnail_generator.render_photo(buffer)
+    finally:
+        buffer.close()
+    return thumbnail_generator.store_renditions(photo_key, owner_id, filename, rendered)
+
+# Applying results, in the main process
+
+def apply_render(items, shared):
+    """
+    Point every photo using a re-rendered original at the new objects and
+    delete the replaced ones; returns the updated items
+
+    Content shared by duplicate uploads is re-rendered once, and the content
+    index item and every photo referencing it are updated together.
+    """
+    photo_ids = {item['photoId'] for item in items}
+    content_hash = next((item['contentHash'] for item in items if item.get('contentHash')), None)
+    if content_hash:
+        references = content_index.replace(content_hash, shared)
+        photo_ids.update(references or [])
+
+    updated = [item for item in (update_photo(photo_id, shared) for photo_id in photo_ids) if item]
+
+    # Objects under keys this render didn't write again, e.g. after a format change
+    kept = {rendition['key'] for rendition in shared['renditions'].values()}
+    replaced = {
+        rendition['key'] for item in items for rendition in (item.get('renditions') or {}).values()
+    } - kept
+    delete_thumbnails(replaced)
+    return updated
+
+def update_photo(photo_id, shared):
+    """Set a photo's shared attributes; its new item, or None if it was deleted meanwhile"""
+    # photoKey comes first, so #a0 = :a0 checks the photo still uses this original
+    names = [name for name in content_index.SHARED_ATTRIBUTES if name in shared]
+    try:
+        response = get_client('dynamodb').update_item(
+            TableName=METADATA_TABLE_NAME,
+            Key={'photoId': {'S': photo_id}},
+            UpdateExpression='SET ' + ', '.join(f'#a{i} = :a{i}' for i in range(len(names))),
+            ConditionExpression='attribute_exists(photoId) AND #a0 = :a0',
+            ExpressionAttributeNames={f'#a{i}': name for i, name in enumerate(names)},
+            ExpressionAttributeValues={f':a{i}': serializer.serialize(shared[name]) for i, name in enumerate(names)},
+            ReturnValues='ALL_NEW'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print(f'Photo {photo_id} was deleted or replaced during the backfill')
+            return None
+        raise
+    return plain_item(response['Attributes'])
+
+def delete_thumbnails(keys):
+    keys = sorted(keys)
+    for start in range(0, len(keys), S3_DELETE_SIZE):
+        get_client('s3').delete_objects(
+            Bucket=THUMBNAIL_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_SIZE]], 'Quiet': True}
+        )
+
+def process_page(pool, entries, force, ingest_missing, stats):
+    """Fan one page of photos out over the pool and record what became of them"""
+    renders = {}
+    futures = {}
+    for photo_key, item in entries:
+        stats['examined'] += 1
+        action = plan(item, force)
+        if action is None:
+            stats['skipped'] += 1
+        elif action == 'render':
+            renders.setdefault(photo_key, []).append(item)
+        elif item is None and not ingest_missing:
+            stats['missing'] += 1
+        else:
+            futures[pool.submit(ingest, photo_key, item and item.get('uploadDate'))] = ('ingest', photo_key)
+    for photo_key in renders:
+        futures[pool.submit(render, photo_key)] = ('render', photo_key)
+
+    listed = []
+    ingested = []
+    thumbnails = {}
+    for future in as_completed(futures):
+        action, photo_key = futures[future]
+        try:
+            result = future.result()
+            if action == 'render':
+                updated = apply_render(renders[photo_key], result)
+                listed.extend(updated)
+                stats['rendered'] += len(updated)
+            elif result is None:
+                stats['failed'] += 1
+            else:
+                item, thumbnail = result
+                ingested.append(item)
+                if thumbnail is not None:
+                    thumbnails[item['photoId']] = thumbnail
+                stats['ingested'] += 1
+        except (thumbnail_generator.ImageTooLarge, Image.DecompressionBombError) as e:
+            # Over the limits it is rendered with, as the function rejects it;
+            # the photo keeps its current renditions
+            print(f'Image too large to {action} {photo_key}: {str(e)}')
+            stats['failed'] += len(renders[photo_key]) if action == 'render' else 1
+        except (ClientError, BotoCoreError, OSError, ValueError) as e:
+            # Left as it was, so the next run tries it again
+            print(f'Failed to {action} {photo_key}: {str(e)}')
+            stats['failed'] += len(renders[photo_key]) if action == 'render' else 1
+
+    # Re-rendered photos move to new cells showing the new thumbnails
+    try:
+        sprite_atlas.remove_photos(listed)
+        for item in listed:
+            item.pop('sprite', None)
+        sprite_atlas.add_photos(listed + ingested, thumbnails)
+    except (ClientError, BotoCoreError, OSError, sprite_atlas.AtlasConflict) as e:
+        print(f'Sprite atlas update failed: {str(e)}; run sprite_atlas.py to repair it')
+
+    # One search index and manifest update per page, as the function does per batch
+    try:
+        search_index.add_photos(ingested)
+        gallery_manifest.add_photos(listed + ingested)
+    except (ClientError, BotoCoreError, search_index.IndexWriteFailed, gallery_manifest.ManifestConflict) as e:
+        print(f'Search index or gallery manifest update failed: {str(e)}; '
+              f'run search_index.py and gallery_manifest.py to repair them')
+
+# Checkpoints
+
+def load_checkpoint(path, source, restart):
+    """The saved progress of an earlier run over source, or a fresh start"""
+    if not restart and os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['source'] == source:
+            return checkpoint
+        print(f'Ignoring {path}: it was written for --source {checkpoint["source"]}')
+    return {'source': source, 'cursor': None, 'done': False, 'elapsed': 0.0,
+            'stats': dict.fromkeys(STAT_NAMES, 0)}
+
+def save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically, so an interrupted write leaves the previous one"""
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, path)
+
+def report(stats, elapsed):
+    rate = stats['examined'] / elapsed if elapsed else 0.0
+    changed = stats['rendered'] + stats['ingested']
+    print(f'{stats["examined"]} photos in {elapsed:.0f}s ({rate:.1f}/s): '
+          f'{stats["rendered"]} re-rendered, {stats["ingested"]} ingested, {stats["skipped"]} up to date, '
+          f'{stats["missing"]} without metadata, {stats["failed"]} failed '
+          f'({changed / elapsed if elapsed else 0.0:.1f} processed/s)')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Re-render photos made with other thumbnail settings and finish failed ones'
+    )
+    parser.add_argument('--source', choices=['table', 'bucket'], default='table',
+                        help='enumerate metadata items (default) or originals in the photo bucket')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='render processes (default: one per CPU)')
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='photos listed per page; progress is saved after each (default: 100)')
+    parser.add_argument('--checkpoint', default='backfill-checkpoint.json',
+                        help='progress file to resume from (default: backfill-checkpoint.json)')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    parser.add_argument('--force', action='store_true', help='re-render photos that are already up to date')
+    parser.add_argument('--ingest-missing', action='store_true',
+                        help='with --source bucket, also process originals that have no metadata item')
+    parser.add_argument('--verbose', action='store_true', help="show thumbnail_generator's per-photo log")
+    args = parser.parse_args()
+
+    checkpoint = load_checkpoint(args.checkpoint, args.source, args.restart)
+    if checkpoint['done']:
+        print(f'{args.checkpoint} records a finished run; pass --restart to run again')
+        return
+    if checkpoint['cursor']:
+        print(f'Resuming from {args.checkpoint}')
+
+    print(f'Processing version {thumbnail_generator.PROCESSING_VERSION}, {args.workers} workers')
+    stats = checkpoint['stats']
+    pages = table_pages if args.source == 'table' else bucket_pages
+    started = time.monotonic() - checkpoint['elapsed']
+
+    # Spawned workers build their own boto3 clients rather than inheriting
+    # this process's connections
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context('spawn'),
+                             initializer=None if args.verbose else quiet_worker) as pool:
+        try:
+            for entries, cursor in pages(checkpoint['cursor'], args.page_size):
+                process_page(pool, entries, args.force, args.ingest_missing, stats)
+                checkpoint.update(cursor=cursor, done=cursor is None, elapsed=time.monotonic() - started)
+                save_checkpoint(args.checkpoint, checkpoint)
+                # Scan pages holding only index items have nothing to report
+                if entries:
+                    report(stats, checkpoint['elapsed'])
+        except ReadThrottled as e:
+            # The page is read again when the run is resumed
+            print(f'Metadata reads throttled: {str(e)}')
+
+    print('Backfill complete' if checkpoint['done'] else 'Backfill stopped early')
+
+if __name__ == '__main__':
+    # PYTHONPATH=backend/common python3 backend/thumbnail_generator/backfill.py
+    # with the function's environment (bucket and table names, RENDITIONS, ...)
+    main()
@@ -0,0 +1,101 @@
+# BlurHash
+# Encodes an image as a short BlurHash string (https://blurha.sh), a blurred
+# placeholder clients can paint before the real thumbnail arrives
+
+import math
+from PIL import Image
+
+# Pixels sampled along the longer side; more doesn't change a 4x3 hash
+SAMPLE_SIZE = 32
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# sRGB channel value to linear light
+SRGB_TO_LINEAR = [
+    value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+    for value in (i / 255 for i in range(256))
+]
+
+def encode(img, components=4):
+    """
+    BlurHash of img with components basis functions along its longer side
+    and proportionally fewer (at least 3) along the shorter one
+
+    img is sampled down to SAMPLE_SIZE pixels, so pass an already small
+    rendition. Transparent areas are blended onto white.
+    """
+    sample = img.copy()
+    sample.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE), Image.Resampling.BOX)
+    if sample.mode in ('RGBA', 'LA', 'PA') or 'transparency' in sample.info:
+        sample = sample.convert('RGBA')
+        background = Image.new('RGBA', sample.size, (255, 255, 255, 255))
+        sample = Image.alpha_composite(background, sample)
+    sample = sample.convert('RGB')
+    width, height = sample.size
+
+    if width >= height:
+        x_components, y_components = components, max(3, min(components, round(components * height / width)))
+    else:
+        x_components, y_components = max(3, min(components, round(components * width / height))), components
+
+    pixels = [
+        (SRGB_TO_LINEAR[r], SRGB_TO_LINEAR[g], SRGB_TO_LINEAR[b])
+        for r, g, b in sample.getdata()
+    ]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    # The basis is separable: weight each row by cos_x first, then the rows by cos_y
+    row_sums = []
+    for i in range(x_components):
+        weights = cos_x[i]
+        sums = []
+        for y in range(height):
+            r = g = b = 0.0
+            for weight, (pr, pg, pb) in zip(weights, pixels[y * width:(y + 1) * width]):
+                r += weight * pr
+                g += weight * pg
+                b += weight * pb
+            sums.append((r, g, b))
+        row_sums.append(sums)
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            r = g = b = 0.0
+            for weight, (sr, sg, sb) in zip(cos_y[j], row_sums[i]):
+                r += weight * sr
+                g += weight * sg
+                b += weight * sb
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, math.floor(max(abs(v) for factor in ac for v in factor) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+        result += encode_base83(quantised_max, 1)
+    else:
+        maximum = 1
+        result += encode_base83(0, 1)
+    result += encode_base83(
+        (linear_to_srgb(dc[0]) << 16) + (linear_to_srgb(dc[1]) << 8) + linear_to_srgb(dc[2]), 4
+    )
+    for factor in ac:
+        r, g, b = (quantise(v / maximum) for v in factor)
+        result += encode_base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+def linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+def quantise(value):
+    """An AC component in -1..1 as 0..18, on a square-root scale"""
+    return max(0, min(18, math.floor(math.copysign(abs(value) ** 0.5, value) * 9 + 9.5)))
+
+def encode_base83(value, length):
+    return ''.join(BASE83[value // 83 ** (length - i - 1) % 83] for i in range(length))
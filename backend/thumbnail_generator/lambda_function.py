@@ -1,172 +1,967 @@
 # Thumbnail Generator Lambda Function
 # Creates thumbnails when photos are uploaded to S3
 
+import hashlib
+import io
 import json
 import os
-import boto3
-from PIL import Image
-from datetime import datetime
-from botocore.exceptions import ClientError
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+# Importing the plugins for the formats we read and write registers them up
+# front, so Pillow never falls back to loading all of its ~40 plugins
+from PIL import ExifTags, Image, GifImagePlugin, JpegImagePlugin, PngImagePlugin, WebPImagePlugin
+from datetime import datetime, timezone
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote_plus
+from aws_clients import get_client
+import content_index
+import gallery_manifest
+from instrumentation import count, instrumented, span
+import blurhash
+import search_index
+import sprite_atlas
 import traceback
 
-s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
-
 PHOTO_BUCKET_NAME = os.environ.get('PHOTO_BUCKET_NAME', 'photo-gallery-photos')
 THUMBNAIL_BUCKET_NAME = os.environ.get('THUMBNAIL_BUCKET_NAME', 'photo-gallery-thumbnails')
 METADATA_TABLE_NAME = os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')
 THUMBNAIL_MAX_SIZE = int(os.environ.get('THUMBNAIL_MAX_SIZE', '200'))
+READ_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Records processed at once; downloads and uploads overlap across threads while
+# decode/resize is limited to one record per vCPU. Keep AWS_MAX_POOL_CONNECTIONS
+# at or above this so threads don't wait on the S3 connection pool.
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '8'))
+cpu_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# Decode and box-reduce down to this multiple of the target size before the
+# final LANCZOS pass. Larger is closer to a full-resolution resample, smaller
+# is faster; 'off' decodes every pixel of the original.
+_reducing_gap = os.environ.get('THUMBNAIL_REDUCING_GAP', '2.0')
+REDUCING_GAP = None if _reducing_gap.lower() in ('', '0', 'off', 'none') else float(_reducing_gap)
+
+# Largest image accepted, in pixels, checked from the header before anything
+# is decoded. Pillow's own decompression bomb check at open uses it too.
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', '100000000'))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Memory the decoded pixels of the records being rendered may take together.
+# JPEGs count at their reduced-decode size. Renders wait until theirs fits, and
+# an image that needs more than all of it is rejected rather than risking an
+# out-of-memory kill. Scale it with the function's memory size.
+DECODE_MEMORY_MB = int(os.environ.get('DECODE_MEMORY_MB', '256'))
+
+# Bytes per pixel Pillow stores each mode in; other modes take 4
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+# Copies of the decoded pixels a format's decoder holds at its peak; Pillow's
+# WebP decoder goes through libwebp's own buffers on the way to the image's
+DECODE_COPIES = {'WEBP': 4}
+
+# Renditions produced from each upload as name:max_size[:format], where format
+# is jpeg, webp, png, auto (JPEG, or PNG when the image has transparent pixels)
+# or source (keep the original's format). 'thumbnail' is required; it backs
+# thumbnailKey/thumbnailDimensions for existing clients.
+RENDITIONS_SPEC = os.environ.get(
+    'RENDITIONS',
+    f'thumbnail:{THUMBNAIL_MAX_SIZE}:auto,thumbnail_webp:{THUMBNAIL_MAX_SIZE}:webp,'
+    'preview:800:auto,preview_webp:800:webp'
+)
+
+# JPEG and WebP renditions are encoded at ENCODE_QUALITY when that fits the
+# byte budget of ENCODE_BYTES_PER_PIXEL (a 200x150 thumbnail gets 30000 * 0.25
+# = 7.5KB). Otherwise the highest quality down to ENCODE_MIN_QUALITY that fits
+# is found by bisection, a handful of extra encodes of an already small image.
+# PNGs over budget are quantized to a 256-colour palette when that is smaller.
+ENCODE_QUALITY = int(os.environ.get('ENCODE_QUALITY', '75'))
+ENCODE_MIN_QUALITY = int(os.environ.get('ENCODE_MIN_QUALITY', '50'))
+ENCODE_BYTES_PER_PIXEL = float(os.environ.get('ENCODE_BYTES_PER_PIXEL', '0.25'))
+
+# Pillow format name, file extension and content type per output format
+OUTPUT_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'GIF': ('gif', 'image/gif'),
+    'WEBP': ('webp', 'image/webp')
+}
+
+# Modes LANCZOS resizing works on directly
+RESIZABLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK')
+
+# Formats whose quality setting trades bytes for fidelity
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+# EXIF Orientation -> the transpose that shows the image upright, as applied by
+# ImageOps.exif_transpose. 5 to 8 swap width and height.
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+# Camera details kept in the item's exif map: name -> (IFD, tag). GPS is left
+# out on purpose; the gallery shares photos, and locations stay in the original.
+EXIF_FIELDS = {
+    'make': (None, ExifTags.Base.Make),
+    'model': (None, ExifTags.Base.Model),
+    'lensModel': (ExifTags.IFD.Exif, ExifTags.Base.LensModel),
+    'focalLength': (ExifTags.IFD.Exif, ExifTags.Base.FocalLength),
+    'fNumber': (ExifTags.IFD.Exif, ExifTags.Base.FNumber),
+    'exposureTime': (ExifTags.IFD.Exif, ExifTags.Base.ExposureTime),
+    'iso': (ExifTags.IFD.Exif, ExifTags.Base.ISOSpeedRatings)
+}
+
+# Longest EXIF string kept; makers pad some fields with garbage
+MAX_EXIF_STRING = 100
+
+# Shared attributes beyond the objects: what was read from the EXIF header, the
+# BlurHash placeholder and the settings the renditions were made with
+SHARED_DETAILS = ('captureDate', 'orientation', 'exif', 'placeholder', 'processingVersion')
+
+# Built by get_srgb_profile the first time an upload carries an ICC profile
+srgb_profile = None
+
+# Partition key of the gallery index that list_photos queries newest first.
+# Only completed photos carry it, keeping failed items out of the listing.
+GALLERY_PARTITION = 'photos'
+
+def parse_renditions(spec):
+    """Parse RENDITIONS into a list of renditions, largest first"""
+    renditions = []
+    for entry in spec.split(','):
+        parts = entry.strip().split(':')
+        if len(parts) not in (2, 3) or not parts[0]:
+            raise ValueError(f'Invalid rendition: {entry!r}')
+        
+        output_format = parts[2].upper() if len(parts) == 3 else 'SOURCE'
+        if output_format not in ('SOURCE', 'AUTO') and output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'Invalid rendition format: {entry!r}')
+        
+        renditions.append({
+            'name': parts[0],
+            'maxSize': int(parts[1]),
+            'format': output_format
+        })
+    
+    if 'thumbnail' not in {r['name'] for r in renditions}:
+        raise ValueError('RENDITIONS must include a thumbnail rendition')
+    
+    # Stable sort: equal sizes keep their configured order
+    renditions.sort(key=lambda r: r['maxSize'], reverse=True)
+    return renditions
+
+RENDITIONS = parse_renditions(RENDITIONS_SPEC)
 
+# Bump when a change to rendering or EXIF extraction should reach photos that
+# are already processed
+RENDER_REVISION = 2
+
+# Stored on every item as processingVersion: the render revision and every
+# setting that changes the output. backfill.py re-renders items without it.
+PROCESSING_VERSION = hashlib.sha256(json.dumps([
+    RENDER_REVISION, RENDITIONS, REDUCING_GAP, ENCODE_QUALITY, ENCODE_MIN_QUALITY, ENCODE_BYTES_PER_PIXEL
+]).encode('utf-8')).hexdigest()[:12]
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+class RecordsFailed(Exception):
+    """Raised from a direct S3 invocation with failed records, so Lambda retries it"""
+
+class ImageTooLarge(Exception):
+    """The image is over MAX_IMAGE_PIXELS, or decoding it would take more than DECODE_MEMORY_MB"""
+
+class DecodeMemory:
+    """The DECODE_MEMORY_MB budget, shared by the records rendering at once"""
+    
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.condition = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, amount):
+        """Hold amount bytes of the budget, waiting until other renders leave room"""
+        with self.condition:
+            if self.used + amount > self.total:
+                with span('memoryWait'):
+                    self.condition.wait_for(lambda: self.used + amount <= self.total)
+            self.used += amount
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.used -= amount
+                self.condition.notify_all()
+
+decode_memory = DecodeMemory(DECODE_MEMORY_MB * 1024 * 1024)
+
+@instrumented('thumbnail_generator')
 def lambda_handler(event, context):
     """
-    Process S3 event notification and generate thumbnail
+    Process S3 event notifications and generate thumbnails
+    
+    Triggered by S3 ObjectCreated events, either directly or through an SQS
+    queue. Records are processed concurrently and succeed or fail
+    independently; for SQS batches the failed messages are returned as
+    batchItemFailures so only they are retried. Direct S3 invocations are
+    asynchronous, so they raise RecordsFailed instead, and Lambda's retries
+    reprocess the event.
     
-    Triggered by S3 ObjectCreated event
+    Completed photos are added to the sprite atlas, the search index and the
+    gallery manifest together once the batch is done, in one update of each
+    rather than one per photo.
     """
     try:
-        # Extract S3 event details
-        for record in event['Records']:
-            bucket_name = record['s3']['bucket']['name']
-            object_key = record['s3']['object']['key']
-            
-            print(f'Processing photo: {object_key} from bucket: {bucket_name}')
-            
-            # Extract photo ID and filename from key (photos/{photoId}/{filename})
-            key_parts = object_key.split('/')
-            if len(key_parts) < 3 or key_parts[0] != 'photos':
-                print(f'Invalid key format: {object_key}')
-                continue
-            
-            photo_id = key_parts[1]
-            filename = '/'.join(key_parts[2:])
-            
-            # Download photo from S3 to /tmp
-            tmp_photo_path = f'/tmp/{photo_id}_original'
-            tmp_thumbnail_path = f'/tmp/{photo_id}_thumbnail'
-            
-            try:
-                s3_client.download_file(bucket_name, object_key, tmp_photo_path)
-                print(f'Downloaded photo to {tmp_photo_path}')
-            except ClientError as e:
-                print(f'S3 download failed: {str(e)}')
-                update_metadata_with_error(photo_id, filename, object_key, 'S3 download failed')
-                continue
-            
-            # Open image with Pillow
+        jobs = get_photo_jobs(event)
+        failed_ids = set()
+        completed = []
+        # Thumbnails rendered in this batch, placed without downloading them again
+        thumbnails = {}
+        
+        def complete(item_id, item, thumbnail=None):
+            completed.append((item_id, item))
+            if thumbnail is not None:
+                thumbnails[item['photoId']] = thumbnail
+        
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            futures = {}
+            for item_id, bucket_name, object_key in jobs:
+                on_complete = lambda item, thumbnail=None, item_id=item_id: complete(item_id, item, thumbnail)
+                futures[executor.submit(process_photo, bucket_name, object_key, on_complete)] = item_id
+            for future in as_completed(futures):
+                try:
+                    succeeded = future.result()
+                except Exception as e:
+                    print(f'Unexpected error processing record: {str(e)}')
+                    print(traceback.format_exc())
+                    succeeded = False
+                if not succeeded:
+                    failed_ids.add(futures[future])
+        
+        # A photo missing from the search index or the manifest isn't listed
+        # everywhere, so its record is retried; reprocessing usually finds the
+        # content already indexed
+        if completed:
+            # First, so the manifest entries carry the sprites. A photo left out
+            # of the atlas is shown from its own thumbnail, so this isn't retried.
             try:
-                with Image.open(tmp_photo_path) as img:
-                    # Get original dimensions
-                    original_width, original_height = img.size
-                    print(f'Original dimensions: {original_width}x{original_height}')
-                    
-                    # Calculate thumbnail dimensions (max 200x200, maintain aspect ratio)
-                    img.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.Resampling.LANCZOS)
-                    thumbnail_width, thumbnail_height = img.size
-                    print(f'Thumbnail dimensions: {thumbnail_width}x{thumbnail_height}')
-                    
-                    # Save thumbnail to /tmp
-                    img.save(tmp_thumbnail_path, format=img.format or 'JPEG')
-                    print(f'Saved thumbnail to {tmp_thumbnail_path}')
+                with span('atlas'):
+                    placed = sprite_atlas.add_photos([item for item_id, item in completed], thumbnails)
+                print(f'Placed {placed} thumbnails in the sprite atlas')
+            except (ClientError, BotoCoreError, OSError, sprite_atlas.AtlasConflict) as e:
+                print(f'Sprite atlas update failed: {str(e)}')
             
-            except Exception as e:
-                print(f'Image processing failed: {str(e)}')
-                print(traceback.format_exc())
-                update_metadata_with_error(photo_id, filename, object_key, 'Image processing failed')
-                cleanup_tmp_files(tmp_photo_path, tmp_thumbnail_path)
-                continue
-            
-            # Upload thumbnail to Thumbnail Bucket
-            thumbnail_key = f'thumbnails/{photo_id}/{filename}'
             try:
-                s3_client.upload_file(tmp_thumbnail_path, THUMBNAIL_BUCKET_NAME, thumbnail_key)
-                print(f'Uploaded thumbnail to {thumbnail_key}')
-            except ClientError as e:
-                print(f'Thumbnail upload failed: {str(e)}')
-                update_metadata_with_error(photo_id, filename, object_key, 'Thumbnail upload failed')
-                cleanup_tmp_files(tmp_photo_path, tmp_thumbnail_path)
-                continue
-            
-            # Get file size
-            file_size = os.path.getsize(tmp_photo_path)
+                with span('index'):
+                    search_index.add_photos([item for item_id, item in completed])
+            except (ClientError, BotoCoreError, search_index.IndexWriteFailed) as e:
+                print(f'Search index update failed: {str(e)}')
+                failed_ids.update(item_id for item_id, item in completed)
             
-            # Write metadata to DynamoDB
             try:
-                table = dynamodb.Table(METADATA_TABLE_NAME)
-                upload_date = datetime.utcnow().isoformat() + 'Z'
-                
-                table.put_item(
-                    Item={
-                        'photoId': photo_id,
-                        'filename': filename,
-                        'uploadDate': upload_date,
-                        'fileSize': file_size,
-                        'contentType': get_content_type(filename),
-                        'photoKey': object_key,
-                        'thumbnailKey': thumbnail_key,
-                        'dimensions': {
-                            'width': original_width,
-                            'height': original_height
-                        },
-                        'thumbnailDimensions': {
-                            'width': thumbnail_width,
-                            'height': thumbnail_height
-                        },
-                        'processingStatus': 'completed',
-                        'tags': []
-                    }
-                )
-                print(f'Metadata written to DynamoDB for photo {photo_id}')
-            
-            except ClientError as e:
-                print(f'DynamoDB write failed: {str(e)}')
-                print(traceback.format_exc())
-            
-            # Clean up /tmp files
-            cleanup_tmp_files(tmp_photo_path, tmp_thumbnail_path)
+                with span('manifest'):
+                    gallery_manifest.add_photos([item for item_id, item in completed])
+                print(f'Added {len(completed)} photos to the gallery manifest')
+            except (ClientError, BotoCoreError, gallery_manifest.ManifestConflict) as e:
+                print(f'Gallery manifest update failed: {str(e)}')
+                failed_ids.update(item_id for item_id, item in completed)
+        
+        print(f'Processed {len(jobs)} photos, {len(failed_ids)} failed')
+        count('photosProcessed', len(jobs))
+        count('recordsFailed', len(failed_ids))
+        
+        if is_sqs_event(event):
+            return {
+                'batchItemFailures': [{'itemIdentifier': item_id} for item_id in sorted(failed_ids)]
+            }
+        
+        # A returned response would count as success and drop the event
+        if failed_ids:
+            raise RecordsFailed(f'{len(failed_ids)} of {len(jobs)} records failed')
         
         return {
             'statusCode': 200,
             'body': json.dumps('Thumbnail generation completed')
         }
     
+    except RecordsFailed:
+        raise
+    
     except Exception as e:
         print(f'Unexpected error in lambda_handler: {str(e)}')
         print(traceback.format_exc())
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'Error: {str(e)}')
+        # Raised, so the event is retried; SQS and asynchronous invocations
+        # both treat any returned value as success
+        raise
+
+def is_sqs_event(event):
+    """Whether the invocation is an SQS batch rather than a direct S3 event"""
+    records = event.get('Records', [])
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+def get_photo_jobs(event):
+    """
+    Flatten an S3 or SQS event into (item_id, bucket, key) jobs
+    
+    item_id is the SQS messageId for queued events (a message can carry
+    several S3 records) and the record index for direct S3 events.
+    """
+    jobs = []
+    for index, record in enumerate(event['Records']):
+        if record.get('eventSource') == 'aws:sqs':
+            item_id = record['messageId']
+            s3_records = json.loads(record['body']).get('Records', [])
+        else:
+            item_id = str(index)
+            s3_records = [record]
+        
+        for s3_record in s3_records:
+            bucket_name = s3_record['s3']['bucket']['name']
+            # S3 URL-encodes object keys in event notifications
+            object_key = unquote_plus(s3_record['s3']['object']['key'])
+            jobs.append((item_id, bucket_name, object_key))
+    return jobs
+
+def process_photo(bucket_name, object_key, on_complete, upload_date=None):
+    """
+    Render and store every rendition of one uploaded photo
+    
+    Returns False when the photo could not be processed (error metadata is
+    written where possible), True otherwise. The completed metadata item is
+    passed to on_complete for the gallery manifest, with the encoded
+    thumbnail when one was rendered. upload_date keeps the date
+    of a photo being reprocessed; new uploads are dated when the object was
+    written, so a retried record keeps its date and manifest position.
+    """
+    print(f'Processing photo: {object_key} from bucket: {bucket_name}')
+    
+    # Extract photo ID and filename from key (photos/{photoId}/{filename})
+    key_parts = object_key.split('/')
+    if len(key_parts) < 3 or key_parts[0] != 'photos':
+        print(f'Invalid key format: {object_key}')
+        return True
+    
+    photo_id = key_parts[1]
+    filename = '/'.join(key_parts[2:])
+    
+    # Stream the original from S3 into memory
+    try:
+        response = get_client('s3').get_object(Bucket=bucket_name, Key=object_key)
+        file_size = response['ContentLength']
+    except (ClientError, BotoCoreError) as e:
+        print(f'S3 download failed: {str(e)}')
+        update_metadata_with_error(photo_id, filename, object_key, 'S3 download failed')
+        return False
+    
+    if upload_date is None and 'LastModified' in response:
+        upload_date = response['LastModified'].astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    
+    # Tags chosen at upload time, from the object's user metadata
+    tags = search_index.decode_tags(response.get('Metadata', {}).get(search_index.TAGS_METADATA))
+    
+    # When the ETag is the content MD5, a copy of known content is recognised
+    # before its body is read
+    content_hash = content_index.etag_md5(response)
+    shared = find_shared(content_hash, photo_id) if content_hash else None
+    if shared:
+        response['Body'].close()
+        return share_photo(
+            bucket_name, object_key, photo_id, filename, file_size, tags, content_hash, shared,
+            on_complete, upload_date
+        )
+    
+    try:
+        with span('download'):
+            original_buffer, digest = read_object_body(response['Body'])
+        count('bytesDownloaded', file_size)
+        print(f'Downloaded photo ({file_size} bytes)')
+    except (ClientError, BotoCoreError) as e:
+        print(f'S3 download failed: {str(e)}')
+        update_metadata_with_error(photo_id, filename, object_key, 'S3 download failed')
+        return False
+    
+    if content_hash is None:
+        content_hash = digest
+        shared = find_shared(content_hash, photo_id)
+        if shared:
+            original_buffer.close()
+            return share_photo(
+                bucket_name, object_key, photo_id, filename, file_size, tags, content_hash, shared,
+                on_complete, upload_date
+            )
+    
+    try:
+        rendered = render_photo(original_buffer)
+    
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        # It would be rejected again, so the record isn't retried
+        print(f'Image too large to process: {str(e)}')
+        update_metadata_with_error(photo_id, filename, object_key, 'Image too large to process')
+        count('photosTooLarge')
+        return True
+    
+    except Exception as e:
+        print(f'Image processing failed: {str(e)}')
+        print(traceback.format_exc())
+        update_metadata_with_error(photo_id, filename, object_key, 'Image processing failed')
+        return False
+    
+    finally:
+        # Release the original as soon as it has been decoded
+        original_buffer.close()
+    
+    try:
+        shared = store_renditions(object_key, photo_id, filename, rendered)
+    except (ClientError, BotoCoreError) as e:
+        print(f'Thumbnail upload failed: {str(e)}')
+        update_metadata_with_error(photo_id, filename, object_key, 'Thumbnail upload failed')
+        return False
+    
+    # Index the content so later copies reuse these objects. If this fails, or
+    # a concurrent copy was indexed first, the photo keeps its objects unshared.
+    try:
+        registered = content_index.register(content_hash, photo_id, shared)
+    except (ClientError, BotoCoreError) as e:
+        print(f'Content index write failed: {str(e)}')
+        registered = False
+    
+    # Write metadata to DynamoDB
+    try:
+        item = completed_metadata(photo_id, filename, file_size, tags, shared, upload_date)
+        if registered:
+            item['contentHash'] = content_hash
+        with span('metadata'):
+            previous = put_metadata(item)
+        print(f'Metadata written to DynamoDB for photo {photo_id}')
+    
+    except (ClientError, BotoCoreError) as e:
+        print(f'DynamoDB write failed: {str(e)}')
+        print(traceback.format_exc())
+        return False
+    
+    carry_sprite(item, previous)
+    details, dimensions, outputs = rendered
+    on_complete(item, next(data for rendition, width, height, data in outputs if rendition['name'] == 'thumbnail'))
+    return True
+
+def render_photo(original_buffer):
+    """
+    Decode an original once and render every rendition from it, holding a CPU
+    slot so concurrent records don't oversubscribe the vCPUs Lambda allocates,
+    and the memory its decode takes from DECODE_MEMORY_MB
+
+    Returns (attributes read from EXIF plus the placeholder, (width, height)
+    as displayed, render_renditions outputs). Raises ImageTooLarge, before
+    decoding anything, for images over the limits, and whatever Pillow raises
+    for images it can't read.
+    """
+    with Image.open(original_buffer) as img:
+        # Image.open has already read the EXIF header; nothing is decoded yet
+        details = read_exif(img)
+        
+        # Get original dimensions, as displayed
+        original_width, original_height = img.size
+        if details['orientation'] in (5, 6, 7, 8):
+            original_width, original_height = original_height, original_width
+        print(f'Original dimensions: {original_width}x{original_height}')
+        
+        if original_width * original_height > MAX_IMAGE_PIXELS:
+            raise ImageTooLarge(f'{original_width}x{original_height} is over MAX_IMAGE_PIXELS ({MAX_IMAGE_PIXELS})')
+        
+        # Sizes the decode from the header: a JPEG is drafted for the largest
+        # rendition first, so it counts at 1/2, 1/4 or 1/8 scale
+        draft_for(img, RENDITIONS[0]['maxSize'])
+        needed = decode_bytes(img)
+        if needed > decode_memory.total:
+            raise ImageTooLarge(f'Decoding {img.width}x{img.height} {img.mode} needs {needed >> 20} MB, '
+                                f'over DECODE_MEMORY_MB ({DECODE_MEMORY_MB})')
+        
+        with decode_memory.reserve(needed), cpu_slots:
+            outputs, details['placeholder'] = render_renditions(img, details['orientation'])
+        for rendition, width, height, data in outputs:
+            quality = f', quality {rendition["quality"]}' if 'quality' in rendition else ''
+            print(f'Rendered {rendition["name"]} as {rendition["outputFormat"]}: '
+                  f'{width}x{height} ({len(data)} bytes{quality})')
+    
+    return details, (original_width, original_height), outputs
+
+def store_renditions(object_key, photo_id, filename, rendered):
+    """
+    Upload render_photo output to the thumbnail bucket under photo_id and
+    filename, and return the shared attributes describing the original at
+    object_key and its renditions (see content_index.SHARED_ATTRIBUTES)
+    """
+    details, (original_width, original_height), outputs = rendered
+    renditions = {}
+    for rendition, width, height, data in outputs:
+        output_format = rendition['outputFormat']
+        rendition_key = get_rendition_key(photo_id, filename, rendition)
+        content_type = OUTPUT_FORMATS[output_format][1]
+        
+        with span('upload'):
+            get_client('s3').put_object(
+                Bucket=THUMBNAIL_BUCKET_NAME,
+                Key=rendition_key,
+                Body=data,
+                ContentType=content_type
+            )
+        count('bytesUploaded', len(data))
+        print(f'Uploaded {rendition["name"]} to {rendition_key}')
+        
+        renditions[rendition['name']] = {
+            'key': rendition_key,
+            'width': width,
+            'height': height,
+            'contentType': content_type
         }
+    
+    thumbnail = renditions['thumbnail']
+    return {
+        'photoKey': object_key,
+        'thumbnailKey': thumbnail['key'],
+        'dimensions': {
+            'width': original_width,
+            'height': original_height
+        },
+        'thumbnailDimensions': {
+            'width': thumbnail['width'],
+            'height': thumbnail['height']
+        },
+        'renditions': renditions,
+        'processingVersion': PROCESSING_VERSION,
+        **details
+    }
+
+def find_shared(content_hash, photo_id):
+    """Shared attributes of already-indexed content, referenced by photo_id now; None otherwise"""
+    try:
+        shared = content_index.acquire(content_hash, photo_id)
+    except (ClientError, BotoCoreError) as e:
+        # Dedup is an optimisation; render the photo as if the content were new
+        print(f'Content index lookup failed: {str(e)}')
+        return None
+    if shared:
+        print(f'Photo {photo_id} duplicates indexed content {content_hash}')
+    return shared
+
+def share_photo(bucket_name, object_key, photo_id, filename, file_size, tags, content_hash, shared,
+                on_complete, upload_date=None):
+    """
+    Complete a duplicate upload without rendering it
+    
+    The metadata points at the shared original and renditions, and the
+    uploaded copy is deleted. If the metadata can't be written, the reference
+    find_shared added is dropped again, so the content isn't kept alive for a
+    photo that has no item.
+    """
+    try:
+        item = completed_metadata(photo_id, filename, file_size, tags, shared, upload_date)
+        item['contentHash'] = content_hash
+        with span('metadata'):
+            previous = put_metadata(item)
+        count('photosDeduplicated')
+        print(f'Metadata written to DynamoDB for photo {photo_id} (shared content)')
+    except (ClientError, BotoCoreError) as e:
+        print(f'DynamoDB write failed: {str(e)}')
+        print(traceback.format_exc())
+        # The owner's reference stays: its redelivered event lands here too,
+        # and its item from the first delivery still uses the content
+        if shared['photoKey'] != object_key:
+            try:
+                if content_index.release(content_hash, [photo_id]) is not None:
+                    print(f'Content {content_hash} lost its last reference; its objects are left unreferenced')
+            except (ClientError, BotoCoreError) as e:
+                print(f'Content index update failed: {str(e)}')
+        return False
+    
+    # A redelivered event for the photo that owns the content must keep it
+    if shared['photoKey'] != object_key:
+        try:
+            get_client('s3').delete_object(Bucket=bucket_name, Key=object_key)
+            print(f'Deleted duplicate upload {object_key}')
+        except (ClientError, BotoCoreError) as e:
+            print(f'Failed to delete duplicate upload: {str(e)}')
+    
+    carry_sprite(item, previous)
+    on_complete(item)
+    return True
+
+def carry_sprite(item, previous):
+    """
+    Deal with the sprite of a reprocessed photo, the item put_metadata
+    replaced: a retried record with the same content and renditions keeps its
+    cell, so the atlas update skips it; otherwise the old cell is erased and
+    the photo is placed afresh
+    """
+    sprite = (previous or {}).get('sprite')
+    if not sprite:
+        return
+    unchanged = item.get('contentHash') is not None and all(
+        previous.get(name) == item.get(name) for name in ('contentHash', 'thumbnailKey', 'processingVersion'))
+    try:
+        if unchanged:
+            if sprite_atlas.record_sprite(item['photoId'], sprite):
+                item['sprite'] = sprite
+        else:
+            with span('atlas'):
+                sprite_atlas.remove_photos([previous])
+    except (ClientError, BotoCoreError, OSError, sprite_atlas.AtlasConflict) as e:
+        # The photo is still placed; an old cell left behind goes on a rebuild
+        print(f'Failed to carry over the sprite of photo {item["photoId"]}: {str(e)}')
+
+def completed_metadata(photo_id, filename, file_size, tags, shared, upload_date=None):
+    """Metadata item of a processed photo whose objects are described by shared"""
+    return {
+        'photoId': photo_id,
+        'gallery': GALLERY_PARTITION,
+        'filename': filename,
+        'uploadDate': upload_date or datetime.utcnow().isoformat() + 'Z',
+        'fileSize': file_size,
+        'contentType': get_content_type(filename),
+        'photoKey': shared['photoKey'],
+        'thumbnailKey': shared['thumbnailKey'],
+        'dimensions': shared['dimensions'],
+        'thumbnailDimensions': shared['thumbnailDimensions'],
+        'renditions': shared['renditions'],
+        'processingStatus': 'completed',
+        'tags': tags,
+        # Missing from content indexed before they were extracted
+        **{name: shared[name] for name in SHARED_DETAILS if name in shared}
+    }
 
 def update_metadata_with_error(photo_id, filename, photo_key, error_message):
     """Update metadata with error status"""
     try:
-        table = dynamodb.Table(METADATA_TABLE_NAME)
         upload_date = datetime.utcnow().isoformat() + 'Z'
         
-        table.put_item(
-            Item={
-                'photoId': photo_id,
-                'filename': filename,
-                'uploadDate': upload_date,
-                'photoKey': photo_key,
-                'processingStatus': 'failed',
-                'errorMessage': error_message,
-                'tags': []
-            }
-        )
+        put_metadata({
+            'photoId': photo_id,
+            'filename': filename,
+            'uploadDate': upload_date,
+            'photoKey': photo_key,
+            'processingStatus': 'failed',
+            'errorMessage': error_message,
+            'tags': []
+        })
         print(f'Error metadata written for photo {photo_id}')
     except Exception as e:
         print(f'Failed to write error metadata: {str(e)}')
 
-def cleanup_tmp_files(*file_paths):
-    """Clean up temporary files"""
-    for file_path in file_paths:
+def put_metadata(item):
+    """Write a metadata item through the low-level client; the item it replaced, or None"""
+    response = get_client('dynamodb').put_item(
+        TableName=METADATA_TABLE_NAME,
+        Item={name: serializer.serialize(value) for name, value in item.items()},
+        ReturnValues='ALL_OLD'
+    )
+    if 'Attributes' not in response:
+        return None
+    return {name: deserializer.deserialize(value) for name, value in response['Attributes'].items()}
+
+def fit_within(size, max_size):
+    """Largest size with the same aspect ratio that fits in max_size x max_size"""
+    width, height = size
+    scale = min(max_size / width, max_size / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def draft_for(img, max_size):
+    """
+    Have a JPEG that isn't decoded yet decode at 1/2, 1/4 or 1/8 scale, as
+    long as that still covers REDUCING_GAP times the max_size target; img.size
+    and img.mode then describe what load() will decode. A no-op otherwise.
+    """
+    size = fit_within(img.size, max_size)
+    if size != img.size and REDUCING_GAP is not None:
+        img.draft(None, (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP))
+
+def decode_bytes(img):
+    """
+    Memory that decoding img at its current size and reducing it for the
+    first rendition takes: the decoder's copies of the pixels, plus a quarter
+    for the reduced copy
+    """
+    copies = DECODE_COPIES.get(img.format, 1)
+    return img.width * img.height * MODE_BYTES.get(img.mode, 4) * (4 * copies + 1) // 4
+
+def shrink_to_fit(img, max_size):
+    """
+    Return img scaled to fit within max_size, decoding as few pixels as possible
+    
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale via draft(), and every format
+    gets an integer box reduce() before the final LANCZOS pass. Both stop at
+    REDUCING_GAP times the target size, so the result stays close to a
+    full-resolution resample.
+    """
+    draft_for(img, max_size)
+    size = fit_within(img.size, max_size)
+    
+    # Decodes the original on the first call; a no-op for resized images
+    with span('decode'):
+        img.load()
+    if size == img.size:
+        return img
+    
+    with span('resize'):
+        return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def render_renditions(img, orientation=1):
+    """
+    Render every configured rendition from one decoded image
+    
+    The image is drafted once for the largest rendition, and each smaller
+    rendition is downscaled from the previous one rather than from the
+    original. The largest rendition is turned upright for the EXIF
+    orientation, rather than the original, so the reduced decode still
+    applies; a square bounding box fits the same either way. Metadata is
+    stripped from it too, so no rendition carries any. img is closed once
+    the largest rendition exists, releasing the full decode early.
+    
+    Returns the (rendition, width, height, encoded bytes) tuples, where each
+    rendition dict gains the resolved outputFormat and, for lossy formats, the
+    quality it was encoded at, and a BlurHash of the smallest rendition.
+    """
+    source_format = img.format if img.format in OUTPUT_FORMATS else 'JPEG'
+    current = img
+    outputs = []
+    
+    for index, rendition in enumerate(RENDITIONS):
+        current = shrink_to_fit(current, rendition['maxSize'])
+        if index == 0 and current is not img:
+            # Free the full decode; every other rendition comes from this one
+            img.close()
+        
+        # Palette and bilevel images can only be resized with NEAREST, so
+        # move them to a true-colour mode before the next downscale
+        if current.mode not in RESIZABLE_MODES:
+            current = current.convert('RGBA' if has_alpha(current) else 'RGB')
+        if index == 0:
+            if orientation in ORIENTATION_TRANSPOSE:
+                current = current.transpose(ORIENTATION_TRANSPOSE[orientation])
+            current = strip_metadata(current)
+        
+        transparent = has_transparent_pixels(current)
+        output_format = rendition['format']
+        if output_format == 'SOURCE':
+            output_format = source_format
+        elif output_format == 'AUTO':
+            output_format = 'PNG' if transparent else 'JPEG'
+        
+        with span('encode'):
+            data, quality = encode_within_budget(current, output_format, transparent)
+        
+        resolved = dict(rendition, outputFormat=output_format)
+        if quality is not None:
+            resolved['quality'] = quality
+        outputs.append((resolved, current.width, current.height, data))
+    
+    # The smallest rendition is already upright and in sRGB, and a few
+    # thousand pixels at most, so this costs about a millisecond
+    with span('placeholder'):
+        placeholder = blurhash.encode(current)
+    
+    return outputs, placeholder
+
+def encode_within_budget(img, output_format, transparent):
+    """
+    (encoded bytes, quality) for img, quality None for lossless formats
+
+    Lossy formats get the highest quality from ENCODE_MIN_QUALITY to
+    ENCODE_QUALITY whose output fits the image's byte budget, or the minimum
+    when none does.
+    """
+    img = prepare_for_format(img, output_format, transparent)
+    budget = img.width * img.height * ENCODE_BYTES_PER_PIXEL
+    if output_format not in LOSSY_FORMATS:
+        data = encode_image(img, output_format)
+        if output_format == 'PNG' and len(data) > budget and img.mode in ('RGB', 'RGBA'):
+            quantized = encode_image(img.quantize(256, method=Image.Quantize.FASTOCTREE), output_format)
+            data = min(data, quantized, key=len)
+        return data, None
+    
+    data = encode_image(img, output_format, ENCODE_QUALITY)
+    if len(data) <= budget:
+        return data, ENCODE_QUALITY
+    
+    best = None
+    low, high = ENCODE_MIN_QUALITY, ENCODE_QUALITY - 1
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode_image(img, output_format, quality)
+        if len(data) <= budget:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    # When nothing fits, the last attempt was ENCODE_MIN_QUALITY
+    return best or (data, ENCODE_MIN_QUALITY)
+
+def prepare_for_format(img, output_format, transparent):
+    """img in a mode output_format stores, dropping alpha nothing uses"""
+    # CMYK JPEGs are larger and some browsers render them with inverted colours
+    if output_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    if output_format == 'WEBP':
+        mode = 'RGBA' if transparent else 'RGB'
+        return img if img.mode == mode else img.convert(mode)
+    if output_format == 'PNG' and img.mode in ('RGBA', 'LA') and not transparent:
+        return img.convert(img.mode[:-1])
+    return img
+
+def encode_image(img, output_format, quality=None):
+    """
+    Encode img with settings for small output: progressive and optimized
+    Huffman tables for JPEG, best compression for PNG. Only what is passed
+    here is written, so no EXIF, XMP or ICC profile reaches the output.
+    """
+    options = {}
+    if output_format == 'JPEG':
+        options = {'quality': quality, 'optimize': True, 'progressive': True}
+    elif output_format == 'WEBP':
+        options = {'quality': quality, 'method': 4}
+    elif output_format in ('PNG', 'GIF'):
+        options = {'optimize': True}
+    buffer = io.BytesIO()
+    img.save(buffer, format=output_format, **options)
+    return buffer.getvalue()
+
+def read_exif(img):
+    """
+    Capture details from an opened image's EXIF header
+
+    Returns orientation (1 when missing or invalid), plus captureDate (ISO
+    8601, with the UTC offset when the camera recorded one) and exif (see
+    EXIF_FIELDS) when the header holds them.
+    """
+    capture = {'orientation': 1}
+    try:
+        exif = img.getexif()
+        details = exif.get_ifd(ExifTags.IFD.Exif)
+    except Exception as e:
+        # Corrupt headers raise all sorts; the photo still renders without them
+        print(f'Unreadable EXIF header: {str(e)}')
+        return capture
+    
+    orientation = exif.get(ExifTags.Base.Orientation)
+    if orientation in ORIENTATION_TRANSPOSE:
+        capture['orientation'] = orientation
+    
+    taken = details.get(ExifTags.Base.DateTimeOriginal) or details.get(ExifTags.Base.DateTimeDigitized)
+    capture_date = parse_exif_date(taken, details.get(ExifTags.Base.OffsetTimeOriginal))
+    if capture_date:
+        capture['captureDate'] = capture_date
+    
+    fields = {}
+    for name, (ifd, tag) in EXIF_FIELDS.items():
+        value = exif_value((details if ifd else exif).get(tag))
+        if value is not None:
+            fields[name] = value
+    if fields:
+        capture['exif'] = fields
+    return capture
+
+def parse_exif_date(value, offset):
+    """ISO 8601 form of an EXIF 'YYYY:MM:DD HH:MM:SS' date; None when malformed"""
+    if not isinstance(value, str):
+        return None
+    try:
+        taken = datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    # OffsetTimeOriginal is '+HH:MM'; without it the time is the camera's local time
+    offset = offset.strip('\x00 ') if isinstance(offset, str) else ''
+    if offset:
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f'Cleaned up {file_path}')
-        except Exception as e:
-            print(f'Failed to clean up {file_path}: {str(e)}')
+            return datetime.fromisoformat(taken.isoformat() + offset).isoformat()
+        except ValueError:
+            pass
+    return taken.isoformat()
+
+def exif_value(value):
+    """An EXIF value as a DynamoDB-storable str, int or Decimal; None when unusable"""
+    if isinstance(value, tuple):
+        # ISOSpeedRatings may list several values; the first is the one used
+        value = value[0] if value else None
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'ignore')
+    if isinstance(value, str):
+        value = value.strip('\x00 ')[:MAX_EXIF_STRING]
+        return value or None
+    if isinstance(value, int):
+        return value
+    try:
+        # Rationals such as FNumber; a zero denominator gives nan
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if number != number or number in (float('inf'), float('-inf')):
+        return None
+    return Decimal(str(round(number, 6)))
+
+def strip_metadata(img):
+    """
+    img with no metadata left but transparency, converted to sRGB first when it
+    carries an ICC profile, since the renditions are written without one
+    """
+    icc_profile = img.info.get('icc_profile')
+    if icc_profile and img.mode in ('RGB', 'RGBA', 'CMYK'):
+        # Imported here so uploads without a profile never load LittleCMS
+        from PIL import ImageCms
+        try:
+            img = ImageCms.profileToProfile(
+                img,
+                ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+                get_srgb_profile(),
+                outputMode='RGBA' if img.mode == 'RGBA' else 'RGB'
+            )
+        except (OSError, ImageCms.PyCMSError) as e:
+            # An unusable profile only costs colour accuracy
+            print(f'Colour profile conversion failed: {str(e)}')
+    img.info = {key: img.info[key] for key in ('transparency',) if key in img.info}
+    return img
+
+def get_srgb_profile():
+    """The sRGB profile renditions are converted to, created on first use"""
+    global srgb_profile
+    if srgb_profile is None:
+        from PIL import ImageCms
+        srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+    return srgb_profile
+
+def has_alpha(img):
+    """Whether img carries transparency"""
+    return img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+
+def has_transparent_pixels(img):
+    """Whether any pixel of img is not fully opaque; False for an unused alpha channel"""
+    if img.mode in ('RGBA', 'LA'):
+        return img.getchannel('A').getextrema()[0] < 255
+    return has_alpha(img)
+
+def get_rendition_key(photo_id, filename, rendition):
+    """S3 key for a rendition; the source-format thumbnail keeps the original layout"""
+    if rendition['name'] == 'thumbnail' and rendition['format'] == 'SOURCE':
+        return f'thumbnails/{photo_id}/{filename}'
+    stem = filename.rsplit('.', 1)[0]
+    extension = OUTPUT_FORMATS[rendition['outputFormat']][0]
+    return f'thumbnails/{photo_id}/{rendition["name"]}/{stem}.{extension}'
+
+def read_object_body(body):
+    """Stream an S3 object body into an in-memory buffer, returning it with its MD5 hex digest"""
+    buffer = io.BytesIO()
+    digest = hashlib.md5(usedforsecurity=False)
+    for chunk in body.iter_chunks(chunk_size=READ_CHUNK_SIZE):
+        buffer.write(chunk)
+        digest.update(chunk)
+    buffer.seek(0)
+    return buffer, digest.hexdigest()
 
 def get_content_type(filename):
     """Determine content type from filename"""
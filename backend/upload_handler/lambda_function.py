@@ -1,17 +1,45 @@
 # Upload Handler Lambda Function
-# Generates presigned URLs for photo uploads
+# Generates presigned URLs for photo uploads, either a single POST or the parts
+# of a multipart upload
 
+import base64
 import json
+import math
 import os
+import re
 import uuid
-import boto3
 from botocore.exceptions import ClientError
-
-s3_client = boto3.client('s3')
+from aws_clients import get_client
+from instrumentation import count, instrumented, span
+import search_index
 
 ALLOWED_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/heic', 'image/heif']
 PHOTO_BUCKET_NAME = os.environ.get('PHOTO_BUCKET_NAME', 'photo-gallery-photos')
 
+# Largest upload accepted in either mode (default 50MB)
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 52428800))
+
+# Most files one batch request may ask presigned POSTs for
+MAX_BATCH_FILES = int(os.environ.get('MAX_BATCH_FILES', 100))
+
+# Single presigned POSTs are valid for 5 minutes; multipart part URLs for longer,
+# since a slow link may take a while to reach the last parts of a batch
+UPLOAD_URL_EXPIRATION = int(os.environ.get('UPLOAD_URL_EXPIRATION', 300))
+PART_URL_EXPIRATION = int(os.environ.get('PART_URL_EXPIRATION', 3600))
+
+# Multipart part size and how many part URLs are presigned per call. S3 needs
+# parts of at least 5MB (except the last) and allows at most 10,000 of them.
+PART_SIZE = max(int(os.environ.get('PART_SIZE', 8 * 1024 * 1024)), 5 * 1024 * 1024)
+PART_URL_BATCH = int(os.environ.get('PART_URL_BATCH', 20))
+MAX_PARTS = 10000
+
+# Multipart actions may only touch keys this function hands out
+UPLOAD_KEY_PATTERN = re.compile(r'^photos/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}/[^/]+$')
+
+# S3 errors on complete_multipart_upload that mean the client sent a bad request
+INVALID_UPLOAD_ERRORS = ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall', 'NoSuchUpload')
+
+@instrumented('upload_handler')
 def lambda_handler(event, context):
     """
     Generate presigned URL for photo upload
@@ -19,53 +47,88 @@ def lambda_handler(event, context):
     Expected input:
     {
         "filename": str,
-        "contentType": str
+        "contentType": str,
+        "tags": [str] (optional),
+        "action": str (optional: initiate, parts, listParts, complete, abort)
     }
     
-    Returns:
+    or, for many files at once:
+    {
+        "files": [{"filename": str, "contentType": str, "tags": [str]}]
+    }
+    
+    Tags travel with the object as S3 user metadata, and thumbnail_generator
+    stores and indexes them once the photo is processed.
+    
+    Returns (single POST, the default):
     {
         "uploadUrl": str,
+        "fields": dict,
         "photoId": str,
         "key": str
     }
+    
+    With an action, the multipart result for that action is returned instead;
+    with files, the batch result described in batch_upload_urls.
     """
     try:
         # Parse request body
         if isinstance(event.get('body'), str):
-            body = json.loads(event['body'])
+            raw_body = event['body']
+            # API Gateway base64-encodes request bodies once binary media types are enabled
+            if event.get('isBase64Encoded'):
+                raw_body = base64.b64decode(raw_body)
+            body = json.loads(raw_body)
         else:
             body = event.get('body', event)
         
-        # Validate required parameters
-        filename = body.get('filename')
-        content_type = body.get('contentType')
-        
-        if not filename:
+        # Multipart uploads go through their own actions
+        action = body.get('action')
+        if action is not None:
+            handler = MULTIPART_ACTIONS.get(action)
+            if handler is None:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': f'Unknown action: {action}'
+                    })
+                }
+            try:
+                result = handler(body)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'error': str(e)
+                    })
+                }
             return {
-                'statusCode': 400,
+                'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
-                    'error': 'Missing required parameters: filename and contentType'
-                })
+                'body': json.dumps(result)
             }
         
-        if not content_type:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'error': 'Missing required parameters: filename and contentType'
-                })
-            }
+        # Many files at once: one presigned POST per entry
+        if 'files' in body:
+            return handle_batch_upload(body['files'])
+        
+        # Validate required parameters
+        filename = body.get('filename')
+        content_type = body.get('contentType')
         
-        # Validate content type
-        if content_type not in ALLOWED_CONTENT_TYPES:
+        error = validate_upload(filename, content_type, body.get('tags'))
+        if error:
             return {
                 'statusCode': 400,
                 'headers': {
@@ -73,27 +136,11 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
-                    'error': 'Invalid file type. Only JPEG, PNG, GIF, and HEIC images are allowed.'
+                    'error': error
                 })
             }
         
-        # Generate unique photo ID
-        photo_id = str(uuid.uuid4())
-        
-        # Construct S3 key
-        s3_key = f'photos/{photo_id}/{filename}'
-        
-        # Generate presigned POST URL with 5-minute expiration
-        presigned_post = s3_client.generate_presigned_post(
-            Bucket=PHOTO_BUCKET_NAME,
-            Key=s3_key,
-            Fields={'Content-Type': content_type},
-            Conditions=[
-                {'Content-Type': content_type},
-                ['content-length-range', 0, 52428800]  # Max 50MB
-            ],
-            ExpiresIn=300  # 5 minutes
-        )
+        upload = presign_post(filename, content_type, body.get('tags'))
         
         # Return success response
         return {
@@ -102,12 +149,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'uploadUrl': presigned_post['url'],
-                'fields': presigned_post['fields'],
-                'photoId': photo_id,
-                'key': s3_key
-            })
+            'body': json.dumps(upload)
         }
         
     except ClientError as e:
@@ -135,3 +177,313 @@ def lambda_handler(event, context):
                 'error': 'An unexpected error occurred. Please try again.'
             })
         }
+
+def validate_upload(filename, content_type, tags=None):
+    """The error message for a filename/contentType/tags triple, or None if it can be uploaded"""
+    if not filename or not isinstance(filename, str) or not content_type:
+        return 'Missing required parameters: filename and contentType'
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        return 'Invalid file type. Only JPEG, PNG, GIF, and HEIC images are allowed.'
+    try:
+        search_index.normalize_tags(tags)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def presign_post(filename, content_type, tags=None):
+    """A new photoId and the presigned POST that uploads the file under it"""
+    # Generate unique photo ID
+    photo_id = str(uuid.uuid4())
+    
+    # Construct S3 key
+    s3_key = f'photos/{photo_id}/{filename}'
+    
+    # Every field is also a condition, so the browser can't change them
+    fields = {'Content-Type': content_type}
+    tags = search_index.normalize_tags(tags)
+    if tags:
+        fields[f'x-amz-meta-{search_index.TAGS_METADATA}'] = search_index.encode_tags(tags)
+    
+    # Generate presigned POST URL
+    with span('presign'):
+        presigned_post = get_client('s3').generate_presigned_post(
+            Bucket=PHOTO_BUCKET_NAME,
+            Key=s3_key,
+            Fields=fields,
+            Conditions=[
+                *({name: value} for name, value in fields.items()),
+                ['content-length-range', 0, MAX_UPLOAD_BYTES]
+            ],
+            ExpiresIn=UPLOAD_URL_EXPIRATION
+        )
+    count('urlsSigned')
+    
+    return {
+        'uploadUrl': presigned_post['url'],
+        'fields': presigned_post['fields'],
+        'photoId': photo_id,
+        'key': s3_key
+    }
+
+def handle_batch_upload(files):
+    """Validate a batch upload request and run it"""
+    if not isinstance(files, list) or not files or not all(isinstance(entry, dict) for entry in files):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': 'files must be a non-empty list of {filename, contentType, tags} entries'
+            })
+        }
+    
+    if len(files) > MAX_BATCH_FILES:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'error': f'Too many files: at most {MAX_BATCH_FILES} per request'
+            })
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(batch_upload_urls(files))
+    }
+
+def batch_upload_urls(files):
+    """
+    Presigned POSTs for every valid entry of a batch
+    
+    Entries are validated in one pass; an invalid entry gets an error result
+    instead of failing the whole batch. Results are in request order.
+    
+    Returns:
+    {
+        "results": [{"filename": str, "status": "issued", "uploadUrl": str, "fields": dict,
+                     "photoId": str, "key": str} | {"filename": str, "status": "invalid", "error": str}],
+        "issued": int,
+        "invalid": int
+    }
+    """
+    errors = [validate_upload(entry.get('filename'), entry.get('contentType'), entry.get('tags')) for entry in files]
+    
+    results = []
+    for entry, error in zip(files, errors):
+        if error:
+            results.append({'filename': entry.get('filename'), 'status': 'invalid', 'error': error})
+        else:
+            result = {'filename': entry['filename'], 'status': 'issued'}
+            result.update(presign_post(entry['filename'], entry['contentType'], entry.get('tags')))
+            results.append(result)
+    
+    invalid = sum(1 for error in errors if error)
+    print(f'Batch upload: issued {len(files) - invalid} presigned POSTs, {invalid} invalid')
+    
+    return {
+        'results': results,
+        'issued': len(files) - invalid,
+        'invalid': invalid
+    }
+
+def initiate_upload(body):
+    """
+    Start a multipart upload and presign the first batch of part URLs
+
+    Expects filename, contentType, fileSize and optionally tags; returns
+    uploadId, photoId, key, partSize, partCount and parts ([{partNumber, url}]).
+    """
+    filename = body.get('filename')
+    content_type = body.get('contentType')
+    file_size = body.get('fileSize')
+
+    error = validate_upload(filename, content_type, body.get('tags'))
+    if error:
+        raise ValueError(error)
+    if '/' in filename:
+        raise ValueError('filename must not contain /')
+    if not isinstance(file_size, int) or isinstance(file_size, bool) or file_size <= 0:
+        raise ValueError('fileSize must be a positive integer')
+    if file_size > MAX_UPLOAD_BYTES:
+        raise ValueError(f'File too large. Maximum size is {MAX_UPLOAD_BYTES} bytes.')
+
+    part_size = choose_part_size(file_size)
+    part_count = math.ceil(file_size / part_size)
+
+    photo_id = str(uuid.uuid4())
+    s3_key = f'photos/{photo_id}/{filename}'
+
+    tags = search_index.normalize_tags(body.get('tags'))
+    upload = get_client('s3').create_multipart_upload(
+        Bucket=PHOTO_BUCKET_NAME,
+        Key=s3_key,
+        ContentType=content_type,
+        Metadata={search_index.TAGS_METADATA: search_index.encode_tags(tags)} if tags else {}
+    )
+    upload_id = upload['UploadId']
+    print(f'Started multipart upload {upload_id} for {s3_key}: {part_count} x {part_size} bytes')
+
+    return {
+        'uploadId': upload_id,
+        'photoId': photo_id,
+        'key': s3_key,
+        'partSize': part_size,
+        'partCount': part_count,
+        'parts': presign_parts(s3_key, upload_id, range(1, min(part_count, PART_URL_BATCH) + 1))
+    }
+
+def get_part_urls(body):
+    """Presign another batch of part URLs for partNumbers (also used to refresh expired ones)"""
+    s3_key, upload_id = parse_upload(body)
+    part_numbers = body.get('partNumbers')
+
+    if not isinstance(part_numbers, list) or not part_numbers:
+        raise ValueError('partNumbers must be a non-empty list')
+    if len(part_numbers) > PART_URL_BATCH:
+        raise ValueError(f'At most {PART_URL_BATCH} partNumbers per request')
+    for number in part_numbers:
+        if not isinstance(number, int) or isinstance(number, bool) or not 1 <= number <= MAX_PARTS:
+            raise ValueError(f'partNumbers must be integers from 1 to {MAX_PARTS}')
+
+    return {'parts': presign_parts(s3_key, upload_id, part_numbers)}
+
+def list_uploaded_parts(body):
+    """Parts S3 already holds for an upload, so a client can resume it"""
+    s3_key, upload_id = parse_upload(body)
+    try:
+        parts = fetch_parts(s3_key, upload_id)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchUpload':
+            raise ValueError('Upload not found; it may have been completed or aborted')
+        raise
+    return {
+        'parts': [
+            {'partNumber': part['PartNumber'], 'etag': part['ETag'], 'size': part['Size']}
+            for part in parts
+        ]
+    }
+
+def complete_upload(body):
+    """
+    Finish a multipart upload from the client's [{partNumber, etag}] list
+
+    Presigned part URLs cannot limit how much is sent, so the stored parts are
+    summed first and uploads over MAX_UPLOAD_BYTES are aborted.
+    """
+    s3_key, upload_id = parse_upload(body)
+    parts = body.get('parts')
+
+    if not isinstance(parts, list) or not parts:
+        raise ValueError('parts must be a non-empty list')
+    try:
+        completed = sorted(
+            ({'PartNumber': int(part['partNumber']), 'ETag': str(part['etag'])} for part in parts),
+            key=lambda part: part['PartNumber']
+        )
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each part needs a partNumber and an etag')
+
+    s3_client = get_client('s3')
+    try:
+        total_size = sum(part['Size'] for part in fetch_parts(s3_key, upload_id))
+        if total_size > MAX_UPLOAD_BYTES:
+            s3_client.abort_multipart_upload(Bucket=PHOTO_BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+            raise ValueError(f'File too large. Maximum size is {MAX_UPLOAD_BYTES} bytes.')
+
+        s3_client.complete_multipart_upload(
+            Bucket=PHOTO_BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in INVALID_UPLOAD_ERRORS:
+            raise ValueError(f'Could not complete upload: {code}')
+        raise
+
+    print(f'Completed multipart upload {upload_id} for {s3_key}: {len(completed)} parts, {total_size} bytes')
+    return {'photoId': s3_key.split('/')[1], 'key': s3_key, 'size': total_size}
+
+def abort_upload(body):
+    """Discard an upload and the parts stored for it"""
+    s3_key, upload_id = parse_upload(body)
+    get_client('s3').abort_multipart_upload(Bucket=PHOTO_BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+    print(f'Aborted multipart upload {upload_id} for {s3_key}')
+    return {'aborted': True}
+
+MULTIPART_ACTIONS = {
+    'initiate': initiate_upload,
+    'parts': get_part_urls,
+    'listParts': list_uploaded_parts,
+    'complete': complete_upload,
+    'abort': abort_upload
+}
+
+def parse_upload(body):
+    """The key and uploadId a multipart action refers to"""
+    s3_key = body.get('key')
+    upload_id = body.get('uploadId')
+
+    if not isinstance(s3_key, str) or not UPLOAD_KEY_PATTERN.match(s3_key):
+        raise ValueError('Invalid upload key')
+    if not isinstance(upload_id, str) or not upload_id:
+        raise ValueError('Missing required parameter: uploadId')
+    return s3_key, upload_id
+
+def choose_part_size(file_size):
+    """PART_SIZE, grown in whole MB when the file would otherwise need more than MAX_PARTS parts"""
+    mb = 1024 * 1024
+    return max(PART_SIZE, math.ceil(file_size / MAX_PARTS / mb) * mb)
+
+def presign_parts(s3_key, upload_id, part_numbers):
+    """
+    Presigned upload_part URLs
+
+    Signing is local (no S3 call), so a whole batch costs a few milliseconds.
+    """
+    s3_client = get_client('s3')
+    count('urlsSigned', len(part_numbers))
+    with span('presign'):
+        return [
+            {
+                'partNumber': number,
+                'url': s3_client.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        'Bucket': PHOTO_BUCKET_NAME,
+                        'Key': s3_key,
+                        'UploadId': upload_id,
+                        'PartNumber': number
+                    },
+                    ExpiresIn=PART_URL_EXPIRATION
+                )
+            }
+            for number in part_numbers
+        ]
+
+def fetch_parts(s3_key, upload_id):
+    """Every part S3 holds for an upload, following list_parts pagination"""
+    s3_client = get_client('s3')
+    parts = []
+    marker = 0
+    while True:
+        page = s3_client.list_parts(
+            Bucket=PHOTO_BUCKET_NAME,
+            Key=s3_key,
+            UploadId=upload_id,
+            PartNumberMarker=marker
+        )
+        parts.extend(page.get('Parts', []))
+        if not page.get('IsTruncated'):
+            return parts
+        marker = page['NextPartNumberMarker']
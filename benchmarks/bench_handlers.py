@@ -0,0 +1,457 @@
+# Handler Benchmark Harness
+# Runs each Lambda's lambda_handler in-process against the fakes in fakes.py,
+# one fresh interpreter per scenario, and reports latency, throughput, peak
+# memory and cold-import time as a table and as JSON
+
+import argparse
+import base64
+import contextlib
+import gzip
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCH_DIR, '..', 'backend')
+HANDLERS = ['upload_handler', 'list_photos', 'delete_photo', 'thumbnail_generator']
+
+PHOTO_BUCKET_NAME = 'photo-gallery-photos'
+BULK_DELETE_SIZE = 100
+UPLOAD_BATCH_SIZE = 100
+SQS_BATCH_SIZE = 10
+
+# Multipart scenarios: a file just under the default 50MB cap, in 8MB parts.
+# Stored parts are small stand-ins; the handler only reads their sizes and ETags.
+MULTIPART_FILE_SIZE = 48 * 1024 * 1024
+MULTIPART_PART_COUNT = 6
+
+# Manifest scenarios build the manifest from the whole synthetic gallery before
+# timing starts, which is too slow and too large for the 1M gallery
+MANIFEST_MAX_GALLERY = 100000
+
+# Tag scenarios tag every SEARCH_TAG_EVERY-th photo and index those before
+# timing starts; the fakes scan every written item per query, so they stop at 10k
+SEARCH_TAG_EVERY = 10
+SEARCH_MAX_GALLERY = 10000
+
+def scenarios(args, corpus):
+    """Every (handler, scenario) to run, as worker specs"""
+    specs = []
+    if 'upload_handler' in args.handlers:
+        specs.append({'handler': 'upload_handler', 'scenario': 'presign',
+                      'invocations': args.invocations})
+        specs.append({'handler': 'upload_handler', 'scenario': f'batch-{UPLOAD_BATCH_SIZE}',
+                      'invocations': max(1, args.invocations // 10)})
+        specs.append({'handler': 'upload_handler', 'scenario': 'multipart-initiate',
+                      'invocations': args.invocations})
+        specs.append({'handler': 'upload_handler', 'scenario': 'multipart-complete',
+                      'invocations': args.invocations})
+    for size in args.gallery_sizes:
+        if 'list_photos' in args.handlers:
+            specs.append({'handler': 'list_photos', 'scenario': 'page-50', 'gallery_size': size,
+                          'invocations': args.invocations, 'limit': 50, 'format': 'full',
+                          'env': {'LISTING_SOURCE': 'index'}})
+            specs.append({'handler': 'list_photos', 'scenario': 'page-200-compact-gzip',
+                          'gallery_size': size, 'invocations': args.invocations, 'limit': 200,
+                          'format': 'compact', 'accept_encoding': 'gzip',
+                          'env': {'LISTING_SOURCE': 'index'}})
+            if size <= MANIFEST_MAX_GALLERY:
+                specs.append({'handler': 'list_photos', 'scenario': 'manifest-page-50', 'gallery_size': size,
+                              'invocations': args.invocations, 'limit': 50, 'format': 'full',
+                              'manifest': True})
+            if size <= SEARCH_MAX_GALLERY:
+                specs.append({'handler': 'list_photos', 'scenario': 'tag-page-50', 'gallery_size': size,
+                              'invocations': args.invocations, 'limit': 50, 'format': 'full',
+                              'filters': {'tag': 'beach'}, 'search': True})
+        if 'delete_photo' in args.handlers:
+            specs.append({'handler': 'delete_photo', 'scenario': 'single', 'gallery_size': size,
+                          'invocations': args.invocations})
+            specs.append({'handler': 'delete_photo', 'scenario': f'bulk-{BULK_DELETE_SIZE}',
+                          'gallery_size': size, 'invocations': args.invocations})
+            if size <= MANIFEST_MAX_GALLERY:
+                specs.append({'handler': 'delete_photo', 'scenario': 'single-manifest', 'gallery_size': size,
+                              'invocations': args.invocations, 'manifest': True})
+    if 'thumbnail_generator' in args.handlers:
+        for label, path in corpus:
+            specs.append({'handler': 'thumbnail_generator', 'scenario': f'single-{label}',
+                          'image': path, 'invocations': args.image_invocations})
+        if corpus:
+            label, path = corpus[0]
+            specs.append({'handler': 'thumbnail_generator', 'scenario': f'duplicate-{label}',
+                          'image': path, 'invocations': args.image_invocations, 'duplicates': True})
+            specs.append({'handler': 'thumbnail_generator', 'scenario': f'sqs-batch-{SQS_BATCH_SIZE}-{label}',
+                          'image': path, 'invocations': max(1, args.image_invocations // SQS_BATCH_SIZE),
+                          'batch': SQS_BATCH_SIZE})
+    return specs
+
+def build_corpus(args, tmp):
+    """(label, path) images for thumbnail_generator: --images or the decode benchmark's set"""
+    if 'thumbnail_generator' not in args.handlers:
+        return []
+    if args.images:
+        return [(name, os.path.join(args.images, name)) for name in sorted(os.listdir(args.images))]
+
+    from bench_thumbnail_decode import REFERENCE_SET, make_reference_image
+    corpus = []
+    for label, width, height, image_format in REFERENCE_SET:
+        path = os.path.join(tmp, f'{label}.{image_format.lower()}')
+        make_reference_image(path, width, height, image_format)
+        corpus.append((label, path))
+    return corpus
+
+# Worker side: everything below runs in the per-scenario interpreter
+
+def worker(spec):
+    start = time.perf_counter()
+    os.environ.update(spec.get('env', {}))
+    import fakes
+    backend = fakes.FakeBackend(gallery_size=spec.get('gallery_size', 0))
+    fakes.install(backend)
+    sys.path.insert(0, os.path.join(BACKEND_DIR, 'common'))
+    sys.path.insert(0, os.path.join(BACKEND_DIR, spec['handler']))
+    import lambda_function
+    cold_import = time.perf_counter() - start
+
+    events, check = prepare(spec, backend, fakes)
+    baseline_kb = peak_rss_kb()
+
+    latencies = []
+    items = 0
+    errors = 0
+    wall_start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for event in events:
+            event = event() if callable(event) else event
+            invoke_start = time.perf_counter()
+            try:
+                response = lambda_function.lambda_handler(event, None)
+            except Exception:
+                # thumbnail_generator raises for direct S3 events with failed records
+                response = None
+            latencies.append(time.perf_counter() - invoke_start)
+            processed, ok = check(response)
+            items += processed
+            errors += 0 if ok else 1
+    wall = time.perf_counter() - wall_start
+
+    peak_kb = peak_rss_kb()
+    print(json.dumps({
+        'cold_import_ms': cold_import * 1000,
+        'latencies': latencies,
+        'wall_s': wall,
+        'items': items,
+        'errors': errors,
+        'peak_rss_mb': peak_kb / 1024,
+        'handler_rss_mb': (peak_kb - baseline_kb) / 1024,
+        'calls': backend.calls
+    }))
+
+def prepare(spec, backend, fakes):
+    """
+    Events for the scenario (or callables producing them), and a check that
+    turns each response into (items processed, succeeded)
+    """
+    rng = random.Random(0)
+    count = spec['invocations']
+    handler = spec['handler']
+
+    if spec.get('manifest'):
+        import gallery_manifest
+        gallery_manifest.rebuild(fakes.synthetic_item(i) for i in range(spec['gallery_size']))
+        backend.calls.clear()
+
+    if spec.get('search'):
+        import search_index
+        store = backend.table('photo-gallery-metadata')
+        tagged = []
+        for i in range(0, spec['gallery_size'], SEARCH_TAG_EVERY):
+            item = fakes.synthetic_item(i)
+            item['tags'] = ['beach']
+            store.put(item)
+            tagged.append(item)
+        search_index.add_photos(tagged)
+        backend.calls.clear()
+
+    if handler == 'upload_handler' and spec['scenario'].startswith('batch-'):
+        events = [
+            {'body': json.dumps({'files': [
+                {'filename': f'IMG_{i:05d}_{j:03d}.jpg', 'contentType': 'image/jpeg'}
+                for j in range(UPLOAD_BATCH_SIZE)
+            ]})}
+            for i in range(count)
+        ]
+
+        def posts_issued(response):
+            ok = response['statusCode'] == 200
+            return (json.loads(response['body'])['issued'] if ok else 0), ok
+
+        return events, posts_issued
+
+    if handler == 'upload_handler' and spec['scenario'] == 'multipart-initiate':
+        events = [
+            {'body': json.dumps({'action': 'initiate', 'filename': f'IMG_{i:05d}.heic',
+                                 'contentType': 'image/heic', 'fileSize': MULTIPART_FILE_SIZE})}
+            for i in range(count)
+        ]
+
+        def parts_presigned(response):
+            ok = response['statusCode'] == 200
+            return (len(json.loads(response['body'])['parts']) if ok else 0), ok
+
+        return events, parts_presigned
+
+    if handler == 'upload_handler' and spec['scenario'] == 'multipart-complete':
+        s3_client = fakes.FakeS3(backend, None)
+
+        def complete_event():
+            # The browser's side: start an upload and PUT every part
+            photo_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            key = f'photos/{photo_id}/IMG.heic'
+            upload_id = s3_client.create_multipart_upload(Bucket=PHOTO_BUCKET_NAME, Key=key)['UploadId']
+            parts = []
+            for number in range(1, MULTIPART_PART_COUNT + 1):
+                etag = s3_client.upload_part(Bucket=PHOTO_BUCKET_NAME, Key=key, UploadId=upload_id,
+                                             PartNumber=number, Body=os.urandom(1024))['ETag']
+                parts.append({'partNumber': number, 'etag': etag})
+            return {'body': json.dumps({'action': 'complete', 'key': key, 'uploadId': upload_id,
+                                        'parts': parts})}
+
+        return [complete_event] * count, lambda response: (1, response['statusCode'] == 200)
+
+    if handler == 'upload_handler':
+        events = [
+            {'body': json.dumps({'filename': f'IMG_{i:05d}.jpg', 'contentType': 'image/jpeg'})}
+            for i in range(count)
+        ]
+        return events, lambda response: (1, response['statusCode'] == 200)
+
+    if handler == 'list_photos':
+        # Walk the gallery page by page, starting over at the end
+        cursor = {'value': None}
+
+        def page_event():
+            params = {'limit': str(spec['limit']), 'format': spec['format'], **spec.get('filters', {})}
+            if cursor['value']:
+                params['cursor'] = cursor['value']
+            headers = {'Accept-Encoding': spec['accept_encoding']} if spec.get('accept_encoding') else {}
+            return {'queryStringParameters': params, 'headers': headers}
+
+        def photos_returned(response):
+            body = response['body']
+            if response.get('isBase64Encoded'):
+                body = gzip.decompress(base64.b64decode(body))
+            data = json.loads(body)
+            cursor['value'] = data.get('nextCursor')
+            return len(data.get('photos', [])), response['statusCode'] == 200
+
+        return [page_event] * count, photos_returned
+
+    if handler == 'delete_photo':
+        size = spec['gallery_size']
+        per_event = BULK_DELETE_SIZE if spec['scenario'].startswith('bulk') else 1
+        picks = rng.sample(range(size), min(size, count * per_event))
+        ids = [fakes.synthetic_photo_id(i) for i in picks]
+        if per_event == 1:
+            events = [{'pathParameters': {'photoId': photo_id}} for photo_id in ids]
+            return events, lambda response: (1, response['statusCode'] == 200)
+        events = [
+            {'body': json.dumps({'photoIds': ids[i:i + per_event]})}
+            for i in range(0, len(ids), per_event)
+        ]
+
+        def bulk_deleted(response):
+            report = json.loads(response['body'])
+            return report.get('deleted', 0), response['statusCode'] == 200 and not report.get('failed')
+
+        return events, bulk_deleted
+
+    if handler == 'thumbnail_generator':
+        with open(spec['image'], 'rb') as f:
+            data = f.read()
+        batch = spec.get('batch')
+        events = []
+        for _ in range(count):
+            keys = []
+            for _ in range(batch or 1):
+                key = f'photos/{uuid.uuid4()}/{os.path.basename(spec["image"])}'
+                # Trailing bytes make each copy distinct content (decoders ignore
+                # them), so every invocation renders instead of hitting dedup
+                copy = data if spec.get('duplicates') else data + uuid.uuid4().bytes
+                backend.objects[(PHOTO_BUCKET_NAME, key)] = copy
+                keys.append(key)
+            records = [{'s3': {'bucket': {'name': PHOTO_BUCKET_NAME}, 'object': {'key': key}}} for key in keys]
+            if batch:
+                events.append({'Records': [
+                    {'eventSource': 'aws:sqs', 'messageId': str(uuid.uuid4()),
+                     'body': json.dumps({'Records': [record]})}
+                    for record in records
+                ]})
+            else:
+                events.append({'Records': records})
+        # Direct S3 events raise rather than answer on failure, so count completed metadata items
+        table = backend.tables[os.environ.get('METADATA_TABLE_NAME', 'photo-gallery-metadata')]
+        completed = {'count': 0}
+
+        def thumbnails_made(response):
+            done = sum(1 for item in table.written.values() if item.get('processingStatus') == 'completed')
+            made, completed['count'] = done - completed['count'], done
+            return made, made == (batch or 1)
+
+        return events, thumbnails_made
+
+    raise ValueError(f'Unknown handler: {handler}')
+
+def peak_rss_kb():
+    """Peak RSS of this process in KB (VmHWM, see bench_thumbnail_decode)"""
+    from bench_thumbnail_decode import peak_rss_kb as vm_hwm
+    return vm_hwm()
+
+# Parent side
+
+def run_worker(spec):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(spec)],
+        check=True, capture_output=True, text=True, cwd=BENCH_DIR
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(spec, raw, warmup):
+    timed = sorted(raw['latencies'][warmup:] or raw['latencies'])
+    return {
+        'handler': spec['handler'],
+        'scenario': spec['scenario'],
+        'gallery_size': spec.get('gallery_size'),
+        'invocations': len(raw['latencies']),
+        'first_invoke_ms': raw['latencies'][0] * 1000 if raw['latencies'] else None,
+        'p50_ms': percentile(timed, 50) * 1000,
+        'p99_ms': percentile(timed, 99) * 1000,
+        'mean_ms': sum(timed) / len(timed) * 1000 if timed else 0.0,
+        'invocations_per_s': len(raw['latencies']) / raw['wall_s'] if raw['wall_s'] else 0.0,
+        'items_per_s': raw['items'] / raw['wall_s'] if raw['wall_s'] else 0.0,
+        'errors': raw['errors'],
+        'peak_rss_mb': raw['peak_rss_mb'],
+        'handler_rss_mb': raw['handler_rss_mb'],
+        'cold_import_ms': raw['cold_import_ms'],
+        'calls': raw['calls']
+    }
+
+def result_key(result):
+    return (result['handler'], result['scenario'], result['gallery_size'])
+
+def compare(results, baseline_path, threshold):
+    """Print p50/p99 changes against a previous --output file; True if any regressed"""
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+
+    print(f'\nCompared with {baseline_path} (regression threshold {threshold:.0f}%)')
+    regressed = False
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p99_ms', 'peak_rss_mb', 'cold_import_ms'):
+            if before[metric]:
+                change = (result[metric] - before[metric]) / before[metric] * 100
+                flag = ' !' if change > threshold else ''
+                regressed = regressed or bool(flag)
+                changes.append(f'{metric} {change:+.1f}%{flag}')
+        print(f'{label(result):<52} ' + '  '.join(changes))
+    return regressed
+
+def label(result):
+    size = f' @{result["gallery_size"]}' if result['gallery_size'] else ''
+    return f'{result["handler"]}/{result["scenario"]}{size}'
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def int_list(value):
+    return [int(n) for n in value.split(',') if n]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark all four Lambda handlers against in-process fakes')
+    parser.add_argument('--handlers', default=','.join(HANDLERS),
+                        help='comma-separated handlers to run (default: all)')
+    parser.add_argument('--gallery-sizes', type=int_list, default=[1000, 10000, 100000, 1000000],
+                        help='comma-separated synthetic gallery sizes (default: 1000,10000,100000,1000000)')
+    parser.add_argument('--invocations', type=int, default=200,
+                        help='invocations per API scenario (default: 200)')
+    parser.add_argument('--image-invocations', type=int, default=10,
+                        help='thumbnails per image in the corpus (default: 10)')
+    parser.add_argument('--images', help='directory of images for thumbnail_generator (default: generated set)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='leading invocations left out of the percentiles (default: 1)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON from a previous --output run to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent increase that counts as a regression with --compare (default: 10)')
+    parser.add_argument('--instrumentation', default='off', choices=['off', 'json', 'emf'],
+                        help='INSTRUMENTATION mode for the handlers (default: off); the peak RSS '
+                             'column then covers the last invocation only')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(json.loads(args.worker))
+        return
+
+    args.handlers = [h for h in args.handlers.split(',') if h]
+    unknown = set(args.handlers) - set(HANDLERS)
+    if unknown:
+        parser.error(f'unknown handlers: {", ".join(sorted(unknown))}')
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        specs = scenarios(args, build_corpus(args, tmp))
+        print(f'{"scenario":<52} {"p50 ms":>8} {"p99 ms":>8} {"inv/s":>8} {"items/s":>9} '
+              f'{"peak MB":>8} {"import ms":>9}')
+        for spec in specs:
+            spec['env'] = dict(spec.get('env', {}), INSTRUMENTATION=args.instrumentation)
+            result = summarize(spec, run_worker(spec), args.warmup)
+            results.append(result)
+            errors = f'  {result["errors"]} errors' if result['errors'] else ''
+            print(f'{label(result):<52} {result["p50_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                  f'{result["invocations_per_s"]:>8.1f} {result["items_per_s"]:>9.1f} '
+                  f'{result["peak_rss_mb"]:>8.1f} {result["cold_import_ms"]:>9.1f}{errors}')
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k not in ('worker', 'output', 'compare')}
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nWrote {args.output}')
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# List Serialization Benchmark
+# Per-item cost of turning a DynamoDB query page into the /photos body: the old
+# resource-layer path (TypeDeserializer, convert_decimals) vs list_photos'
+# single pass over the typed attributes
+
+import argparse
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+from boto3.dynamodb.types import TypeDeserializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'list_photos'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'common'))
+
+import lambda_function
+
+class FixedUrls:
+    """Same URL for every key, so only serialization is measured"""
+    url = 'https://photo-gallery-thumbnails.s3.amazonaws.com/thumbnails/x/y.jpg?X-Amz-Signature=' + '0' * 64
+
+    def get_url(self, bucket, key, now=None):
+        return self.url
+
+def make_items(count):
+    """Query items in the wire format the low-level client returns"""
+    def rendition(name, size, content_type):
+        return {'M': {
+            'key': {'S': f'thumbnails/{name}'},
+            'width': {'N': str(size)},
+            'height': {'N': str(size * 3 // 4)},
+            'contentType': {'S': content_type}
+        }}
+
+    items = []
+    for i in range(count):
+        photo_id = f'{i:08d}-4f1c-4b8e-9a57-3d2a{i:08x}'
+        items.append({
+            'photoId': {'S': photo_id},
+            'filename': {'S': f'IMG_{i:05d}.jpg'},
+            'uploadDate': {'S': f'2024-03-{i % 28 + 1:02d}T12:{i % 60:02d}:00.000000'},
+            'fileSize': {'N': str(2_000_000 + i * 37)},
+            'photoKey': {'S': f'photos/{photo_id}/IMG_{i:05d}.jpg'},
+            'thumbnailKey': {'S': f'thumbnails/{photo_id}/IMG_{i:05d}.jpg'},
+            'tags': {'L': [{'S': 'holiday'}]},
+            'dimensions': {'M': {'width': {'N': '4032'}, 'height': {'N': '3024'}}},
+            'thumbnailDimensions': {'M': {'width': {'N': '300'}, 'height': {'N': '225'}}},
+            'renditions': {'M': {
+                'thumbnail': rendition('thumbnail', 300, 'image/jpeg'),
+                'thumbnail_webp': rendition('thumbnail_webp', 300, 'image/webp'),
+                'preview': rendition('preview', 800, 'image/jpeg'),
+                'preview_webp': rendition('preview_webp', 800, 'image/webp')
+            }},
+            'processingStatus': {'S': 'completed'}
+        })
+    return items
+
+def convert_decimals(obj):
+    """list_photos' former Decimal conversion"""
+    if isinstance(obj, list):
+        return [convert_decimals(i) for i in obj]
+    elif isinstance(obj, dict):
+        return {k: convert_decimals(v) for k, v in obj.items()}
+    elif isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    else:
+        return obj
+
+def resource_path(items, urls):
+    """Table.query deserialization followed by the former per-item loop"""
+    deserializer = TypeDeserializer()
+    items = [{k: deserializer.deserialize(v) for k, v in item.items()} for item in items]
+
+    photos = []
+    for item in items:
+        if item.get('processingStatus') == 'failed':
+            continue
+        renditions = {}
+        for name, rendition in item.get('renditions', {}).items():
+            renditions[name] = {
+                'url': urls.get_url('thumbnails', rendition['key']),
+                'width': int(rendition['width']),
+                'height': int(rendition['height']),
+                'contentType': rendition['contentType']
+            }
+        photos.append({
+            'photoId': item['photoId'],
+            'filename': item['filename'],
+            'uploadDate': item['uploadDate'],
+            'fileSize': int(item.get('fileSize', 0)),
+            'thumbnailUrl': urls.get_url('thumbnails', item['thumbnailKey']),
+            'photoUrl': urls.get_url('photos', item['photoKey']),
+            'tags': item.get('tags', []),
+            'dimensions': convert_decimals(item.get('dimensions', {})),
+            'thumbnailDimensions': convert_decimals(item.get('thumbnailDimensions', {})),
+            'renditions': renditions,
+            'placeholder': item.get('placeholder'),
+            'sprite': convert_decimals(item['sprite']) if 'sprite' in item else None
+        })
+    return json.dumps({'photos': photos, 'nextCursor': None}, separators=(',', ':'))
+
+def typed_path(items, urls):
+    photos = [
+        lambda_function.format_photo(item, urls) for item in items
+        if item.get('processingStatus', {}).get('S') != 'failed'
+    ]
+    return json.dumps({'photos': photos, 'nextCursor': None}, separators=(',', ':'))
+
+def best_of(repeat, fn, *args):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='list_photos serialization benchmark')
+    parser.add_argument('--sizes', default='50,200,1000,10000',
+                        help='comma-separated items per page (default: 50,200,1000,10000)')
+    parser.add_argument('--repeat', type=int, default=5, help='best-of runs per case (default: 5)')
+    args = parser.parse_args()
+
+    urls = FixedUrls()
+
+    print(f'{"items":>7}  {"before us/item":>14}  {"after us/item":>13}  {"speedup":>7}')
+    for size in (int(n) for n in args.sizes.split(',')):
+        items = make_items(size)
+        before, old_body = best_of(args.repeat, resource_path, items, urls)
+        after, new_body = best_of(args.repeat, typed_path, items, urls)
+        if json.loads(old_body) != json.loads(new_body):
+            sys.exit('Bodies differ between the two paths')
+        print(f'{size:>7}  {before / size * 1e6:>14.1f}  {after / size * 1e6:>13.1f}  '
+              f'{before / after:>6.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# Thumbnail Decode Benchmark
+# Wall time and peak RSS per megapixel for thumbnail_generator's reduced decode,
+# with a quality check against a full-resolution LANCZOS reference
+
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+THUMBNAIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'thumbnail_generator')
+
+# (label, width, height, format)
+REFERENCE_SET = [
+    ('jpeg-4mp', 2448, 1632, 'JPEG'),
+    ('jpeg-12mp', 4032, 3024, 'JPEG'),
+    ('jpeg-24mp', 6000, 4000, 'JPEG'),
+    ('png-4mp', 2448, 1632, 'PNG'),
+    ('png-12mp', 4032, 3024, 'PNG'),
+    ('webp-12mp', 4032, 3024, 'WEBP'),
+    ('gif-4mp', 2448, 1632, 'GIF')
+]
+
+def make_reference_image(path, width, height, image_format):
+    """Photo-like test image: smooth gradients with high-frequency detail on top"""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(width * height)
+    img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(5, max(6, width // 20))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    img = img.filter(ImageFilter.GaussianBlur(1))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    img = Image.blend(img, noise, 0.15)
+    save_args = {'quality': 90} if image_format in ('JPEG', 'WEBP') else {}
+    img.save(path, format=image_format, **save_args)
+
+def run_worker(image_path, reducing_gap, output_path):
+    """Time one thumbnail in a fresh interpreter so peak RSS is per case"""
+    env = dict(os.environ, THUMBNAIL_REDUCING_GAP=reducing_gap)
+    result = subprocess.run(
+        [sys.executable, __file__, '--worker', image_path, output_path],
+        env=env, check=True, capture_output=True, text=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def worker(image_path, output_path):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    sys.path.insert(0, os.path.join(THUMBNAIL_DIR, '..', 'common'))
+    sys.path.insert(0, THUMBNAIL_DIR)
+    import lambda_function
+    from PIL import Image
+
+    with open(image_path, 'rb') as f:
+        data = io.BytesIO(f.read())
+    baseline_kb = peak_rss_kb()
+
+    start = time.perf_counter()
+    with Image.open(data) as img:
+        megapixels = img.width * img.height / 1e6
+        thumbnail = lambda_function.shrink_to_fit(img, lambda_function.THUMBNAIL_MAX_SIZE)
+        thumbnail.convert('RGB').save(output_path, format='PNG')
+    elapsed = time.perf_counter() - start
+
+    peak_kb = peak_rss_kb()
+    print(json.dumps({
+        'seconds': elapsed,
+        'megapixels': megapixels,
+        'peak_rss_mb': peak_kb / 1024,
+        'decode_rss_mb': (peak_kb - baseline_kb) / 1024
+    }))
+
+def peak_rss_kb():
+    """Peak RSS of this process in KB
+
+    Linux keeps ru_maxrss across fork/exec, so a worker would report the
+    parent's peak; VmHWM belongs to the current address space only.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def mean_abs_error(path_a, path_b):
+    from PIL import Image, ImageChops, ImageStat
+
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        diff = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+        return sum(ImageStat.Stat(diff).mean) / 3
+
+def main():
+    parser = argparse.ArgumentParser(description='Thumbnail decode benchmark')
+    parser.add_argument('--images', help='directory of reference images (default: generated set)')
+    parser.add_argument('--reducing-gap', default='2.0', help='fast-path gap to test (default: 2.0)')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='max mean absolute error vs full decode, 0-255 scale (default: 2.0)')
+    parser.add_argument('--worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.images:
+            cases = [(name, os.path.join(args.images, name)) for name in sorted(os.listdir(args.images))]
+        else:
+            cases = []
+            for label, width, height, image_format in REFERENCE_SET:
+                path = os.path.join(tmp, f'{label}.{image_format.lower()}')
+                make_reference_image(path, width, height, image_format)
+                cases.append((label, path))
+
+        print(f'{"image":<14} {"MP":>5}  {"full ms/MP":>10} {"fast ms/MP":>10}  '
+              f'{"full MB":>8} {"fast MB":>8}  {"MAE":>5}')
+        failures = []
+        for label, path in cases:
+            full_out = os.path.join(tmp, f'{label}-full.png')
+            fast_out = os.path.join(tmp, f'{label}-fast.png')
+            full = run_worker(path, 'off', full_out)
+            fast = run_worker(path, args.reducing_gap, fast_out)
+            error = mean_abs_error(full_out, fast_out)
+            mp = full['megapixels']
+            print(f'{label:<14} {mp:>5.1f}  {full["seconds"] * 1000 / mp:>10.1f} '
+                  f'{fast["seconds"] * 1000 / mp:>10.1f}  {full["peak_rss_mb"]:>8.1f} '
+                  f'{fast["peak_rss_mb"]:>8.1f}  {error:>5.2f}')
+            if error > args.tolerance:
+                failures.append(label)
+
+        if failures:
+            print(f'Quality tolerance {args.tolerance} exceeded for: {", ".join(failures)}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
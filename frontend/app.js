@@ -4,10 +4,48 @@
 const API_BASE_URL =
   "https://njoff2es13.execute-api.us-east-1.amazonaws.com/prod";
 
+// Number of photos requested per /photos page
+const PAGE_SIZE = 50;
+
+// Largest photoIds list the bulk delete endpoint accepts
+const BULK_DELETE_SIZE = 1000;
+
+// Files above this size upload in parts, several at a time, and can resume
+const MULTIPART_THRESHOLD = 16 * 1024 * 1024;
+const PART_CONCURRENCY = 4;
+const PART_RETRIES = 3;
+
+// Small files are presigned UPLOAD_BATCH_SIZE per /upload call (at most
+// upload_handler's MAX_BATCH_FILES) and posted UPLOAD_CONCURRENCY at a time
+const UPLOAD_BATCH_SIZE = 50;
+const UPLOAD_CONCURRENCY = 6;
+
+// Part URLs presigned per request; matches upload_handler's PART_URL_BATCH
+const PART_URL_BATCH = 20;
+
+// Typing in a filter box reloads the gallery once this long after the last key
+const FILTER_DEBOUNCE_MS = 300;
+
+// WebP renditions are smaller, so prefer them wherever the browser decodes them
+const SUPPORTS_WEBP = document
+  .createElement("canvas")
+  .toDataURL("image/webp")
+  .startsWith("data:image/webp");
+
+// BlurHash placeholders are decoded this many pixels wide, then stretched
+// over the tile; the blur hides the scaling
+const PLACEHOLDER_WIDTH = 32;
+
 // State
 let allPhotos = [];
-let filteredPhotos = [];
+// The same photos by photoId, for the lookups each card makes
+let photosById = new Map();
 let currentPhotoId = null;
+let selectedPhotoIds = new Set();
+let nextCursor = null;
+let isLoadingPage = false;
+let galleryGeneration = 0;
+let filterTimer = null;
 
 // Initialize app when DOM is loaded
 document.addEventListener("DOMContentLoaded", () => {
@@ -16,6 +54,9 @@ document.addEventListener("DOMContentLoaded", () => {
   // Set up event listeners
   setupEventListeners();
 
+  // Load the next page whenever the end of the grid scrolls into view
+  setupInfiniteScroll();
+
   // Load gallery on page load
   loadGallery();
 });
@@ -27,30 +68,52 @@ function setupEventListeners() {
   const fileNameSpan = document.getElementById("file-name");
 
   photoInput.addEventListener("change", (e) => {
-    const fileName = e.target.files[0]?.name || "No file chosen";
-    fileNameSpan.textContent = fileName;
+    const files = e.target.files;
+    fileNameSpan.textContent =
+      files.length > 1
+        ? `${files.length} files chosen`
+        : files[0]?.name || "No file chosen";
   });
 
   uploadForm.addEventListener("submit", async (e) => {
     e.preventDefault();
-    const file = photoInput.files[0];
-    if (file) {
-      await uploadPhoto(file);
+    const files = [...photoInput.files];
+    if (files.length > 0) {
+      await uploadPhotos(files);
     }
   });
 
-  // Filter controls
-  const tagSearch = document.getElementById("tag-search");
+  // Photos dropped on the upload form are uploaded straight away
+  uploadForm.addEventListener("dragover", (e) => {
+    e.preventDefault();
+  });
+
+  uploadForm.addEventListener("drop", async (e) => {
+    e.preventDefault();
+    const files = [...e.dataTransfer.files].filter((file) =>
+      photoInput.accept.split(",").includes(file.type),
+    );
+    if (files.length > 0) {
+      await uploadPhotos(files);
+    }
+  });
+
+  // Filter controls: /photos filters on the server, so each change reloads
+  // the gallery from its first page
+  const nameSearch = document.getElementById("tag-search");
+  const tagFilter = document.getElementById("tag-filter");
   const dateStart = document.getElementById("date-start");
   const dateEnd = document.getElementById("date-end");
   const clearFilters = document.getElementById("clear-filters");
 
-  tagSearch.addEventListener("input", applyFilters);
+  nameSearch.addEventListener("input", scheduleFilters);
+  tagFilter.addEventListener("input", scheduleFilters);
   dateStart.addEventListener("change", applyFilters);
   dateEnd.addEventListener("change", applyFilters);
 
   clearFilters.addEventListener("click", () => {
-    tagSearch.value = "";
+    nameSearch.value = "";
+    tagFilter.value = "";
     dateStart.value = "";
     dateEnd.value = "";
     applyFilters();
@@ -72,6 +135,18 @@ function setupEventListeners() {
     }
   });
 
+  // Bulk delete
+  const deleteSelected = document.getElementById("delete-selected");
+  deleteSelected.addEventListener("click", async () => {
+    const count = selectedPhotoIds.size;
+    if (
+      count > 0 &&
+      confirm(`Are you sure you want to delete ${count} selected photos?`)
+    ) {
+      await deletePhotos([...selectedPhotoIds]);
+    }
+  });
+
   // Close modal when clicking outside
   modal.addEventListener("click", (e) => {
     if (e.target === modal) {
@@ -82,162 +157,682 @@ function setupEventListeners() {
 
 // API Functions
 
-async function uploadPhoto(file) {
+async function uploadPhotos(files) {
   const statusDiv = document.getElementById("upload-status");
+  const small = files.filter((file) => file.size <= MULTIPART_THRESHOLD);
+  const large = files.filter((file) => file.size > MULTIPART_THRESHOLD);
+  const failures = [];
+  let uploaded = 0;
 
-  try {
-    statusDiv.className = "status-message info";
-    statusDiv.textContent = "Uploading photo...";
-    statusDiv.style.display = "block";
+  statusDiv.className = "status-message info";
+  statusDiv.style.display = "block";
 
-    console.log("Requesting upload URL for:", file.name, file.type);
+  const reportProgress = (detail = "") => {
+    statusDiv.textContent =
+      files.length === 1
+        ? `Uploading photo...${detail}`
+        : `Uploading photos... ${uploaded + failures.length} of ${files.length}${detail}`;
+  };
+  reportProgress();
 
-    // Step 1: Get presigned URL from backend
-    const response = await fetch(`${API_BASE_URL}/upload`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({
-        filename: file.name,
-        contentType: file.type,
-      }),
-    });
+  const recordFailure = (file, error) => {
+    console.error("Upload error:", file.name, error);
+    failures.push(`${file.name}: ${error.message}`);
+    reportProgress();
+  };
 
-    console.log("Upload URL response status:", response.status);
+  // Small files: one /upload call presigns a whole batch, then the batch is
+  // posted to S3 through a bounded pool
+  for (let i = 0; i < small.length; i += UPLOAD_BATCH_SIZE) {
+    const batch = small.slice(i, i + UPLOAD_BATCH_SIZE);
 
-    if (!response.ok) {
-      const error = await response.json();
-      throw new Error(error.error || "Failed to get upload URL");
+    let results;
+    try {
+      results = await requestUploadUrls(batch);
+    } catch (error) {
+      batch.forEach((file) => recordFailure(file, error));
+      continue;
     }
 
-    const data = await response.json();
-
-    // Step 2: Upload file directly to S3 using presigned URL
-    const formData = new FormData();
-    Object.keys(data.fields).forEach((key) => {
-      formData.append(key, data.fields[key]);
-    });
-    formData.append("file", file);
-
-    const uploadResponse = await fetch(data.uploadUrl, {
-      method: "POST",
-      body: formData,
+    await runPool(batch, UPLOAD_CONCURRENCY, async (file, index) => {
+      try {
+        const result = results[index];
+        if (result.status !== "issued") {
+          throw new Error(result.error);
+        }
+        await postToS3(file, result);
+        uploaded += 1;
+        reportProgress();
+      } catch (error) {
+        recordFailure(file, error);
+      }
     });
+  }
 
-    if (!uploadResponse.ok) {
-      throw new Error("Failed to upload photo to S3");
+  // Large files: one at a time, each already sending several parts in parallel
+  for (const file of large) {
+    try {
+      await uploadMultipart(file, (percent) => reportProgress(` (${file.name} ${percent}%)`));
+      uploaded += 1;
+      reportProgress();
+    } catch (error) {
+      recordFailure(file, error);
     }
+  }
 
+  if (failures.length > 0) {
+    statusDiv.className = "status-message error";
+    const shown = failures.slice(0, 5).join("; ");
+    const more = failures.length > 5 ? ` (and ${failures.length - 5} more)` : "";
+    statusDiv.textContent = `Upload failed: ${shown}${more}`;
+    if (uploaded > 0) {
+      statusDiv.textContent = `${uploaded} of ${files.length} photos uploaded. ${statusDiv.textContent}`;
+    }
+  } else {
     statusDiv.className = "status-message success";
     statusDiv.textContent =
-      "Photo uploaded successfully! Processing thumbnail...";
+      files.length === 1
+        ? "Photo uploaded successfully! Processing thumbnail..."
+        : `${uploaded} photos uploaded successfully! Processing thumbnails...`;
 
     // Reset form
     document.getElementById("upload-form").reset();
     document.getElementById("file-name").textContent = "No file chosen";
+  }
 
+  if (uploaded > 0) {
     // Reload gallery after a short delay to allow thumbnail processing
     setTimeout(() => {
       loadGallery();
-      statusDiv.style.display = "none";
+      if (failures.length === 0) {
+        statusDiv.style.display = "none";
+      }
     }, 3000);
+  }
+}
+
+async function requestUploadUrls(files) {
+  console.log(`Requesting upload URLs for ${files.length} files`);
+
+  const response = await fetch(`${API_BASE_URL}/upload`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      files: files.map((file) => ({
+        filename: file.name,
+        contentType: file.type,
+        tags: uploadTags(),
+      })),
+    }),
+  });
+
+  console.log("Upload URL response status:", response.status);
+
+  const data = await response.json();
+  if (!response.ok) {
+    throw new Error(data.error || "Failed to get upload URLs");
+  }
+  return data.results;
+}
+
+async function postToS3(file, upload) {
+  // Upload file directly to S3 using the presigned POST
+  const formData = new FormData();
+  Object.keys(upload.fields).forEach((key) => {
+    formData.append(key, upload.fields[key]);
+  });
+  formData.append("file", file);
+
+  const uploadResponse = await fetch(upload.uploadUrl, {
+    method: "POST",
+    body: formData,
+  });
+
+  if (!uploadResponse.ok) {
+    throw new Error("Failed to upload photo to S3");
+  }
+}
+
+// Run task(item, index) over items with at most `limit` running at once
+async function runPool(items, limit, task) {
+  let next = 0;
+  const worker = async () => {
+    while (next < items.length) {
+      const index = next++;
+      await task(items[index], index);
+    }
+  };
+  await Promise.all(
+    Array.from({ length: Math.min(limit, items.length) }, worker),
+  );
+}
+
+// Multipart uploads: the file goes to S3 in parts, PART_CONCURRENCY at a time.
+// The upload's IDs are kept in localStorage until it completes, so choosing the
+// same file again after a failure or reload only sends the missing parts.
+
+async function uploadMultipart(file, onProgress) {
+  const stateKey = multipartStateKey(file);
+  const upload = await startOrResumeUpload(file, stateKey);
+
+  const pending = [];
+  for (let partNumber = 1; partNumber <= upload.partCount; partNumber++) {
+    if (!upload.done.has(partNumber)) {
+      pending.push(partNumber);
+    }
+  }
+
+  const reportProgress = () => {
+    onProgress(Math.floor((upload.done.size / upload.partCount) * 100));
+  };
+  reportProgress();
+
+  const uploadNextParts = async () => {
+    while (pending.length > 0) {
+      const partNumber = pending.shift();
+      const start = (partNumber - 1) * upload.partSize;
+      const blob = file.slice(start, start + upload.partSize);
+      try {
+        upload.done.set(partNumber, await uploadPart(upload, partNumber, blob));
+      } catch (error) {
+        // Stop the other workers; parts already sent stay in S3 for a resume
+        pending.length = 0;
+        throw error;
+      }
+      reportProgress();
+    }
+  };
+
+  try {
+    await Promise.all(
+      Array.from(
+        { length: Math.min(PART_CONCURRENCY, pending.length) },
+        uploadNextParts,
+      ),
+    );
+
+    const parts = [...upload.done].map(([partNumber, etag]) => ({
+      partNumber,
+      etag,
+    }));
+    await uploadAction({
+      action: "complete",
+      key: upload.key,
+      uploadId: upload.uploadId,
+      parts,
+    });
   } catch (error) {
-    console.error("Upload error:", error);
-    statusDiv.className = "status-message error";
-    statusDiv.style.display = "block";
-    statusDiv.textContent = `Upload failed: ${error.message}`;
+    throw new Error(
+      `${error.message}. Choose the same file again to resume the upload.`,
+    );
+  }
+
+  localStorage.removeItem(stateKey);
+}
+
+function multipartStateKey(file) {
+  return `multipart-upload:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function startOrResumeUpload(file, stateKey) {
+  const saved = JSON.parse(localStorage.getItem(stateKey) || "null");
+
+  if (saved) {
+    try {
+      const data = await uploadAction({
+        action: "listParts",
+        key: saved.key,
+        uploadId: saved.uploadId,
+      });
+      console.log(
+        `Resuming upload ${saved.uploadId}: ${data.parts.length} of ${saved.partCount} parts already sent`,
+      );
+      return {
+        ...saved,
+        done: new Map(data.parts.map((part) => [part.partNumber, part.etag])),
+        urls: new Map(),
+        urlRequest: null,
+      };
+    } catch (error) {
+      console.warn("Could not resume upload, starting over:", error);
+      localStorage.removeItem(stateKey);
+    }
+  }
+
+  const data = await uploadAction({
+    action: "initiate",
+    filename: file.name,
+    contentType: file.type,
+    fileSize: file.size,
+    tags: uploadTags(),
+  });
+
+  const upload = {
+    key: data.key,
+    uploadId: data.uploadId,
+    photoId: data.photoId,
+    partSize: data.partSize,
+    partCount: data.partCount,
+  };
+  localStorage.setItem(stateKey, JSON.stringify(upload));
+
+  return {
+    ...upload,
+    done: new Map(),
+    urls: new Map(data.parts.map((part) => [part.partNumber, part.url])),
+    urlRequest: null,
+  };
+}
+
+async function uploadPart(upload, partNumber, blob) {
+  for (let attempt = 1; ; attempt++) {
+    const url = await partUrl(upload, partNumber);
+    try {
+      const response = await fetch(url, { method: "PUT", body: blob });
+      if (!response.ok) {
+        // Most likely an expired URL; presign this part again before retrying
+        upload.urls.delete(partNumber);
+        throw new Error(`Part ${partNumber} failed with status ${response.status}`);
+      }
+
+      const etag = response.headers.get("ETag");
+      if (!etag) {
+        throw new Error(
+          "S3 did not return the part ETag (the bucket CORS rules must expose it)",
+        );
+      }
+      return etag;
+    } catch (error) {
+      if (attempt >= PART_RETRIES) {
+        throw error;
+      }
+      console.warn(`Retrying part ${partNumber}:`, error);
+      await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+    }
   }
 }
 
+async function partUrl(upload, partNumber) {
+  // Workers share one in-flight request, which presigns the next batch of parts
+  while (!upload.urls.has(partNumber)) {
+    if (!upload.urlRequest) {
+      const partNumbers = [];
+      for (
+        let n = partNumber;
+        n <= upload.partCount && partNumbers.length < PART_URL_BATCH;
+        n++
+      ) {
+        if (!upload.done.has(n) && !upload.urls.has(n)) {
+          partNumbers.push(n);
+        }
+      }
+
+      upload.urlRequest = uploadAction({
+        action: "parts",
+        key: upload.key,
+        uploadId: upload.uploadId,
+        partNumbers,
+      })
+        .then((data) => {
+          data.parts.forEach((part) => upload.urls.set(part.partNumber, part.url));
+        })
+        .finally(() => {
+          upload.urlRequest = null;
+        });
+    }
+    await upload.urlRequest;
+  }
+  return upload.urls.get(partNumber);
+}
+
+async function uploadAction(body) {
+  const response = await fetch(`${API_BASE_URL}/upload`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify(body),
+  });
+
+  const data = await response.json();
+  if (!response.ok) {
+    throw new Error(data.error || `Upload ${body.action} failed`);
+  }
+  return data;
+}
+
 async function loadGallery() {
+  const statusDiv = document.getElementById("gallery-status");
+
+  // Start over from the newest photo; any page still in flight is discarded
+  galleryGeneration += 1;
+  setPhotos([]);
+  nextCursor = null;
+  isLoadingPage = false;
+  selectedPhotoIds.clear();
+  updateSelectionToolbar();
+
+  statusDiv.className = "status-message info";
+  statusDiv.textContent = "Loading photos...";
+  statusDiv.style.display = "block";
+
+  await loadNextPage();
+}
+
+async function loadNextPage() {
   const galleryDiv = document.getElementById("gallery");
   const statusDiv = document.getElementById("gallery-status");
 
+  if (isLoadingPage) return;
+  const generation = galleryGeneration;
+  const isFirstPage = allPhotos.length === 0;
+  let loaded = false;
+  isLoadingPage = true;
+
   try {
-    statusDiv.className = "status-message info";
-    statusDiv.textContent = "Loading photos...";
+    const params = new URLSearchParams({ limit: PAGE_SIZE, format: "compact" });
+    for (const [name, value] of Object.entries(currentFilters())) {
+      if (value) {
+        params.set(name, value);
+      }
+    }
+    if (nextCursor) {
+      params.set("cursor", nextCursor);
+    }
 
-    const response = await fetch(`${API_BASE_URL}/photos`);
+    const response = await fetch(`${API_BASE_URL}/photos?${params}`);
 
     if (!response.ok) {
       throw new Error("Failed to load photos");
     }
 
     const data = await response.json();
-    allPhotos = data.photos || [];
-    filteredPhotos = [...allPhotos];
+    if (generation !== galleryGeneration) return;
+
+    const photos = expandPhotos(data);
+    addPhotos(photos);
+    nextCursor = data.nextCursor || null;
+    loaded = true;
 
     statusDiv.style.display = "none";
 
-    renderGallery();
+    // The first page replaces whatever the previous gallery or filters showed
+    if (isFirstPage) {
+      renderGallery();
+    } else {
+      appendToGallery(photos);
+    }
   } catch (error) {
+    if (generation !== galleryGeneration) return;
     console.error("Load gallery error:", error);
     statusDiv.className = "status-message error";
+    statusDiv.style.display = "block";
     statusDiv.textContent = `Failed to load photos: ${error.message}`;
-    galleryDiv.innerHTML = "";
+    if (isFirstPage) {
+      galleryDiv.innerHTML = "";
+    }
+  } finally {
+    if (generation === galleryGeneration) {
+      isLoadingPage = false;
+    }
+  }
+
+  // A short page may leave the sentinel on screen, which the observer
+  // won't report again, so keep going until the viewport is filled
+  if (
+    loaded &&
+    generation === galleryGeneration &&
+    nextCursor &&
+    isSentinelNearViewport()
+  ) {
+    loadNextPage();
   }
 }
 
+// Rebuild photo objects from a /photos page, full or compact
+function expandPhotos(data) {
+  // Sprites index the page's sheets; keep the sheet URL with each photo
+  const withSheet = (sprite, sheets) =>
+    sprite ? { ...sprite, url: sheets[sprite.sheet] } : null;
+
+  if (data.format !== "compact") {
+    return (data.photos || []).map((photo) => ({
+      ...photo,
+      sprite: withSheet(photo.sprite, data.sheets || []),
+    }));
+  }
+
+  const url = ([prefix, path, query, ...values]) => {
+    let i = 0;
+    const search = data.queryTemplates[query].replace(/\{\}/g, () => values[i++]);
+    return data.urlPrefixes[prefix] + path + (search ? `?${search}` : "");
+  };
+  const dimensions = (value) =>
+    value ? { width: value[0], height: value[1] } : {};
+  const sheets = (data.sheets || []).map(url);
+
+  return data.photos.map((record) => {
+    const row = {};
+    data.fields.forEach((field, i) => {
+      row[field] = record[i];
+    });
+
+    const renditions = {};
+    data.renditionNames.forEach((name, i) => {
+      const rendition = row.renditions[i];
+      if (rendition) {
+        renditions[name] = {
+          width: rendition[0],
+          height: rendition[1],
+          contentType: rendition[2],
+          url: url(rendition[3]),
+        };
+      }
+    });
+
+    return {
+      photoId: row.photoId,
+      filename: row.filename,
+      uploadDate: row.uploadDate,
+      fileSize: row.fileSize,
+      tags: row.tags,
+      dimensions: dimensions(row.dimensions),
+      thumbnailDimensions: dimensions(row.thumbnailDimensions),
+      photoUrl: url(row.photoUrl),
+      thumbnailUrl: url(row.thumbnailUrl),
+      renditions,
+      placeholder: row.placeholder || null,
+      sprite: row.sprite
+        ? withSheet(
+            {
+              sheet: row.sprite[0],
+              x: row.sprite[1],
+              y: row.sprite[2],
+              width: row.sprite[3],
+              height: row.sprite[4],
+            },
+            sheets
+          )
+        : null,
+    };
+  });
+}
+
+function isSentinelNearViewport() {
+  const sentinel = document.getElementById("gallery-sentinel");
+  return sentinel.getBoundingClientRect().top < window.innerHeight + 400;
+}
+
+function setupInfiniteScroll() {
+  const sentinel = document.getElementById("gallery-sentinel");
+
+  const observer = new IntersectionObserver(
+    (entries) => {
+      if (entries.some((entry) => entry.isIntersecting) && nextCursor) {
+        loadNextPage();
+      }
+    },
+    { rootMargin: "400px" }
+  );
+
+  observer.observe(sentinel);
+}
+
+function setPhotos(photos) {
+  allPhotos = photos;
+  photosById = new Map(photos.map((photo) => [photo.photoId, photo]));
+}
+
+function addPhotos(photos) {
+  photos.forEach((photo) => {
+    allPhotos.push(photo);
+    photosById.set(photo.photoId, photo);
+  });
+}
+
+// Renders the whole grid; used for a gallery's first page and once it
+// becomes empty
 function renderGallery() {
   const galleryDiv = document.getElementById("gallery");
 
-  if (filteredPhotos.length === 0) {
-    galleryDiv.innerHTML =
-      '<p style="text-align: center; color: #7f8c8d; grid-column: 1/-1;">No photos found. Upload your first photo!</p>';
+  if (allPhotos.length === 0) {
+    // A filtered page can come back empty with more to read after it
+    const filtered = Object.values(currentFilters()).some((value) => value);
+    galleryDiv.innerHTML = nextCursor
+      ? ""
+      : `<p style="text-align: center; color: #7f8c8d; grid-column: 1/-1;">${
+          filtered
+            ? "No photos match these filters."
+            : "No photos found. Upload your first photo!"
+        }</p>`;
+    return;
+  }
+
+  galleryDiv.innerHTML = allPhotos.map(photoCardHtml).join("");
+  galleryDiv.querySelectorAll(".photo-card").forEach(setupPhotoCard);
+}
+
+// Adds a page's cards after those already shown, leaving them (and the
+// sprites already drawn on them) in place
+function appendToGallery(photos) {
+  const galleryDiv = document.getElementById("gallery");
+  const shown = galleryDiv.children.length;
+  galleryDiv.insertAdjacentHTML("beforeend", photos.map(photoCardHtml).join(""));
+  Array.from(galleryDiv.children).slice(shown).forEach(setupPhotoCard);
+}
+
+function removeFromGallery(photoIds) {
+  setPhotos(allPhotos.filter((p) => !photoIds.has(p.photoId)));
+
+  if (allPhotos.length === 0) {
+    renderGallery();
     return;
   }
+  document.querySelectorAll("#gallery .photo-card").forEach((card) => {
+    if (photoIds.has(card.dataset.photoId)) {
+      card.remove();
+    }
+  });
+}
 
-  galleryDiv.innerHTML = filteredPhotos
-    .map(
-      (photo) => `
-        <div class="photo-card" data-photo-id="${photo.photoId}">
-            <img src="${photo.thumbnailUrl}" alt="${
+function photoCardHtml(photo) {
+  const placeholder = placeholderUrl(photo);
+  const style = placeholder
+    ? ` style="background-image: url('${placeholder}')"`
+    : "";
+  // Photos on a sprite sheet are drawn from it once it loads
+  const thumb = photo.sprite
+    ? `<canvas class="photo-thumb" width="${photo.sprite.width}" height="${
+        photo.sprite.height
+      }" role="img" aria-label="${photo.filename}"${style}></canvas>`
+    : `<img class="photo-thumb" src="${thumbnailSrc(photo)}" alt="${
         photo.filename
-      }" loading="lazy">
-            <div class="photo-info">
-                <h3>${photo.filename}</h3>
-                <p>${formatDate(photo.uploadDate)}</p>
-                <div class="photo-actions">
-                    <button class="btn btn-primary btn-view" data-photo-id="${
-                      photo.photoId
-                    }">View</button>
-                    <button class="btn btn-danger btn-delete" data-photo-id="${
-                      photo.photoId
-                    }">Delete</button>
-                </div>
+      }" loading="lazy" decoding="async"${style}>`;
+  return `
+    <div class="photo-card" data-photo-id="${photo.photoId}">
+        ${thumb}
+        <div class="photo-info">
+            <label class="photo-select">
+                <input type="checkbox" data-photo-id="${photo.photoId}" ${
+    selectedPhotoIds.has(photo.photoId) ? "checked" : ""
+  }> Select
+            </label>
+            <h3>${photo.filename}</h3>
+            <p>${formatDate(photo.uploadDate)}</p>
+            ${
+              photo.tags && photo.tags.length > 0
+                ? `<div class="photo-tags">${photo.tags
+                    .map(
+                      (tag) =>
+                        `<button class="photo-tag" data-tag="${escapeHtml(tag)}">${escapeHtml(tag)}</button>`
+                    )
+                    .join("")}</div>`
+                : ""
+            }
+            <div class="photo-actions">
+                <button class="btn btn-primary btn-view" data-photo-id="${
+                  photo.photoId
+                }">View</button>
+                <button class="btn btn-danger btn-delete" data-photo-id="${
+                  photo.photoId
+                }">Delete</button>
             </div>
         </div>
-    `
-    )
-    .join("");
+    </div>
+`;
+}
+
+// Draws a rendered card's thumbnail and wires up its controls
+function setupPhotoCard(card) {
+  const photoId = card.dataset.photoId;
 
-  // Add event listeners to photo cards
-  galleryDiv.querySelectorAll(".btn-view").forEach((btn) => {
+  const img = card.querySelector("img.photo-thumb");
+  if (img) {
+    clearPlaceholder(img);
+  }
+  const canvas = card.querySelector("canvas.photo-thumb");
+  if (canvas) {
+    drawSprite(canvas);
+  }
+
+  card.querySelector(".btn-view").addEventListener("click", (e) => {
+    e.stopPropagation();
+    viewFullSize(photoId);
+  });
+
+  card.querySelector(".btn-delete").addEventListener("click", async (e) => {
+    e.stopPropagation();
+    if (confirm("Are you sure you want to delete this photo?")) {
+      await deletePhoto(photoId);
+    }
+  });
+
+  // Click on a tag to show only the photos carrying it
+  card.querySelectorAll(".photo-tag").forEach((btn) => {
     btn.addEventListener("click", (e) => {
       e.stopPropagation();
-      const photoId = btn.dataset.photoId;
-      viewFullSize(photoId);
+      document.getElementById("tag-filter").value = btn.dataset.tag;
+      applyFilters();
     });
   });
 
-  galleryDiv.querySelectorAll(".btn-delete").forEach((btn) => {
-    btn.addEventListener("click", async (e) => {
-      e.stopPropagation();
-      const photoId = btn.dataset.photoId;
-      if (confirm("Are you sure you want to delete this photo?")) {
-        await deletePhoto(photoId);
-      }
-    });
+  const label = card.querySelector(".photo-select");
+  label.addEventListener("click", (e) => e.stopPropagation());
+
+  const checkbox = label.querySelector("input");
+  checkbox.addEventListener("change", () => {
+    if (checkbox.checked) {
+      selectedPhotoIds.add(photoId);
+    } else {
+      selectedPhotoIds.delete(photoId);
+    }
+    updateSelectionToolbar();
   });
 
   // Click on card to view full size
-  galleryDiv.querySelectorAll(".photo-card").forEach((card) => {
-    card.addEventListener("click", () => {
-      const photoId = card.dataset.photoId;
-      viewFullSize(photoId);
-    });
-  });
+  card.addEventListener("click", () => viewFullSize(photoId));
 }
 
 async function deletePhoto(photoId) {
@@ -251,12 +846,10 @@ async function deletePhoto(photoId) {
       throw new Error(error.error || "Failed to delete photo");
     }
 
-    // Remove from local state
-    allPhotos = allPhotos.filter((p) => p.photoId !== photoId);
-    filteredPhotos = filteredPhotos.filter((p) => p.photoId !== photoId);
-
-    // Re-render gallery
-    renderGallery();
+    // Remove from local state and the grid
+    removeFromGallery(new Set([photoId]));
+    selectedPhotoIds.delete(photoId);
+    updateSelectionToolbar();
 
     // Show success message
     const statusDiv = document.getElementById("gallery-status");
@@ -271,8 +864,72 @@ async function deletePhoto(photoId) {
   }
 }
 
+async function deletePhotos(photoIds) {
+  const statusDiv = document.getElementById("gallery-status");
+  const deleted = new Set();
+  let failed = 0;
+
+  try {
+    statusDiv.className = "status-message info";
+    statusDiv.textContent = `Deleting ${photoIds.length} photos...`;
+    statusDiv.style.display = "block";
+
+    for (let i = 0; i < photoIds.length; i += BULK_DELETE_SIZE) {
+      const response = await fetch(`${API_BASE_URL}/photos/delete`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+        },
+        body: JSON.stringify({
+          photoIds: photoIds.slice(i, i + BULK_DELETE_SIZE),
+        }),
+      });
+
+      if (!response.ok) {
+        const error = await response.json();
+        throw new Error(error.error || "Failed to delete photos");
+      }
+
+      const data = await response.json();
+      data.results.forEach((result) => {
+        // A photo that is already gone counts as deleted
+        if (result.status === "failed") {
+          failed += 1;
+        } else {
+          deleted.add(result.photoId);
+        }
+      });
+    }
+  } catch (error) {
+    console.error("Bulk delete error:", error);
+    failed = photoIds.length - deleted.size;
+  }
+
+  // Remove from local state and the grid
+  removeFromGallery(deleted);
+  deleted.forEach((photoId) => selectedPhotoIds.delete(photoId));
+  updateSelectionToolbar();
+
+  if (failed > 0) {
+    statusDiv.className = "status-message error";
+    statusDiv.textContent = `Deleted ${deleted.size} photos, ${failed} could not be deleted`;
+  } else {
+    statusDiv.className = "status-message success";
+    statusDiv.textContent = `Deleted ${deleted.size} photos`;
+    setTimeout(() => {
+      statusDiv.style.display = "none";
+    }, 3000);
+  }
+}
+
+function updateSelectionToolbar() {
+  const deleteSelected = document.getElementById("delete-selected");
+  deleteSelected.hidden = selectedPhotoIds.size === 0;
+  deleteSelected.textContent = `Delete selected (${selectedPhotoIds.size})`;
+}
+
 function viewFullSize(photoId) {
-  const photo = allPhotos.find((p) => p.photoId === photoId);
+  const photo = photosById.get(photoId);
   if (!photo) return;
 
   currentPhotoId = photoId;
@@ -283,7 +940,13 @@ function viewFullSize(photoId) {
   const modalDate = document.getElementById("modal-date");
   const modalDimensions = document.getElementById("modal-dimensions");
 
-  modalImage.src = photo.photoUrl;
+  // Smallest rendition that fills the modal, falling back to the original
+  const rendition = pickRendition(
+    photo,
+    window.innerWidth * 0.9,
+    window.innerHeight * 0.8
+  );
+  modalImage.src = rendition ? rendition.url : photo.photoUrl;
   modalFilename.textContent = photo.filename;
   modalDate.textContent = `Uploaded: ${formatDate(photo.uploadDate)}`;
 
@@ -302,39 +965,248 @@ function closeModal() {
   currentPhotoId = null;
 }
 
-// Filter Functions
+// Rendition Selection
 
-function applyFilters() {
-  const tagSearch = document
-    .getElementById("tag-search")
-    .value.toLowerCase()
-    .trim();
-  const dateStart = document.getElementById("date-start").value;
-  const dateEnd = document.getElementById("date-end").value;
-
-  filteredPhotos = allPhotos.filter((photo) => {
-    // Filename search (instead of tags since we don't have tags)
-    if (tagSearch) {
-      const matchesFilename = photo.filename.toLowerCase().includes(tagSearch);
-      if (!matchesFilename) return false;
+function usableRenditions(photo) {
+  return Object.values(photo.renditions || {}).filter(
+    (r) => SUPPORTS_WEBP || r.contentType !== "image/webp"
+  );
+}
+
+function thumbnailSrc(photo) {
+  const webp = photo.renditions && photo.renditions.thumbnail_webp;
+  return SUPPORTS_WEBP && webp ? webp.url : photo.thumbnailUrl;
+}
+
+// Returns the smallest rendition that shows the photo at full sharpness in a
+// boxWidth x boxHeight area, or null when only the original is big enough
+function pickRendition(photo, boxWidth, boxHeight) {
+  const original = photo.dimensions;
+  if (!original || !original.width || !original.height) return null;
+
+  const scale = Math.min(
+    boxWidth / original.width,
+    boxHeight / original.height,
+    1
+  );
+  const neededWidth = Math.ceil(
+    original.width * scale * (window.devicePixelRatio || 1)
+  );
+
+  const fits = usableRenditions(photo)
+    .filter((r) => r.width >= Math.min(neededWidth, original.width))
+    .sort(
+      (a, b) =>
+        a.width - b.width ||
+        (b.contentType === "image/webp") - (a.contentType === "image/webp")
+    );
+
+  return fits.length > 0 ? fits[0] : null;
+}
+
+// Sprite Sheets
+
+// Sheet images by URL, each fetched once while the page is open
+const spriteSheets = new Map();
+
+function loadSpriteSheet(url) {
+  if (!spriteSheets.has(url)) {
+    spriteSheets.set(
+      url,
+      new Promise((resolve, reject) => {
+        const sheet = new Image();
+        sheet.decoding = "async";
+        sheet.onload = () => resolve(sheet);
+        sheet.onerror = reject;
+        sheet.src = url;
+      })
+    );
+  }
+  return spriteSheets.get(url);
+}
+
+// Copies a card's cell out of its sprite sheet, or swaps the canvas for the
+// photo's own thumbnail when the sheet can't be loaded
+function drawSprite(canvas) {
+  const photoId = canvas.closest(".photo-card").dataset.photoId;
+  const photo = photosById.get(photoId);
+  const { url, x, y, width, height } = photo.sprite;
+
+  loadSpriteSheet(url).then(
+    (sheet) => {
+      canvas
+        .getContext("2d")
+        .drawImage(sheet, x, y, width, height, 0, 0, width, height);
+      canvas.style.backgroundImage = "";
+    },
+    () => {
+      const img = document.createElement("img");
+      img.className = "photo-thumb";
+      img.src = thumbnailSrc(photo);
+      img.alt = photo.filename;
+      img.decoding = "async";
+      img.style.backgroundImage = canvas.style.backgroundImage;
+      clearPlaceholder(img);
+      canvas.replaceWith(img);
     }
+  );
+}
 
-    // Date filter
-    if (dateStart || dateEnd) {
-      const photoDate = new Date(photo.uploadDate).toISOString().split("T")[0];
+// Placeholders
 
-      if (dateStart && photoDate < dateStart) return false;
-      if (dateEnd && photoDate > dateEnd) return false;
+// Drop the placeholder once the thumbnail has loaded, so it can't show
+// through transparent areas
+function clearPlaceholder(img) {
+  if (img.complete) {
+    img.style.backgroundImage = "";
+  } else {
+    img.addEventListener("load", () => (img.style.backgroundImage = ""), {
+      once: true,
+    });
+  }
+}
+
+const BLURHASH_DIGITS =
+  "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~";
+
+// Decoded placeholders by BlurHash and size, kept while the page is open
+const placeholderUrls = new Map();
+
+// A data URL of the photo's BlurHash decoded at its thumbnail's aspect ratio,
+// or "" when it has none
+function placeholderUrl(photo) {
+  if (!photo.placeholder) return "";
+
+  const thumbnail = photo.thumbnailDimensions || {};
+  const height =
+    thumbnail.width && thumbnail.height
+      ? Math.max(1, Math.round((PLACEHOLDER_WIDTH * thumbnail.height) / thumbnail.width))
+      : PLACEHOLDER_WIDTH;
+  const cacheKey = `${photo.placeholder}:${height}`;
+
+  if (!placeholderUrls.has(cacheKey)) {
+    const pixels = decodeBlurHash(photo.placeholder, PLACEHOLDER_WIDTH, height);
+    let url = "";
+    if (pixels) {
+      const canvas = document.createElement("canvas");
+      canvas.width = PLACEHOLDER_WIDTH;
+      canvas.height = height;
+      canvas.getContext("2d").putImageData(pixels, 0, 0);
+      url = canvas.toDataURL();
     }
+    placeholderUrls.set(cacheKey, url);
+  }
+  return placeholderUrls.get(cacheKey);
+}
 
-    return true;
-  });
+// ImageData for a BlurHash (https://blurha.sh), or null when it is malformed
+function decodeBlurHash(hash, width, height) {
+  const decode83 = (text) =>
+    [...text].reduce((value, digit) => value * 83 + BLURHASH_DIGITS.indexOf(digit), 0);
+  const toLinear = (value) => {
+    const v = value / 255;
+    return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+  };
+  const toSrgb = (value) => {
+    const v = Math.max(0, Math.min(1, value));
+    return v <= 0.0031308
+      ? Math.trunc(v * 12.92 * 255 + 0.5)
+      : Math.trunc((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255 + 0.5);
+  };
+
+  if (!hash || hash.length < 6) return null;
+  const sizeFlag = decode83(hash[0]);
+  const componentsX = (sizeFlag % 9) + 1;
+  const componentsY = Math.floor(sizeFlag / 9) + 1;
+  if (hash.length !== 4 + 2 * componentsX * componentsY) return null;
+
+  const maximum = (decode83(hash[1]) + 1) / 166;
+  const dc = decode83(hash.slice(2, 6));
+  const colors = [[toLinear(dc >> 16), toLinear((dc >> 8) & 255), toLinear(dc & 255)]];
+  for (let i = 1; i < componentsX * componentsY; i++) {
+    const value = decode83(hash.slice(4 + i * 2, 6 + i * 2));
+    colors.push(
+      [Math.floor(value / 361), Math.floor(value / 19) % 19, value % 19].map((q) => {
+        const v = (q - 9) / 9;
+        return Math.sign(v) * v * v * maximum;
+      })
+    );
+  }
+
+  // The basis is separable, so the cosines are computed once per row and column
+  const cosX = [];
+  for (let i = 0; i < componentsX; i++) {
+    cosX.push(Array.from({ length: width }, (_, x) => Math.cos((Math.PI * i * x) / width)));
+  }
+  const cosY = [];
+  for (let j = 0; j < componentsY; j++) {
+    cosY.push(Array.from({ length: height }, (_, y) => Math.cos((Math.PI * j * y) / height)));
+  }
+
+  const pixels = new ImageData(width, height);
+  for (let y = 0; y < height; y++) {
+    for (let x = 0; x < width; x++) {
+      let r = 0;
+      let g = 0;
+      let b = 0;
+      for (let j = 0; j < componentsY; j++) {
+        for (let i = 0; i < componentsX; i++) {
+          const basis = cosX[i][x] * cosY[j][y];
+          const color = colors[i + j * componentsX];
+          r += color[0] * basis;
+          g += color[1] * basis;
+          b += color[2] * basis;
+        }
+      }
+      const offset = 4 * (x + y * width);
+      pixels.data[offset] = toSrgb(r);
+      pixels.data[offset + 1] = toSrgb(g);
+      pixels.data[offset + 2] = toSrgb(b);
+      pixels.data[offset + 3] = 255;
+    }
+  }
+  return pixels;
+}
+
+// Filter Functions
+
+// The /photos query parameters for the current filter inputs
+function currentFilters() {
+  return {
+    q: document.getElementById("tag-search").value.trim(),
+    tag: document.getElementById("tag-filter").value.trim(),
+    from: document.getElementById("date-start").value,
+    to: document.getElementById("date-end").value,
+  };
+}
 
-  renderGallery();
+function applyFilters() {
+  clearTimeout(filterTimer);
+  loadGallery();
+}
+
+function scheduleFilters() {
+  clearTimeout(filterTimer);
+  filterTimer = setTimeout(applyFilters, FILTER_DEBOUNCE_MS);
+}
+
+// Tags typed into the upload form, comma separated
+function uploadTags() {
+  return document
+    .getElementById("photo-tags")
+    .value.split(",")
+    .map((tag) => tag.trim())
+    .filter((tag) => tag);
 }
 
 // Utility Functions
 
+function escapeHtml(text) {
+  const div = document.createElement("div");
+  div.textContent = text;
+  return div.innerHTML.replace(/"/g, "&quot;");
+}
+
 function formatDate(isoString) {
   const date = new Date(isoString);
   return date.toLocaleDateString("en-US", {
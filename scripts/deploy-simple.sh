@@ -29,6 +29,9 @@ echo "-------------------------------------------------------------"
 echo "Deploying Upload Handler..."
 cd lambda/upload_handler
 zip -q function.zip lambda_function.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-upload-handler \
@@ -49,7 +52,13 @@ echo "✓ Upload Handler deployed"
 # List Handler
 echo "Deploying List Handler..."
 cd lambda/list_photos
-zip -q function.zip lambda_function.py
+zip -q function.zip lambda_function.py response_encoding.py url_cache.py url_signer.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/gallery_manifest.py
+zip -qj function.zip ../common/s3_head.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/sprite_atlas.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-list-handler \
@@ -71,6 +80,13 @@ echo "✓ List Handler deployed"
 echo "Deploying Delete Handler..."
 cd lambda/delete_photo
 zip -q function.zip lambda_function.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/content_index.py
+zip -qj function.zip ../common/gallery_manifest.py
+zip -qj function.zip ../common/s3_head.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/sprite_atlas.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-delete-handler \
@@ -109,6 +125,12 @@ fi
 
 echo "API ID: $API_ID"
 
+# Let list_photos return gzip/br bodies (isBase64Encoded) as raw bytes
+aws apigateway update-rest-api \
+    --rest-api-id ${API_ID} \
+    --patch-operations op=add,path=/binaryMediaTypes/*~1* \
+    --region ${AWS_REGION} > /dev/null 2>&1 || true
+
 # Get root resource ID
 ROOT_ID=$(aws apigateway get-resources \
     --rest-api-id ${API_ID} \
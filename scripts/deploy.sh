@@ -56,7 +56,7 @@ cat > /tmp/upload-handler-policy.json << EOF
   "Version": "2012-10-17",
   "Statement": [{
     "Effect": "Allow",
-    "Action": ["s3:PutObject"],
+    "Action": ["s3:PutObject", "s3:AbortMultipartUpload", "s3:ListMultipartUploadParts"],
     "Resource": "arn:aws:s3:::${PHOTO_BUCKET}/*"
   }]
 }
@@ -85,7 +85,7 @@ cat > /tmp/thumbnail-generator-policy.json << EOF
   "Statement": [
     {
       "Effect": "Allow",
-      "Action": ["s3:GetObject"],
+      "Action": ["s3:GetObject", "s3:DeleteObject"],
       "Resource": "arn:aws:s3:::${PHOTO_BUCKET}/*"
     },
     {
@@ -95,7 +95,25 @@ cat > /tmp/thumbnail-generator-policy.json << EOF
     },
     {
       "Effect": "Allow",
-      "Action": ["dynamodb:PutItem"],
+      "Action": ["s3:GetObject", "s3:DeleteObject"],
+      "Resource": [
+        "arn:aws:s3:::${THUMBNAIL_BUCKET}/manifest/*",
+        "arn:aws:s3:::${THUMBNAIL_BUCKET}/atlas/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["s3:GetObject"],
+      "Resource": "arn:aws:s3:::${THUMBNAIL_BUCKET}/thumbnails/*"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["s3:ListBucket"],
+      "Resource": "arn:aws:s3:::${THUMBNAIL_BUCKET}"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:DeleteItem", "dynamodb:BatchWriteItem"],
       "Resource": "arn:aws:dynamodb:${AWS_REGION}:${AWS_ACCOUNT_ID}:table/${METADATA_TABLE}"
     }
   ]
@@ -125,8 +143,11 @@ cat > /tmp/list-handler-policy.json << EOF
   "Statement": [
     {
       "Effect": "Allow",
-      "Action": ["dynamodb:Scan"],
-      "Resource": "arn:aws:dynamodb:${AWS_REGION}:${AWS_ACCOUNT_ID}:table/${METADATA_TABLE}"
+      "Action": ["dynamodb:Query", "dynamodb:BatchGetItem"],
+      "Resource": [
+        "arn:aws:dynamodb:${AWS_REGION}:${AWS_ACCOUNT_ID}:table/${METADATA_TABLE}",
+        "arn:aws:dynamodb:${AWS_REGION}:${AWS_ACCOUNT_ID}:table/${METADATA_TABLE}/index/*"
+      ]
     },
     {
       "Effect": "Allow",
@@ -135,6 +156,11 @@ cat > /tmp/list-handler-policy.json << EOF
         "arn:aws:s3:::${PHOTO_BUCKET}/*",
         "arn:aws:s3:::${THUMBNAIL_BUCKET}/*"
       ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["s3:ListBucket"],
+      "Resource": "arn:aws:s3:::${THUMBNAIL_BUCKET}"
     }
   ]
 }
@@ -171,7 +197,25 @@ cat > /tmp/delete-handler-policy.json << EOF
     },
     {
       "Effect": "Allow",
-      "Action": ["dynamodb:GetItem", "dynamodb:DeleteItem"],
+      "Action": ["s3:GetObject", "s3:PutObject"],
+      "Resource": [
+        "arn:aws:s3:::${THUMBNAIL_BUCKET}/manifest/*",
+        "arn:aws:s3:::${THUMBNAIL_BUCKET}/atlas/*"
+      ]
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["s3:GetObject"],
+      "Resource": "arn:aws:s3:::${THUMBNAIL_BUCKET}/thumbnails/*"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["s3:ListBucket"],
+      "Resource": "arn:aws:s3:::${THUMBNAIL_BUCKET}"
+    },
+    {
+      "Effect": "Allow",
+      "Action": ["dynamodb:GetItem", "dynamodb:DeleteItem", "dynamodb:UpdateItem", "dynamodb:BatchGetItem", "dynamodb:BatchWriteItem"],
       "Resource": "arn:aws:dynamodb:${AWS_REGION}:${AWS_ACCOUNT_ID}:table/${METADATA_TABLE}"
     }
   ]
@@ -218,6 +262,9 @@ echo "--------------------------------------"
 echo "Deploying Upload Handler..."
 cd backend/upload_handler
 zip -q function.zip lambda_function.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-upload-handler \
@@ -238,7 +285,14 @@ echo "✓ Upload Handler deployed"
 # Thumbnail Generator
 echo "Deploying Thumbnail Generator..."
 cd backend/thumbnail_generator
-zip -q function.zip lambda_function.py
+zip -q function.zip lambda_function.py blurhash.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/content_index.py
+zip -qj function.zip ../common/gallery_manifest.py
+zip -qj function.zip ../common/s3_head.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/sprite_atlas.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-thumbnail-generator \
@@ -262,7 +316,13 @@ echo "✓ Thumbnail Generator deployed"
 # List Handler
 echo "Deploying List Handler..."
 cd backend/list_photos
-zip -q function.zip lambda_function.py
+zip -q function.zip lambda_function.py response_encoding.py url_cache.py url_signer.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/gallery_manifest.py
+zip -qj function.zip ../common/s3_head.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/sprite_atlas.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-list-handler \
@@ -284,6 +344,13 @@ echo "✓ List Handler deployed"
 echo "Deploying Delete Handler..."
 cd backend/delete_photo
 zip -q function.zip lambda_function.py
+zip -qj function.zip ../common/aws_clients.py
+zip -qj function.zip ../common/content_index.py
+zip -qj function.zip ../common/gallery_manifest.py
+zip -qj function.zip ../common/s3_head.py
+zip -qj function.zip ../common/search_index.py
+zip -qj function.zip ../common/sprite_atlas.py
+zip -qj function.zip ../common/instrumentation.py
 
 aws lambda create-function \
     --function-name photo-gallery-delete-handler \
@@ -319,6 +386,35 @@ echo ""THUMBNAIL_BUCKET}}" \
 
 cd ../..
 echo "✓ Delete Handler deployed"
+
+# Photos written before the gallery index existed lack its partition key, and
+# the builds below read that index; tag them first (nothing to do for a new
+# gallery, and a no-op on later deploys)
+echo "Tagging photos for the gallery index..."
+METADATA_TABLE_NAME=${METADATA_TABLE} AWS_DEFAULT_REGION=${AWS_REGION} \
+    PYTHONPATH=backend/common python3 backend/list_photos/backfill_gallery.py \
+    || echo "Photos not tagged (needs boto3); run backend/list_photos/backfill_gallery.py before the builds below"
+
+# list_photos serves pages from the gallery manifest once it exists; build it
+# from the metadata table (an empty manifest for a new gallery)
+echo "Building gallery manifest..."
+METADATA_TABLE_NAME=${METADATA_TABLE} MANIFEST_BUCKET_NAME=${THUMBNAIL_BUCKET} AWS_DEFAULT_REGION=${AWS_REGION} \
+    PYTHONPATH=backend/common python3 backend/common/gallery_manifest.py \
+    || echo "Manifest not built (needs boto3); photos are listed from DynamoDB until it is"
+
+# Filtered listings read the search index; index photos uploaded before it
+# existed (nothing to do for a new gallery)
+echo "Building search index..."
+METADATA_TABLE_NAME=${METADATA_TABLE} AWS_DEFAULT_REGION=${AWS_REGION} \
+    PYTHONPATH=backend/common python3 backend/common/search_index.py \
+    || echo "Search index not built (needs boto3); run backend/common/search_index.py before filtering older photos"
+
+# Sprite sheets for photos uploaded before the atlas existed (an empty atlas
+# for a new gallery); rebuilds the manifest too, so run it after that
+echo "Building sprite atlas..."
+METADATA_TABLE_NAME=${METADATA_TABLE} THUMBNAIL_BUCKET_NAME=${THUMBNAIL_BUCKET} MANIFEST_BUCKET_NAME=${THUMBNAIL_BUCKET} AWS_DEFAULT_REGION=${AWS_REGION} \
+    PYTHONPATH=backend/common python3 backend/common/sprite_atlas.py \
+    || echo "Sprite atlas not built (needs boto3 and Pillow); older photos load their own thumbnails until it is"
 echo ""
 
 echo "Step 4: Configuring S3 event notification..."
@@ -357,6 +453,42 @@ aws s3api put-bucket-notification-configuration \
     --notification-configuration file:///tmp/notification.json
 
 echo "✓ S3 event notification configured"
+
+# Browsers PUT multipart upload parts straight to the photo bucket and need the
+# ETag of each part to complete the upload
+cat > /tmp/photo-bucket-cors.json << EOF
+{
+  "CORSRules": [{
+    "AllowedOrigins": ["*"],
+    "AllowedMethods": ["POST", "PUT"],
+    "AllowedHeaders": ["*"],
+    "ExposeHeaders": ["ETag"],
+    "MaxAgeSeconds": 3000
+  }]
+}
+EOF
+
+aws s3api put-bucket-cors \
+    --bucket ${PHOTO_BUCKET} \
+    --cors-configuration file:///tmp/photo-bucket-cors.json
+
+# Parts of uploads that are never completed or resumed are billed until aborted
+cat > /tmp/photo-bucket-lifecycle.json << EOF
+{
+  "Rules": [{
+    "ID": "abort-incomplete-multipart-uploads",
+    "Status": "Enabled",
+    "Filter": {"Prefix": "photos/"},
+    "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 7}
+  }]
+}
+EOF
+
+aws s3api put-bucket-lifecycle-configuration \
+    --bucket ${PHOTO_BUCKET} \
+    --lifecycle-configuration file:///tmp/photo-bucket-lifecycle.json
+
+echo "✓ Photo bucket CORS and lifecycle configured"
 echo ""
 
 echo "Step 5: Creating API Gateway..."
@@ -375,6 +507,12 @@ API_ID=$(aws apigateway create-rest-api \
 
 echo "API ID: $API_ID"
 
+# Let list_photos return gzip/br bodies (isBase64Encoded) as raw bytes
+aws apigateway update-rest-api \
+    --rest-api-id ${API_ID} \
+    --patch-operations op=add,path=/binaryMediaTypes/*~1* \
+    --region ${AWS_REGION} > /dev/null 2>&1 || true
+
 # Get root resource ID
 ROOT_ID=$(aws apigateway get-resources \
     --rest-api-id ${API_ID} \
@@ -478,6 +616,38 @@ aws apigateway put-integration \
     --region ${AWS_REGION} \
     2>/dev/null || true
 
+# Create /photos/delete resource for bulk deletes
+BULK_DELETE_RESOURCE_ID=$(aws apigateway create-resource \
+    --rest-api-id ${API_ID} \
+    --parent-id ${PHOTOS_RESOURCE_ID} \
+    --path-part delete \
+    --region ${AWS_REGION} \
+    --query 'id' \
+    --output text 2>/dev/null || aws apigateway get-resources \
+    --rest-api-id ${API_ID} \
+    --region ${AWS_REGION} \
+    --query "items[?path=='/photos/delete'].id" \
+    --output text)
+
+# Create POST method for /photos/delete
+aws apigateway put-method \
+    --rest-api-id ${API_ID} \
+    --resource-id ${BULK_DELETE_RESOURCE_ID} \
+    --http-method POST \
+    --authorization-type NONE \
+    --region ${AWS_REGION} \
+    2>/dev/null || true
+
+aws apigateway put-integration \
+    --rest-api-id ${API_ID} \
+    --resource-id ${BULK_DELETE_RESOURCE_ID} \
+    --http-method POST \
+    --type AWS_PROXY \
+    --integration-http-method POST \
+    --uri arn:aws:apigateway:${AWS_REGION}:lambda:path/2015-03-31/functions/arn:aws:lambda:${AWS_REGION}:${AWS_ACCOUNT_ID}:function:photo-gallery-delete-handler/invocations \
+    --region ${AWS_REGION} \
+    2>/dev/null || true
+
 # Deploy API
 aws apigateway create-deployment \
     --rest-api-id ${API_ID} \